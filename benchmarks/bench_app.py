@@ -0,0 +1,348 @@
+"""Measure the latency of the main pages and forms on a synthetic dataset,
+and compare the results with those of an earlier run.
+
+    $ python benchmarks/bench_app.py --output before.json
+    $ python benchmarks/bench_app.py --compare before.json --threshold 0.1
+
+Each scenario is driven through the Flask test client against a fresh
+database filled by ``flask seed``. The report gives latency percentiles,
+the SQL statements run per request and the peak memory allocated while
+serving a request. With ``--compare``, the run fails if the median or
+90th percentile of a scenario grew by more than the threshold, or if it
+runs more statements per request than before.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# run from a checkout, whether the package is installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myblog import create_app
+from myblog.db import ConnectionPool
+from myblog.db import get_db
+from myblog.db import init_db
+from myblog.seed import seed
+
+SCENARIOS = ("index", "detail", "login", "create", "comment")
+
+_statements = 0
+
+
+def count_statements(connect):
+    """Wrap ``ConnectionPool.connect`` to count every statement run by
+    every connection, the writer's included.
+    """
+
+    def wrapped(self):
+        conn = connect(self)
+        conn.set_trace_callback(_count)
+        return conn
+
+    return wrapped
+
+
+def _count(statement):
+    global _statements
+    _statements += 1
+
+
+def csrf_token(client, path):
+    response = client.get(path)
+    match = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', response.data)
+    return match.group(1).decode()
+
+
+class Scenario:
+    """Requests of one kind, made by a client set up by :meth:`prepare`."""
+
+    def __init__(self, name, app, dataset, public_ids, rng, accept_encoding=None):
+        self.name = name
+        self.app = app
+        self.dataset = dataset
+        self.public_ids = public_ids
+        self.rng = rng
+        self.accept_encoding = accept_encoding
+        self.client = self.new_client()
+        self.token = None
+        self.prepare()
+
+    def new_client(self):
+        client = self.app.test_client()
+        if self.accept_encoding:
+            client.environ_base["HTTP_ACCEPT_ENCODING"] = self.accept_encoding
+        return client
+
+    def login(self):
+        user = self.rng.randrange(self.dataset["users"]) + self.dataset["first_user"]
+        token = csrf_token(self.client, "/auth/login")
+        self.client.post(
+            "/auth/login",
+            data={"username": f"user{user}", "password": "password", "csrf_token": token},
+        )
+
+    def blog_id(self):
+        return self.rng.choice(self.public_ids)
+
+    def prepare(self):
+        if self.name in ("create", "comment"):
+            self.login()
+        if self.name == "create":
+            self.token = csrf_token(self.client, "/create")
+        elif self.name == "comment":
+            self.token = csrf_token(self.client, "/%d/detail" % self.blog_id())
+
+    def before_request(self):
+        """Untimed set up of the next request."""
+        if self.name == "login":
+            # logging in clears the session, and the CSRF token with it
+            self.client = self.new_client()
+            self.token = csrf_token(self.client, "/auth/login")
+
+    @property
+    def expected_status(self):
+        return 200 if self.name in ("index", "detail") else 302
+
+    def request(self):
+        if self.name == "index":
+            return self.client.get("/")
+        if self.name == "detail":
+            return self.client.get("/%d/detail" % self.blog_id())
+        if self.name == "login":
+            user = self.rng.randrange(self.dataset["users"]) + self.dataset["first_user"]
+            return self.client.post(
+                "/auth/login",
+                data={
+                    "username": f"user{user}",
+                    "password": "password",
+                    "csrf_token": self.token,
+                },
+            )
+        if self.name == "create":
+            return self.client.post(
+                "/create",
+                data={"title": "Benchmark", "body": "x " * 500, "csrf_token": self.token},
+            )
+        return self.client.post(
+            "/%d/comment" % self.blog_id(),
+            data={"text": "Nice one", "csrf_token": self.token},
+        )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run(scenario, requests, warmup):
+    """Time ``requests`` requests of a scenario after ``warmup`` ones, then
+    measure the peak memory of a few more.
+    """
+    global _statements
+
+    for _ in range(warmup):
+        scenario.before_request()
+        scenario.request()
+
+    latencies = []
+    statements = 0
+    for _ in range(requests):
+        scenario.before_request()
+        _statements = 0
+        started = time.perf_counter()
+        response = scenario.request()
+        latencies.append(time.perf_counter() - started)
+        statements += _statements
+        if response.status_code != scenario.expected_status:
+            sys.exit(f"{scenario.name}: {response.status}")
+
+    peak = 0
+    tracemalloc.start()
+    for _ in range(min(requests, 20)):
+        scenario.before_request()
+        tracemalloc.reset_peak()
+        scenario.request()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        "requests": requests,
+        "mean_ms": statistics.fmean(milliseconds),
+        "p50_ms": percentile(milliseconds, 50),
+        "p90_ms": percentile(milliseconds, 90),
+        "p99_ms": percentile(milliseconds, 99),
+        "statements_per_request": statements / requests,
+        "peak_kib": peak / 1024,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each scenario since ``baseline`` and return the
+    regressions.
+    """
+    regressions = []
+    print()
+    print(f"{'scenario':<10} {'p50 before':>10} {'p50 now':>10} {'change':>8}")
+
+    for name, now in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+
+        change = now["p50_ms"] / before["p50_ms"] - 1
+        print(f"{name:<10} {before['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} {change:>+8.1%}")
+
+        for key in ("p50_ms", "p90_ms"):
+            if now[key] > before[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {before[key]:.2f} -> {now[key]:.2f}")
+        if now["statements_per_request"] > before["statements_per_request"]:
+            regressions.append(
+                f"{name}: statements per request {before['statements_per_request']:.1f}"
+                f" -> {now['statements_per_request']:.1f}"
+            )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--blogs", type=int, default=5000)
+    parser.add_argument("--comments", type=int, default=50000)
+    parser.add_argument("--public-ratio", type=float, default=0.8)
+    parser.add_argument("--body-words", type=int, default=300)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="turn off the response and fragment caches",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="turn on the request and SQL metrics, to measure their overhead",
+    )
+    parser.add_argument(
+        "--accept-encoding",
+        help="Accept-Encoding header of the requests, to measure compression",
+    )
+    parser.add_argument(
+        "--hash-method",
+        default="pbkdf2:sha256:50000",
+        help="password hash method; see bench_passwords.py for its cost",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="largest allowed latency growth, as a fraction",
+    )
+    args = parser.parse_args()
+
+    ConnectionPool.connect = count_statements(ConnectionPool.connect)
+    db_fd, db_path = tempfile.mkstemp(suffix=".sqlite")
+    config = {
+        "DATABASE": db_path,
+        "PASSWORD_HASH_METHOD": args.hash_method,
+        "PASSWORD_HASH_WORKERS": 0,
+        # the sources stand in for the unbuilt assets
+        "TESTING": True,
+        "ASSETS_SOURCES_FALLBACK": True,
+        # no background threads, their statements would be counted in the
+        # requests'
+        "OUTBOX_BACKGROUND": False,
+        "REPLICA_BACKGROUND": False,
+    }
+    if args.no_cache:
+        config.update(RESPONSE_CACHE=None, FRAGMENT_CACHE=False)
+    if args.metrics:
+        config.update(METRICS_ENABLED=True, SLOW_QUERY_SECONDS=60)
+    app = create_app(config)
+
+    dataset = {
+        "users": args.users,
+        "blogs": args.blogs,
+        "comments": args.comments,
+        "public_ratio": args.public_ratio,
+        "body_words": args.body_words,
+    }
+    started = time.perf_counter()
+    with app.app_context():
+        init_db()
+        first_user, first_blog, _ = seed(**dataset)
+        public_ids = [
+            row[0] for row in get_db().execute("SELECT id FROM blog WHERE public")
+        ]
+    print(f"seeded in {time.perf_counter() - started:.1f}s: {dataset}")
+    dataset["first_user"] = first_user
+
+    results = {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "dataset": dataset,
+        "config": {
+            "cache": not args.no_cache,
+            "metrics": args.metrics,
+            "hash_method": args.hash_method,
+            "accept_encoding": args.accept_encoding,
+        },
+        "scenarios": {},
+    }
+
+    print()
+    print(
+        f"{'scenario':<10} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8}"
+        f" {'stmts':>6} {'peak KiB':>9}"
+    )
+    try:
+        for name in args.scenario or SCENARIOS:
+            scenario = Scenario(
+                name, app, dataset, public_ids, random.Random(0), args.accept_encoding
+            )
+            result = run(scenario, args.requests, args.warmup)
+            results["scenarios"][name] = result
+            print(
+                f"{name:<10} {result['mean_ms']:>8.2f} {result['p50_ms']:>8.2f}"
+                f" {result['p90_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+                f" {result['statements_per_request']:>6.1f} {result['peak_kib']:>9.1f}"
+            )
+    finally:
+        os.close(db_fd)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print()
+            print("regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
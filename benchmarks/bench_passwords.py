@@ -0,0 +1,76 @@
+"""Measure how many password hashes per second each hashing
+configuration gives, on the request thread and through the process pool.
+
+    $ python benchmarks/bench_passwords.py
+    $ python benchmarks/bench_passwords.py --method pbkdf2:sha256:600000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+# run from a checkout, whether the package is installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from myblog.passwords import Hasher
+
+METHODS = (
+    "pbkdf2:sha256:50000",
+    "pbkdf2:sha256:260000",
+    "pbkdf2:sha256:600000",
+    "scrypt:32768:8:1",
+)
+
+
+def rate(hasher, threads, method, seconds):
+    """Hash from ``threads`` request-like threads for about ``seconds``
+    seconds and return the hashes per second.
+    """
+    deadline = time.perf_counter() + seconds
+
+    def work():
+        count = 0
+        while time.perf_counter() < deadline:
+            hasher.run(generate_password_hash, "password", method, 16)
+            count += 1
+        return count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        count = sum(executor.map(lambda _: work(), range(threads)))
+
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--method", action="append", help="hash method to measure")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        action="append",
+        help="pool size to measure, 0 for the request thread",
+    )
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    methods = args.method or METHODS
+    workers = args.workers or (0, os.cpu_count() or 1)
+
+    print(f"{'method':<24} {'workers':>7} {'hashes/s':>10}")
+    for count in workers:
+        threads = max(count, 1)
+        hasher = Hasher(count, threads, None)
+        try:
+            for method in methods:
+                hashes = rate(hasher, threads, method, args.seconds)
+                print(f"{method:<24} {count:>7} {hashes:>10.1f}")
+        finally:
+            hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,10 @@ def create_app(test_config=None):
         SECRET_KEY="dev",
         # store the database in the instance folder
         DATABASE=os.path.join(app.instance_path, "myblog.sqlite"),
+        # number of blogs on each page of the index
+        BLOGS_PER_PAGE=20,
+        # number of comments on each page of a blog's detail
+        COMMENTS_PER_PAGE=20,
     )
 
     if test_config is None:
@@ -27,15 +31,52 @@ def create_app(test_config=None):
         pass
 
     # register the database commands
-    from myblog import db
+    from myblog import db, identity, replica, writer
 
     db.init_app(app)
+    identity.init_app(app)
+    writer.init_app(app)
+    replica.init_app(app)
+
+    # register the caches, HTTP caching, static assets, metrics and
+    # profiler settings
+    from myblog import assets, cache, conditional, metrics, profiler
+
+    assets.init_app(app)
+    cache.init_app(app)
+    conditional.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
 
     # apply the blueprints to the app
-    from myblog import auth, blog
+    from myblog import (
+        api,
+        auth,
+        blog,
+        form,
+        outbox,
+        passwords,
+        render,
+        search,
+        seed,
+        serve,
+        transfer,
+    )
 
+    api.init_app(app)
+    auth.init_app(app)
+    form.init_app(app)
+    outbox.init_app(app)
+    passwords.init_app(app)
+    render.init_app(app)
+    search.init_app(app)
+    seed.init_app(app)
+    serve.init_app(app)
+    transfer.init_app(app)
+    app.register_blueprint(api.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    app.register_blueprint(search.bp)
 
     # make url_for('index') == url_for('blog.index')
     # in another app, you might define a separate main index here with
@@ -43,4 +84,9 @@ def create_app(test_config=None):
     # the tutorial the blog will be the main index
     app.add_url_rule("/", endpoint="index")
 
+    # compress the responses, around everything else
+    from myblog import compress
+
+    compress.init_app(app)
+
     return app
@@ -0,0 +1,237 @@
+import datetime
+import json
+
+from flask import Blueprint
+from flask import current_app
+from flask import g
+from flask import request
+from flask import stream_with_context
+from werkzeug.exceptions import abort
+
+from myblog.blog import blog_comments
+from myblog.blog import get_blog
+from myblog.blog import visible_blogs
+from myblog.pagination import decode_cursor
+from myblog.pagination import encode_cursor
+from myblog.replica import get_read_db
+
+bp = Blueprint("api", __name__, url_prefix="/api")
+
+# the fields clients may ask for, and the column each is read from
+BLOG_FIELDS = {
+    "id": "p.id",
+    "title": "p.title",
+    "body": "p.body",
+    "author_id": "p.author_id",
+    "author": "u.username AS author",
+    "public": "p.public",
+    "created": "p.created",
+    "updated": "p.updated",
+    "comment_count": "p.comment_count",
+}
+COMMENT_FIELDS = {
+    "id": "c.id",
+    "blog_id": "c.blog_id",
+    "author_id": "c.author_id",
+    "text": "c.text",
+    "created": "c.created",
+}
+
+MIMETYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(record):
+    return json.dumps(record, default=_default, separators=(",", ":"))
+
+
+def parse_fields(available, key_fields):
+    """Get the fields listed by the ``fields`` argument, all of them by
+    default.
+
+    :param available: the :data:`BLOG_FIELDS` or :data:`COMMENT_FIELDS`
+    :param key_fields: fields that are always selected, since the cursor
+        is made from them, even if they are not sent
+    :return: the names of the fields to send and the select list
+    :raise 400: if a field is unknown
+    """
+    names = request.args.get("fields")
+    if names is None:
+        fields = list(available)
+    else:
+        fields = [name.strip() for name in names.split(",") if name.strip()]
+        unknown = [name for name in fields if name not in available]
+        if unknown or not fields:
+            abort(400, f"Unknown fields: {', '.join(unknown) or '(none)'}.")
+
+    columns = [available[name] for name in dict.fromkeys(key_fields + fields)]
+    return fields, ", ".join(columns)
+
+
+def parse_start():
+    """Get the key to resume from: the one in the ``cursor`` argument, or
+    else the time in ``updated_since``, as an ISO 8601 timestamp in UTC
+    unless it has an offset.
+
+    :return: a ``(timestamp, id)`` key to seek past, or ``None``
+    :raise 400: if either argument is malformed
+    """
+    token = request.args.get("cursor")
+    if token:
+        direction, start = decode_cursor(token)
+        if direction != "next":
+            abort(400, "Invalid cursor.")
+        return start
+
+    since = request.args.get("updated_since")
+    if since:
+        try:
+            since = datetime.datetime.fromisoformat(since)
+        except ValueError:
+            abort(400, "Invalid updated_since timestamp.")
+
+        if since.tzinfo is not None:
+            since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+        # timestamps are stored as "YYYY-MM-DD HH:MM:SS", and every row
+        # at or after the time sorts after id 0
+        return str(since), 0
+
+    return None
+
+
+def parse_limit():
+    """Get the ``limit`` argument, ``None`` to send every row."""
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        abort(400, "The limit must be a positive number.")
+
+    return limit
+
+
+def stream(name, rows, fields, key, limit):
+    """Make the response streaming ``rows`` as they are read.
+
+    The format is NDJSON, one object per line, if the ``format`` argument
+    or the ``Accept`` header asks for it, and otherwise a JSON object
+    with the ``name`` array and ``next_cursor``. When ``limit`` cuts the
+    rows short, the cursor to resume from is sent as ``next_cursor``,
+    which in NDJSON is the object on the last line.
+
+    :param rows: a cursor yielding up to ``limit + 1`` rows
+    :param fields: names of the fields to send
+    :param key: function returning the sort key of a row
+    """
+    format = request.args.get("format")
+    if format is None:
+        best = request.accept_mimetypes.best_match(
+            [MIMETYPES["json"], MIMETYPES["ndjson"]], MIMETYPES["json"]
+        )
+        format = "ndjson" if best == MIMETYPES["ndjson"] else "json"
+    elif format not in MIMETYPES:
+        abort(400, "The format must be json or ndjson.")
+
+    chunk_rows = current_app.config["API_CHUNK_ROWS"]
+
+    def generate():
+        sent = 0
+        last = None
+        more = False
+
+        if format == "json":
+            yield '{"%s":[' % name
+
+        while not more:
+            batch = rows.fetchmany(chunk_rows)
+            if not batch:
+                break
+
+            if limit is not None and sent + len(batch) > limit:
+                batch = batch[: limit - sent]
+                more = True
+                if not batch:
+                    break
+
+            records = [dumps({field: row[field] for field in fields}) for row in batch]
+            if format == "ndjson":
+                yield "".join(record + "\n" for record in records)
+            else:
+                yield ("\n" if not sent else ",\n") + ",\n".join(records)
+
+            sent += len(batch)
+            last = batch[-1]
+
+        rows.close()
+        next_cursor = encode_cursor("next", key(last)) if more else None
+
+        if format == "json":
+            yield '\n],"next_cursor":%s}\n' % dumps(next_cursor)
+        elif next_cursor is not None:
+            yield dumps({"next_cursor": next_cursor}) + "\n"
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype=MIMETYPES[format]
+    )
+
+
+@bp.route("/blogs")
+def blogs():
+    """Stream the blogs visible to the current user, least recently
+    updated first, so that a client can sync by resuming from the last
+    blog it got.
+
+    Query arguments:
+
+    - ``fields``: comma separated fields to send, all by default
+    - ``updated_since``: only blogs updated at or after this time
+    - ``cursor``: the ``next_cursor`` of a previous response
+    - ``limit``: maximum number of blogs, all by default
+    - ``format``: ``json`` or ``ndjson``
+    """
+    fields, columns = parse_fields(BLOG_FIELDS, ["id", "updated"])
+    start = parse_start()
+    limit = parse_limit()
+    user_id = g.user["id"] if g.user else None
+
+    # the "prev" walk of the index listing is oldest first
+    sql, params = visible_blogs(
+        user_id, columns, "prev", start, None if limit is None else limit + 1
+    )
+    rows = get_read_db().execute(sql, params)
+    return stream("blogs", rows, fields, lambda row: (row["updated"], row["id"]), limit)
+
+
+@bp.route("/blogs/<int:blog_id>/comments")
+def comments(blog_id):
+    """Stream the comments of a blog visible to the current user, oldest
+    first. It takes the same arguments as :func:`blogs`; since comments
+    are not edited, ``updated_since`` is their creation time.
+    """
+    db = get_read_db()
+    get_blog(blog_id, check_author=False, db=db)
+
+    fields, columns = parse_fields(COMMENT_FIELDS, ["id", "created"])
+    start = parse_start()
+    limit = parse_limit()
+
+    sql, params = blog_comments(
+        blog_id, columns, "prev", start, None if limit is None else limit + 1
+    )
+    rows = db.execute(sql, params)
+    return stream(
+        "comments", rows, fields, lambda row: (row["created"], row["id"]), limit
+    )
+
+
+def init_app(app):
+    """Register the API settings with the Flask app. This is called by
+    the application factory.
+    """
+    # rows read from the database and sent per chunk of a response
+    app.config.setdefault("API_CHUNK_ROWS", 100)
@@ -0,0 +1,373 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.parse
+import urllib.request
+
+import click
+from flask import current_app
+from flask import request
+from flask import send_from_directory
+from flask import url_for
+from flask.cli import with_appcontext
+from werkzeug.utils import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the files of each bundle, in order: URLs are downloaded once into the
+# "vendor" folder of the static folder, other entries are paths in it
+BUNDLES = {
+    "vendor.css": (
+        "https://maxcdn.bootstrapcdn.com/bootstrap/3.4.0/css/bootstrap.min.css",
+        "https://maxcdn.bootstrapcdn.com/bootstrap/3.4.0/css/bootstrap-theme.min.css",
+        "https://code.jquery.com/ui/1.12.1/themes/ui-lightness/jquery-ui.min.css",
+        "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.13.0/css/all.min.css",
+        "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.13.0/css/v4-shims.min.css",
+    ),
+    "vendor.js": (
+        "https://ajax.googleapis.com/ajax/libs/jquery/3.3.1/jquery.min.js",
+        "https://maxcdn.bootstrapcdn.com/bootstrap/3.4.0/js/bootstrap.min.js",
+        "https://code.jquery.com/ui/1.12.1/jquery-ui.min.js",
+    ),
+    "app.css": ("style.css",),
+    "app.js": ("app.js",),
+}
+
+# folder of the built files in the static folder, served forever
+DIST = "dist"
+
+# types worth precompressing; images and web fonts are compressed already
+_COMPRESSIBLE = (".css", ".js", ".json", ".svg", ".ttf", ".eot", ".otf", ".txt")
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_SOURCE_MAP = re.compile(rb"/[*/]# sourceMappingURL=[^\n]*?(\*/|$)", re.M)
+
+
+def _is_url(source):
+    return source.startswith(("http://", "https://"))
+
+
+def vendor_path(static_folder, url):
+    """Where the download of ``url`` is kept in the static folder."""
+    parts = urllib.parse.urlsplit(url)
+    return os.path.join(static_folder, "vendor", parts.netloc, *parts.path.split("/"))
+
+
+def fetch(static_folder, source, refresh=False):
+    """Read a source file, downloading it first if it is a URL that
+    wasn't vendored yet.
+    """
+    if not _is_url(source):
+        with open(os.path.join(static_folder, source), "rb") as f:
+            return f.read()
+
+    path = vendor_path(static_folder, source)
+    if refresh or not os.path.exists(path):
+        with urllib.request.urlopen(source, timeout=30) as response:
+            data = response.read()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return data
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Builder:
+    """Writes fingerprinted files, with their precompressed variants, to
+    the ``dist`` folder of the static folder.
+    """
+
+    def __init__(self, static_folder, static_url_path, refresh=False):
+        self.static_folder = static_folder
+        self.static_url_path = static_url_path
+        self.folder = os.path.join(static_folder, DIST)
+        self.refresh = refresh
+        self.written = set()
+        self._resources = {}
+
+    def write(self, name, data):
+        """Write ``data`` under ``name`` with its hash in the name.
+
+        :return: the name of the file in the ``dist`` folder
+        """
+        stem, ext = posixpath.splitext(posixpath.basename(name))
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        filename = f"{stem}.{digest}{ext}"
+        path = os.path.join(self.folder, filename)
+
+        if not os.path.exists(path):
+            os.makedirs(self.folder, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+            if ext in _COMPRESSIBLE:
+                variants = [(".gz", gzip.compress(data, 9, mtime=0))]
+                if brotli is not None:
+                    variants.append((".br", brotli.compress(data, quality=11)))
+
+                for suffix, compressed in variants:
+                    # not worth it for tiny files
+                    if len(compressed) < len(data):
+                        with open(path + suffix, "wb") as f:
+                            f.write(compressed)
+
+        self.written.update((filename, filename + ".gz", filename + ".br"))
+        return filename
+
+    def resource(self, css_source, reference):
+        """Copy a file referenced by ``url()`` in the CSS ``css_source``.
+
+        :return: its new name, or ``None`` to leave the reference as it is
+        """
+        target, suffix = re.match(r"([^?#]*)(.*)", reference).groups()
+        if not target or target.startswith(("data:", "about:")):
+            return None
+
+        if _is_url(css_source):
+            source = urllib.parse.urljoin(css_source, target)
+        elif _is_url(target) or target.startswith("//"):
+            return None
+        elif target.startswith("/"):
+            prefix = self.static_url_path.rstrip("/") + "/"
+            if not target.startswith(prefix):
+                return None
+            source = target[len(prefix) :]
+        else:
+            source = posixpath.normpath(
+                posixpath.join(posixpath.dirname(css_source), target)
+            )
+
+        if source not in self._resources:
+            data = fetch(self.static_folder, source, self.refresh)
+            self._resources[source] = self.write(source, data)
+
+        return self._resources[source] + suffix
+
+    def bundle(self, name, sources):
+        """Concatenate ``sources`` into one file, copying the files their
+        CSS refers to next to it.
+
+        :return: the name of the bundle in the ``dist`` folder
+        """
+        is_css = name.endswith(".css")
+        parts = []
+
+        for source in sources:
+            data = _SOURCE_MAP.sub(b"", fetch(self.static_folder, source, self.refresh))
+
+            if is_css:
+
+                def rewrite(match):
+                    new = self.resource(source, match.group(2).strip())
+                    return match.group(0) if new is None else f'url("{new}")'
+
+                data = _CSS_URL.sub(rewrite, data.decode("utf8")).encode("utf8")
+
+            parts.append(data.strip())
+
+        # a script lacking its final semicolon must not run into the next
+        return self.write(name, (b"\n" if is_css else b";\n").join(parts) + b"\n")
+
+
+def build(bundles, static_folder, static_url_path, refresh=False):
+    """Build each bundle and write the manifest mapping their names to
+    the built files. The files of the previous build are kept, for the
+    pages served before it, and older ones are deleted.
+
+    :return: the path of each bundle in the static folder, by name
+    """
+    builder = Builder(static_folder, static_url_path, refresh)
+    paths = {
+        name: f"{DIST}/{builder.bundle(name, sources)}"
+        for name, sources in bundles.items()
+    }
+
+    os.makedirs(builder.folder, exist_ok=True)
+    manifest_path = os.path.join(builder.folder, "manifest.json")
+    previous = _read_manifest(manifest_path) or {"files": []}
+    keep = builder.written | set(previous["files"]) | {"manifest.json"}
+
+    temporary = manifest_path + ".tmp"
+    with open(temporary, "w", encoding="utf8") as f:
+        json.dump({"bundles": paths, "files": sorted(builder.written)}, f, indent=2)
+    os.replace(temporary, manifest_path)
+
+    for filename in os.listdir(builder.folder):
+        if filename not in keep:
+            os.remove(os.path.join(builder.folder, filename))
+
+    return paths
+
+
+def _read_manifest(path):
+    try:
+        with open(path, encoding="utf8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def get_manifest():
+    """Get the built bundles, read again whenever a build replaces the
+    manifest. Empty if the assets were never built.
+    """
+    path = os.path.join(current_app.static_folder, DIST, "manifest.json")
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return {}
+
+    cached = current_app.extensions.get("myblog.assets")
+    if cached is None or cached[0] != (path, mtime):
+        manifest = _read_manifest(path) or {"bundles": {}}
+        cached = ((path, mtime), manifest["bundles"])
+        current_app.extensions["myblog.assets"] = cached
+
+    return cached[1]
+
+
+def sources_fallback():
+    """Whether pages load the sources of the bundles that aren't built,
+    as ``ASSETS_SOURCES_FALLBACK`` says, by default in debug and testing.
+    """
+    fallback = current_app.config["ASSETS_SOURCES_FALLBACK"]
+    if fallback is None:
+        return current_app.debug or current_app.testing
+
+    return fallback
+
+
+def check_assets(app):
+    """Make sure the pages of ``app`` can load their assets: every bundle
+    is built, or :func:`sources_fallback` allows loading the sources.
+
+    :raise RuntimeError: naming the bundles that aren't built
+    """
+    with app.app_context():
+        if sources_fallback():
+            return
+
+        manifest = get_manifest()
+        missing = [
+            name for name in app.config["ASSETS_BUNDLES"] if name not in manifest
+        ]
+
+    if missing:
+        raise RuntimeError(
+            f"The {', '.join(missing)} bundles aren't built. Run 'flask"
+            " assets-build', or set ASSETS_SOURCES_FALLBACK = True to load"
+            " their sources and CDNs."
+        )
+
+
+def asset_urls(name):
+    """The URLs to load a bundle from: its fingerprinted file once it was
+    built by ``flask assets-build``, otherwise each of its sources.
+
+    ``flask serve`` refuses to start without the build, unless
+    :func:`sources_fallback` allows the sources; an app served otherwise
+    logs it once, then loads the sources.
+    """
+    path = get_manifest().get(name)
+    if path is not None:
+        return [url_for("static", filename=path)]
+
+    logged = "myblog.assets.unbuilt" in current_app.extensions
+    if not sources_fallback() and not logged:
+        current_app.extensions["myblog.assets.unbuilt"] = True
+        current_app.logger.error(
+            "The %r bundle isn't built, loading its sources. Run"
+            " 'flask assets-build'.",
+            name,
+        )
+
+    return [
+        source if _is_url(source) else url_for("static", filename=source)
+        for source in current_app.config["ASSETS_BUNDLES"][name]
+    ]
+
+
+def static_view(filename):
+    """Serve a static file. The fingerprinted files never change, so they
+    are cached for ``ASSETS_MAX_AGE``, and served precompressed to the
+    clients accepting it.
+    """
+    if not filename.startswith(DIST + "/"):
+        return current_app.send_static_file(filename)
+
+    folder = current_app.static_folder
+    max_age = current_app.config["ASSETS_MAX_AGE"]
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = None
+
+    for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[coding]:
+            path = safe_join(folder, filename + suffix)
+            if path is not None and os.path.isfile(path):
+                response = send_from_directory(
+                    folder, filename + suffix, mimetype=mimetype, max_age=max_age
+                )
+                response.headers["Content-Encoding"] = coding
+                break
+
+    if response is None:
+        response = send_from_directory(folder, filename, max_age=max_age)
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@click.command("assets-build")
+@click.option("--refresh", is_flag=True, help="Download the vendored files again.")
+@with_appcontext
+def assets_build_command(refresh):
+    """Bundle, fingerprint and precompress the static assets."""
+    # the path the static view is mounted on, which the CSS may refer to
+    rule = next(current_app.url_map.iter_rules("static")).rule
+    try:
+        paths = build(
+            current_app.config["ASSETS_BUNDLES"],
+            current_app.static_folder,
+            rule.partition("<")[0],
+            refresh,
+        )
+    except OSError as e:
+        raise click.ClickException(f"Could not build the assets: {e}")
+
+    for name, path in paths.items():
+        click.echo(f"{name}: {path}")
+
+    if brotli is None:
+        click.echo("Brotli is not installed, only gzip variants were made.")
+
+
+def init_app(app):
+    """Register the asset settings, the ``asset_urls`` template global,
+    the build command and the static view with the Flask app. This is
+    called by the application factory.
+    """
+    # the bundles built by "flask assets-build"
+    app.config.setdefault("ASSETS_BUNDLES", BUNDLES)
+    # seconds the fingerprinted files are cached by clients
+    app.config.setdefault("ASSETS_MAX_AGE", 365 * 24 * 3600)
+    # whether pages load the sources of the bundles, CDNs included, while
+    # they aren't built; None allows it in debug and testing only, so
+    # "flask serve" refuses to start a deployment that skipped the build
+    app.config.setdefault("ASSETS_SOURCES_FALLBACK", None)
+
+    app.add_template_global(asset_urls)
+    app.cli.add_command(assets_build_command)
+
+    if app.has_static_folder:
+        app.view_functions["static"] = static_view
@@ -1,22 +1,36 @@
 import functools
+import os
+import sqlite3
+import threading
 
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
+from flask import has_request_context
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from flask.ctx import _AppCtxGlobals
+from werkzeug.exceptions import abort
 
+from myblog.cache import MemoryCache
 from myblog.db import get_db
+from myblog.outbox import enqueue
+from myblog.passwords import HasherBusy
+from myblog.passwords import check_password
+from myblog.passwords import hash_password
+from myblog.passwords import needs_rehash
+from myblog.writer import execute_write
 
 from myblog.form import LoginForm, RegistrationForm, ForgotForm
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+_user_cache_lock = threading.Lock()
+
 
 def login_required(view):
     """View decorator that redirects anonymous users to the login page."""
@@ -31,18 +45,79 @@ def login_required(view):
     return wrapped_view
 
 
-@bp.before_app_request
+class AppGlobals(_AppCtxGlobals):
+    """The ``g`` object, loading ``g.user`` the first time it is read, so
+    that only requests which look at the user pay for it.
+    """
+
+    def __getattr__(self, name):
+        if name == "user":
+            self.user = load_logged_in_user()
+            return self.user
+
+        return super().__getattr__(name)
+
+
+def get_user_cache():
+    """Get the cache of user records of the current app in this process."""
+    cache = current_app.extensions.get("myblog.user_cache")
+
+    if cache is None or cache[0] != os.getpid():
+        with _user_cache_lock:
+            cache = current_app.extensions.get("myblog.user_cache")
+
+            if cache is None or cache[0] != os.getpid():
+                # each record counts as one unit against the size
+                backend = MemoryCache(
+                    current_app.config["USER_CACHE_SIZE"], sizeof=lambda user: 1
+                )
+                cache = (os.getpid(), backend)
+                current_app.extensions["myblog.user_cache"] = cache
+
+    return cache[1]
+
+
+def get_user(user_id):
+    """Get the id, username and email of a user, from the user cache when
+    possible. The password hash is never part of it.
+
+    :return: the user as a dict, or ``None`` if there is no such user
+    """
+    cache = get_user_cache()
+    user = cache.get(user_id)
+
+    if user is None:
+        row = get_db().execute(
+            "SELECT id, username, email FROM user WHERE id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        user = dict(row)
+        cache.set(user_id, user, current_app.config["USER_CACHE_TTL"])
+
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user from the user cache after its username or email has
+    been changed. Only the cache of this process is reached, the other
+    processes keep the record until ``USER_CACHE_TTL`` expires.
+    """
+    get_user_cache().delete(user_id)
+
+
 def load_logged_in_user():
-    """If a user id is stored in the session, load the user object from
-    the database into ``g.user``."""
+    """If a user id is stored in the session, load the user object."""
+    if not has_request_context():
+        return None
+
     user_id = session.get("user_id")
 
     if user_id is None:
-        g.user = None
-    else:
-        g.user = (
-            get_db().execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
-        )
+        return None
+
+    return get_user(user_id)
 
 
 @bp.route("/register", methods=("GET", "POST"))
@@ -82,17 +157,26 @@ def register():
             # the login page
 
             """
-            Here the salting technique is used to hash the password using 
-            the method pbkdf2:sha256 with salt length = 8 that is the default 
-            values of the werkzeug.security.generate_password_hash method 
-            as you can see in https://werkzeug.palletsprojects.com/en/1.0.x/utils/
+            Here the salting technique is used to hash the password using
+            the method and salt length set by PASSWORD_HASH_METHOD and
+            PASSWORD_SALT_LENGTH, off the request thread, see
+            myblog.passwords
             """
-            db.execute(
-                "INSERT INTO user (username, email, password) VALUES (?, ?, ?)",
-                (username, email, generate_password_hash(password)),
-            )
-            db.commit()
-            return redirect(url_for("auth.login"))
+            try:
+                password_hash = hash_password(password)
+            except HasherBusy:
+                abort(503, "Too many signups at once, please try again.")
+
+            try:
+                execute_write(
+                    "INSERT INTO user (username, email, password) VALUES (?, ?, ?)",
+                    (username, email, password_hash),
+                )
+            except sqlite3.IntegrityError:
+                # someone else took the name or email since it was checked
+                error = f"User {username} or email {email} is already registered."
+            else:
+                return redirect(url_for("auth.login"))
 
         flash(error)
     elif request.method == "POST" and not form.validate():
@@ -116,10 +200,20 @@ def login():
             "SELECT * FROM user WHERE username = ?", (username,)
         ).fetchone()
 
-        if user is None:
-            error = "Incorrect username."
-        elif not check_password_hash(user["password"], password):
-            error = "Incorrect password."
+        try:
+            if user is None:
+                error = "Incorrect username."
+            elif not check_password(user["password"], password):
+                error = "Incorrect password."
+            elif needs_rehash(user["password"]):
+                # upgrade the stored hash to the configured method and cost
+                # now that the password is known
+                execute_write(
+                    "UPDATE user SET password = ? WHERE id = ?",
+                    (hash_password(password), user["id"]),
+                )
+        except HasherBusy:
+            abort(503, "Too many logins at once, please try again.")
 
         if error is None:
             # store the user id in a new session and return to the index
@@ -148,11 +242,17 @@ def forgot():
             error = f"The email {email} is not registered."
 
         if error is None:
-            # create new session, send email to recover credentials and return to the index
+            # create new session, queue the email to recover credentials and
+            # return to the index; the outbox worker sends it
             session.clear()
-
-            # here the code to send recover email ....
-            print("\t \t Sending recovery email.....")
+            enqueue(
+                "mail",
+                {
+                    "to": user["email"],
+                    "subject": "Your myblog account",
+                    "body": render_template("auth/recovery.txt", user=user),
+                },
+            )
 
             return redirect(url_for("index"))
 
@@ -170,3 +270,13 @@ def logout():
     """Clear the current session, including the stored user id."""
     session.clear()
     return redirect(url_for("index"))
+
+
+def init_app(app):
+    """Register the lazily loaded ``g.user`` and the user cache settings
+    with the Flask app. This is called by the application factory.
+    """
+    app.app_ctx_globals_class = AppGlobals
+    # seconds a user record is cached, and how many are kept
+    app.config.setdefault("USER_CACHE_TTL", 300)
+    app.config.setdefault("USER_CACHE_SIZE", 10000)
@@ -1,4 +1,8 @@
+import datetime
+import time
+
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
 from flask import redirect
@@ -6,10 +10,20 @@ from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
+from markupsafe import Markup
 from werkzeug.exceptions import abort
 
 from myblog.auth import login_required
+from myblog.cache import cache_anonymous
+from myblog.cache import invalidate
+from myblog.conditional import conditional
 from myblog.db import get_db
+from myblog.identity import get_identity_map
+from myblog.pagination import paginate
+from myblog.render import derive
+from myblog.render import render_html
+from myblog.replica import get_read_db
+from myblog.writer import execute_write
 
 from myblog.form import (
     CreateBlogForm, CreateCommentForm, DeleteBlogForm, DeleteCommentForm
@@ -17,32 +31,105 @@ from myblog.form import (
 
 bp = Blueprint("blog", __name__)
 
+# a blog is visible to everyone if it is public, and to its author always;
+# the single parameter is the current user's id, or None if anonymous
+VISIBLE = "(p.public = 1 OR p.author_id = ?)"
+
+
+def visible_blogs(user_id, columns, direction="next", start=None, limit=None):
+    """Build the query selecting ``columns`` of every blog ``user_id`` may
+    read, most recently updated first.
+
+    Anonymous visitors only see public blogs. A logged in user also sees
+    their own private blogs, which are selected by a second ``UNION ALL``
+    arm. Each arm walks the ``(public, updated)`` or ``(author_id,
+    updated)`` index in order and SQLite merges them, so neither a full
+    scan nor a temporary sort is needed.
+
+    :param user_id: id of the current user, or ``None`` if anonymous
+    :param columns: select list over ``blog p JOIN user u``, which must
+        include ``p.id`` and ``p.updated`` to order the arms by
+    :param direction: ``"next"`` to walk towards older blogs, ``"prev"``
+        to walk back towards newer ones (in oldest first order)
+    :param start: ``(updated, id)`` key to seek past, or ``None``
+    :param limit: maximum number of rows, or ``None`` for all of them
+    :return: the SQL string and its parameters
+    """
+    arm = f"SELECT {columns} FROM blog p JOIN user u ON p.author_id = u.id WHERE "
+    seek = ""
+    seek_params = []
+    if start is not None:
+        seek = " AND (p.updated, p.id) %s (?, ?)" % ("<" if direction == "next" else ">")
+        seek_params = list(start)
+
+    sql = arm + "p.public = 1" + seek
+    params = list(seek_params)
+
+    if user_id is not None:
+        sql += " UNION ALL " + arm + "p.author_id = ? AND p.public = 0" + seek
+        params += [user_id] + seek_params
+
+    order = "DESC" if direction == "next" else "ASC"
+    sql += f" ORDER BY p.updated {order}, p.id {order}"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return sql, params
+
+
+def blog_key(blog):
+    """Sort key of a blog in the listing, as stored in its cursors."""
+    return blog["updated"], blog["id"]
+
+
+def blog_page(columns, db):
+    """Load the page of blogs visible to the current user that the
+    request's ``cursor`` argument points at.
+
+    :param columns: select list for :func:`visible_blogs`
+    :param db: connection to read from
+    :return: a :class:`~myblog.pagination.Page`
+    """
+    user_id = g.user["id"] if g.user else None
+
+    def fetch(direction, start, limit):
+        sql, params = visible_blogs(user_id, columns, direction, start, limit)
+        return db.execute(sql, params).fetchall()
+
+    return paginate(
+        fetch, request.args.get("cursor"), current_app.config["BLOGS_PER_PAGE"], blog_key
+    )
+
+
+def index_validators():
+    """The keys and comment counts of the blogs on the requested index
+    page, which only changes when one of them is added, edited, removed
+    or commented on.
+    """
+    page = blog_page("p.id, p.updated, p.comment_count", get_read_db())
+    parts = [tuple(blog) for blog in page] + [page.next_cursor, page.prev_cursor]
+    return parts, max((blog["updated"] for blog in page), default=None)
+
 
 @bp.route("/")
+@conditional(index_validators)
+@cache_anonymous("blogs")
 def index():
-    """Show all the blogs, most recent first."""
-    db = get_db()
-    query_response = db.execute(
-        "SELECT p.id, title, body, updated, author_id, username, public"
-        " FROM blog p JOIN user u ON p.author_id = u.id"
-        " ORDER BY updated DESC"
-    ).fetchall()
-
-    blogs = []
-    for row in query_response:
-        if g.user:
-            if row["author_id"] != g.user["id"] and row['public'] == 0:
-                continue
-        else:
-            if row['public'] == 0:
-                continue
-
-        blogs.append(row)
+    """Show a page of the blogs visible to the current user, most recent
+    first. The page is selected by the opaque ``cursor`` query argument.
+    """
+    page = blog_page(
+        "p.id, title, excerpt, word_count, p.updated, author_id, username, public,"
+        " comment_count",
+        get_read_db(),
+    )
 
-    return render_template("blog/index.html", blogs=blogs)
+    return render_template("blog/index.html", blogs=page, page=page)
 
 
-def get_blog(blog_id, check_author=True, check_public=True):
+def get_blog(blog_id, check_author=True, check_public=True, db=None):
     """Get a blog and its author by id.
 
     Checks that the id exists and optionally that the current user is
@@ -50,20 +137,13 @@ def get_blog(blog_id, check_author=True, check_public=True):
 
     :param id: id of blog to get
     :param check_author: require the current user to be the author
+    :param check_public: require the blog to be visible to the current user
+    :param db: connection to read from, the primary by default
     :return: the blog with author information
     :raise 404: if a blog with the given id doesn't exist
     :raise 403: if the current user isn't the author
     """
-    blog = (
-        get_db()
-        .execute(
-            "SELECT p.id, title, body, updated, author_id, username, public"
-            " FROM blog p JOIN user u ON p.author_id = u.id"
-            " WHERE p.id = ?",
-            (blog_id,),
-        )
-        .fetchone()
-    )
+    blog = get_blogs([blog_id], db)[blog_id]
 
     if blog is None:
         abort(404, f"Blog id {blog_id} doesn't exist.")
@@ -71,41 +151,67 @@ def get_blog(blog_id, check_author=True, check_public=True):
     if check_author and blog["author_id"] != g.user["id"]:
         abort(403)
 
-    if g.user:
-        if check_public and blog["public"] == 0 and blog["author_id"] != g.user["id"]:
-            abort(403)
-    else:
-        if check_public and blog["public"] == 0:
-            abort(403)
+    if check_public and not blog["visible"]:
+        abort(403)
 
     return blog
 
 
+def get_blogs(blog_ids, db=None):
+    """Get blogs and their authors by id, with whether the current user
+    may read them, through the request's identity map.
+
+    :param blog_ids: ids of the blogs to get
+    :param db: connection to read from, the primary by default
+    :return: a dict of the blogs by id, ``None`` for missing ones
+    """
+
+    def load(blog_ids):
+        user_id = g.user["id"] if g.user else None
+        blogs = (
+            (db or get_db())
+            .execute(
+                "SELECT p.id, title, body, body_html, updated, author_id, username,"
+                f" public, comment_count, {VISIBLE} AS visible"
+                " FROM blog p JOIN user u ON p.author_id = u.id"
+                " WHERE p.id IN (%s)" % ", ".join("?" * len(blog_ids)),
+                (user_id, *blog_ids),
+            )
+            .fetchall()
+        )
+        return {blog["id"]: blog for blog in blogs}
+
+    return get_identity_map().get_many("blog", blog_ids, load)
+
+
 def get_comment(comment_id, check_author=True):
-    """Get a blog and its author by id.
+    """Get a comment by id.
 
     Checks that the id exists and optionally that the current user is
     the author.
 
-    :param id: id of blog to get
+    :param id: id of comment to get
     :param check_author: require the current user to be the author
-    :return: the blog with author information
-    :raise 404: if a blog with the given id doesn't exist
+    :return: the comment
+    :raise 404: if a comment with the given id doesn't exist
     :raise 403: if the current user isn't the author
     """
-    comment = (
-        get_db()
-        .execute(
-            " SELECT c.id, c.text, c.updated, c.author_id"
-            " FROM comment c JOIN user u ON c.author_id = u.id"
-            " WHERE c.id = ?",
-            (comment_id,),
+
+    def load(comment_id):
+        return (
+            get_db()
+            .execute(
+                "SELECT c.id, c.text, c.updated, c.author_id, c.blog_id"
+                " FROM comment c WHERE c.id = ?",
+                (comment_id,),
+            )
+            .fetchone()
         )
-        .fetchone()
-    )
+
+    comment = get_identity_map().get("comment", comment_id, load)
 
     if comment is None:
-        abort(404, f"Blog id {comment_id} doesn't exist.")
+        abort(404, f"Comment id {comment_id} doesn't exist.")
 
     if check_author and comment["author_id"] != g.user["id"]:
         abort(403)
@@ -113,22 +219,63 @@ def get_comment(comment_id, check_author=True):
     return comment
 
 
-def get_comments(blog_id):
+def comment_key(comment):
+    """Sort key of a comment on a detail page, as stored in its cursors."""
+    return comment["created"], comment["id"]
+
+
+def blog_comments(blog_id, columns, direction="next", start=None, limit=None):
+    """Build the query selecting ``columns`` of a blog's comments, newest
+    first.
+
+    The ``(blog_id, created)`` index is walked from the ``(created, id)``
+    key of the previous page, so the cost of a page doesn't grow with the
+    number of comments.
+
+    :param columns: select list over ``comment c``, which must include
+        ``c.id`` and ``c.created``
+    :param direction: ``"next"`` to walk towards older comments,
+        ``"prev"`` to walk back towards newer ones (in oldest first order)
+    :param start: ``(created, id)`` key to seek past, or ``None``
+    :param limit: maximum number of rows, or ``None`` for all of them
+    :return: the SQL string and its parameters
     """
-    Get comments from a blog.
+    sql = f"SELECT {columns} FROM comment c WHERE c.blog_id = ?"
+    params = [blog_id]
+    if start is not None:
+        sql += " AND (c.created, c.id) %s (?, ?)" % ("<" if direction == "next" else ">")
+        params += start
+
+    order = "DESC" if direction == "next" else "ASC"
+    sql += f" ORDER BY c.created {order}, c.id {order}"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return sql, params
+
+
+def get_comments(blog_id, columns="c.id, c.text, c.created, c.author_id", db=None):
+    """Get the page of a blog's comments that the request's ``comments``
+    argument points at.
+
+    :param columns: select list for :func:`blog_comments`
+    :param db: connection to read from, the primary by default
+    :return: a :class:`~myblog.pagination.Page`
     """
-    comments = (
-        get_db()
-        .execute(
-            " SELECT DISTINCT c.id, c.text, c.created, c.author_id"
-            " FROM blog b JOIN comment c ON c.blog_id = b.id"
-            " WHERE b.id = ?",
-            (blog_id,),
-        )
-        .fetchall()
-    )
+    db = db or get_db()
 
-    return comments
+    def fetch(direction, start, limit):
+        sql, params = blog_comments(blog_id, columns, direction, start, limit)
+        return db.execute(sql, params).fetchall()
+
+    return paginate(
+        fetch,
+        request.args.get("comments"),
+        current_app.config["COMMENTS_PER_PAGE"],
+        comment_key,
+    )
 
 
 @bp.route("/create", methods=("GET", "POST"))
@@ -145,12 +292,13 @@ def create():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                "INSERT INTO blog (title, body, public, author_id) VALUES (?, ?, ?, ?)",
-                (title, body, public, g.user["id"]),
+            execute_write(
+                "INSERT INTO blog"
+                " (title, body, excerpt, body_html, word_count, public, author_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (title, body, *derive(body), public, g.user["id"]),
             )
-            db.commit()
+            invalidate("blogs")
             return redirect(url_for("blog.index"))
 
     elif request.method == "POST" and not form.validate():
@@ -165,25 +313,26 @@ def create():
 @login_required
 def update(blog_id):
     """Update a blog if the current user is the author."""
+    blog = get_blog(blog_id)
     if request.method == "GET":
-        blog =  get_blog(blog_id)
         form = CreateBlogForm(obj=blog, meta={'csrf_context': session})
     else:
         form = CreateBlogForm(request.form, meta={'csrf_context': session})
-    if request.method == "POST":
+    if request.method == "POST" and form.validate():
         title = form.title.data
         body = form.body.data
         public = form.public.data
 
-        blog = get_blog(blog_id)
-        if g.user['id'] != blog['author_id']:
-            abort(403)
-
-        db = get_db()
-        db.execute(
-            "UPDATE blog SET title = ?, body = ?, public = ?, updated = CURRENT_TIMESTAMP WHERE id = ?", (title, body, public, blog_id)
+        # updated must change on every edit, even within the same second,
+        # since caches of the blog are keyed on it
+        execute_write(
+            "UPDATE blog SET title = ?, body = ?, excerpt = ?, body_html = ?,"
+            " word_count = ?, public = ?,"
+            " updated = MAX(CURRENT_TIMESTAMP, datetime(updated, '+1 second'))"
+            " WHERE id = ?",
+            (title, body, *derive(body), public, blog_id),
         )
-        db.commit()
+        invalidate("blogs", f"blog:{blog_id}")
         return redirect(url_for("blog.index"))
 
     elif request.method == "POST" and not form.validate():
@@ -201,12 +350,12 @@ def comment(blog_id):
     if request.method == "POST":
         text = form.text.data
 
-        db = get_db()
-        db.execute(
+        execute_write(
             "INSERT INTO comment (text, author_id, blog_id) VALUES (?, ?, ?)",
             (text, g.user["id"], blog_id),
         )
-        db.commit()
+        # the index shows comment counts
+        invalidate("blogs", f"blog:{blog_id}")
         return redirect(url_for("blog.detail", blog_id=blog_id))
 
     elif request.method == "POST" and not form.validate():
@@ -215,14 +364,67 @@ def comment(blog_id):
                 flash(error, field_name.capitalize())
 
 
+def detail_validators(blog_id):
+    """The last update and comment count of a visible blog and the keys
+    of the requested page of comments; ``None`` if the blog can't be
+    shown, for the view to fail.
+    """
+    db = get_read_db()
+    user_id = g.user["id"] if g.user else None
+    blog = db.execute(
+        f"SELECT p.updated, p.comment_count, {VISIBLE} AS visible"
+        " FROM blog p WHERE p.id = ?",
+        (user_id, blog_id),
+    ).fetchone()
+
+    if blog is None or not blog["visible"]:
+        return None
+
+    page = get_comments(blog_id, "c.id, c.created", db)
+    (latest,) = db.execute(
+        "SELECT MAX(created) FROM comment WHERE blog_id = ?", (blog_id,)
+    ).fetchone()
+    last_modified = blog["updated"]
+    if latest is not None:
+        last_modified = max(last_modified, datetime.datetime.fromisoformat(latest))
+
+    # the comment form's CSRF token expires, so logged in users get a
+    # fresh page every 10 minutes
+    epoch = int(time.time() // 600) if user_id else None
+
+    parts = [blog["updated"], blog["comment_count"], latest, epoch]
+    parts += [tuple(comment) for comment in page]
+    parts += [page.next_cursor, page.prev_cursor]
+    return parts, last_modified
+
+
 @bp.route("/<int:blog_id>/detail", methods=("GET",))
+@conditional(detail_validators)
+@cache_anonymous("blog:{blog_id}")
 def detail(blog_id):
     """Detail a blog if is public."""
-    blog = get_blog(blog_id, check_author=False)
-    comments = get_comments(blog_id=blog_id)
-    form = CreateCommentForm(request.form, meta={'csrf_context': session})
-    
-    return render_template("blog/detail.html", comments=comments, blog=blog, form=form)
+    db = get_read_db()
+    blog = get_blog(blog_id, check_author=False, db=db)
+    comments = get_comments(blog_id, db=db)
+    # only the users can comment, and an anonymous form would give the
+    # cached page's visitors a session
+    form = None
+    if g.user is not None:
+        form = CreateCommentForm(request.form, meta={'csrf_context': session})
+    # rendered when the blog was written, unless it predates the backfill
+    if blog["body_html"] is not None:
+        body_html = Markup(blog["body_html"])
+    else:
+        body_html = render_html(blog["body"])
+
+    return render_template(
+        "blog/detail.html",
+        comments=comments,
+        page=comments,
+        blog=blog,
+        body_html=body_html,
+        form=form,
+    )
 
 
 @bp.route("/<int:blog_id>/delete", methods=("GET", "POST"))
@@ -236,9 +438,8 @@ def delete(blog_id):
     form = DeleteBlogForm(request.form, meta={'csrf_context': session})
     if request.method == "POST" and form.validate():
         get_blog(blog_id)
-        db = get_db()
-        db.execute("DELETE FROM blog WHERE id = ?", (blog_id,))
-        db.commit()
+        execute_write("DELETE FROM blog WHERE id = ?", (blog_id,))
+        invalidate("blogs", f"blog:{blog_id}")
         return redirect(url_for("blog.index"))
     
     return render_template("blog/delete_blog.html", form=form, blog=get_blog(blog_id))
@@ -254,10 +455,9 @@ def comment_delete(comment_id):
     """
     form = DeleteCommentForm(request.form, meta={'csrf_context': session})
     if request.method == "POST" and form.validate():
-        get_comment(comment_id)
-        db = get_db()
-        db.execute("DELETE FROM comment WHERE id = ?", (comment_id,))
-        db.commit()
+        comment = get_comment(comment_id)
+        execute_write("DELETE FROM comment WHERE id = ?", (comment_id,))
+        invalidate("blogs", f"blog:{comment['blog_id']}")
         return redirect(url_for("blog.detail", blog_id=request.args.get('blog_id')))
 
     context = {
@@ -0,0 +1,440 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import make_response
+from flask import request
+from flask import session
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from myblog.db import ConnectionPool
+from myblog.db import get_db
+from myblog.replica import read_from_primary
+from myblog.serve import closed_before_fork
+from myblog.writer import write
+
+_cache_lock = threading.Lock()
+
+
+class CacheBackend:
+    """Interface of the stores behind the response cache. Values are byte
+    strings.
+    """
+
+    def get(self, key):
+        """Return the value stored under ``key``, or ``None``."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Store ``value`` under ``key`` for ``ttl`` seconds."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every entry."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return the hit, miss and eviction counters and the size of the
+        store as a dict.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources of the store, if it has any."""
+
+
+class MemoryCache(CacheBackend):
+    """An in-process cache evicting the least recently used entries once
+    ``max_bytes`` is exceeded, and expired entries when they are read.
+
+    :param sizeof: function giving the size charged for a value, which
+        allows storing other values than byte strings; the size is then
+        not reported as ``bytes`` by :meth:`stats`
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        stats = dict(self._counters, entries=len(self._entries))
+        if self._sizeof is len:
+            stats["bytes"] = self._size
+
+        return stats
+
+    def _remove(self, key):
+        expires, size, value = self._entries.pop(key)
+        self._size -= size
+
+
+class SQLiteCache(CacheBackend):
+    """A cache stored in an SQLite file, which the worker processes of
+    one host can share. Least recently used entries are evicted once
+    ``max_bytes`` is exceeded. The counters are those of this process.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._pool = ConnectionPool(
+            path,
+            4,
+            {"journal_mode": "wal", "synchronous": "normal", "busy_timeout": 5000},
+        )
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+        with self._connection() as db:
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS entry ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS entry_accessed ON entry (accessed);"
+            )
+
+    def get(self, key):
+        now = time.time()
+
+        with self._connection() as db:
+            row = db.execute(
+                "SELECT value FROM entry WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+
+            db.execute("UPDATE entry SET accessed = ? WHERE key = ?", (now, key))
+
+        self._counters["hits"] += 1
+        return row[0]
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now),
+            )
+            db.execute("DELETE FROM entry WHERE expires < ?", (now,))
+
+            size = db.execute("SELECT total(size) FROM entry").fetchone()[0]
+            while size > self.max_bytes:
+                oldest, evicted = db.execute(
+                    "SELECT key, size FROM entry ORDER BY accessed LIMIT 1"
+                ).fetchone()
+                db.execute("DELETE FROM entry WHERE key = ?", (oldest,))
+                self._counters["evictions"] += 1
+                size -= evicted
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute("DELETE FROM entry")
+
+    def stats(self):
+        with self._connection() as db:
+            entries, size = db.execute("SELECT COUNT(*), total(size) FROM entry").fetchone()
+
+        return dict(self._counters, entries=entries, bytes=int(size))
+
+    def close(self):
+        self._pool.close()
+
+    @contextlib.contextmanager
+    def _connection(self):
+        conn = self._pool.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._pool.release(conn)
+
+
+def get_response_cache():
+    """Get the response cache backend of the current app in this process,
+    or ``None`` if ``RESPONSE_CACHE`` is off.
+    """
+    kind = current_app.config["RESPONSE_CACHE"]
+    if not kind:
+        return None
+
+    cache = current_app.extensions.get("myblog.response_cache")
+    if cache is None or cache[0] != os.getpid():
+        with _cache_lock:
+            cache = current_app.extensions.get("myblog.response_cache")
+
+            if cache is None or cache[0] != os.getpid():
+                max_bytes = current_app.config["RESPONSE_CACHE_MAX_BYTES"]
+                if kind == "sqlite":
+                    backend = SQLiteCache(
+                        current_app.config["RESPONSE_CACHE_PATH"], max_bytes
+                    )
+                else:
+                    backend = MemoryCache(max_bytes)
+
+                cache = (os.getpid(), backend)
+                current_app.extensions["myblog.response_cache"] = cache
+
+    return cache[1]
+
+
+closed_before_fork("myblog.response_cache", lambda cache: (cache[0], cache[1].close))
+
+
+def _dump_response(response):
+    headers = [
+        (name, value) for name, value in response.headers if name != "Set-Cookie"
+    ]
+    head = json.dumps([response.status_code, headers]).encode()
+    return head + b"\n" + response.get_data()
+
+
+def _load_response(value):
+    head, body = value.split(b"\n", 1)
+    status, headers = json.loads(head)
+    return Response(body, status=status, headers=headers)
+
+
+def tag_versions(tags):
+    """The current version of each tag, in order. They are read from the
+    primary database, where every process bumps them.
+    """
+    versions = dict(
+        get_db().execute(
+            "SELECT tag, version FROM cache_tag WHERE tag IN (%s)"
+            % ", ".join("?" * len(tags)),
+            tags,
+        )
+    )
+
+    return [versions.get(tag, 0) for tag in tags]
+
+
+def cache_anonymous(*tags):
+    """View decorator caching the whole response for anonymous visitors.
+
+    Responses are cached by endpoint, path and query string, for
+    ``RESPONSE_CACHE_TTL`` seconds. ``tags`` name the data the page is
+    built from, as format strings over the view arguments, for example
+    ``"blog:{blog_id}"``. Pages are cached under the versions of their
+    tags, which :func:`invalidate` bumps, so a write drops every page
+    built from a tag in all the processes at once. Under a
+    :func:`~myblog.conditional.conditional` view the key also has the
+    ETag, so a cached page is only ever sent with the ETag it was
+    rendered for. Logged in users, pages with pending flashed messages
+    and responses other than 200 are never cached.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            cache = get_response_cache()
+
+            if (
+                cache is None
+                or request.method != "GET"
+                or "user_id" in session
+                or "_flashes" in session
+            ):
+                return view(**kwargs)
+
+            view_tags = [tag.format(**kwargs) for tag in tags]
+            versions = tag_versions(view_tags)
+            key = "|".join(
+                [request.endpoint, request.full_path, str(g.get("etag"))]
+                + [f"{tag}={version}" for tag, version in zip(view_tags, versions)]
+            )
+
+            value = cache.get(key)
+            if value is not None:
+                response = _load_response(value)
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            # a page rendered from a lagging replica would be cached under
+            # the current versions with older data
+            read_from_primary()
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, _dump_response(response), current_app.config["RESPONSE_CACHE_TTL"])
+
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop the cached pages built from any of ``tags``, in every process,
+    by bumping their versions in the database.
+    """
+    if not current_app.config["RESPONSE_CACHE"]:
+        return
+
+    def operation(db):
+        db.executemany(
+            "INSERT INTO cache_tag VALUES (?, 1)"
+            " ON CONFLICT (tag) DO UPDATE SET version = version + 1",
+            [(tag,) for tag in tags],
+        )
+
+    write(operation)
+
+
+def get_fragment_cache():
+    """Get the template fragment cache of the current app in this
+    process, or ``None`` if ``FRAGMENT_CACHE`` is off.
+    """
+    if not current_app.config["FRAGMENT_CACHE"]:
+        return None
+
+    cache = current_app.extensions.get("myblog.fragment_cache")
+    if cache is None or cache[0] != os.getpid():
+        with _cache_lock:
+            cache = current_app.extensions.get("myblog.fragment_cache")
+
+            if cache is None or cache[0] != os.getpid():
+                backend = MemoryCache(current_app.config["FRAGMENT_CACHE_MAX_BYTES"])
+                cache = (os.getpid(), backend)
+                current_app.extensions["myblog.fragment_cache"] = cache
+
+    return cache[1]
+
+
+def viewer_class(author_id):
+    """Classify the current user relative to the author of some content:
+    ``"author"``, ``"member"`` for other logged in users, or
+    ``"anonymous"``. Fragments only vary by this, not by the user.
+    """
+    if g.user is None:
+        return "anonymous"
+
+    return "author" if g.user["id"] == author_id else "member"
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension caching the rendered output of a block::
+
+        {% cache "blog", blog['id'], blog['updated'], viewer_class(blog['author_id']) %}
+            ...
+        {% endcache %}
+
+    The values after ``cache`` form the key, so it must include
+    everything the block's output depends on. Blocks are kept in a
+    :class:`MemoryCache` bounded by ``FRAGMENT_CACHE_MAX_BYTES``.
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render", [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        cache = get_fragment_cache()
+        if cache is None:
+            return caller()
+
+        key = repr(parts)
+        fragment = cache.get(key)
+
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment, current_app.config["FRAGMENT_CACHE_TTL"])
+
+        return fragment
+
+
+def init_app(app):
+    """Register the response and fragment cache settings and the
+    ``{% cache %}`` template tag with the Flask app. This is called by
+    the application factory.
+    """
+    # "memory" for a cache in each process, "sqlite" for one shared by
+    # the processes of a host, or None to disable it; invalidations reach
+    # every process either way
+    app.config.setdefault("RESPONSE_CACHE", "memory")
+    # seconds a cached page is served for
+    app.config.setdefault("RESPONSE_CACHE_TTL", 60)
+    # total size of the cached pages
+    app.config.setdefault("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    # file of the "sqlite" cache
+    app.config.setdefault(
+        "RESPONSE_CACHE_PATH", os.path.join(app.instance_path, "cache.sqlite")
+    )
+    # cache rendered blocks of the templates that use {% cache %}
+    app.config.setdefault("FRAGMENT_CACHE", True)
+    # seconds a block is kept, and the total size of the blocks in
+    # characters
+    app.config.setdefault("FRAGMENT_CACHE_TTL", 3600)
+    app.config.setdefault("FRAGMENT_CACHE_MAX_BYTES", 8 * 1024 * 1024)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.add_template_global(viewer_class)
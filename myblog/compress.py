@@ -0,0 +1,182 @@
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        # wbits 16 + 15 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        """Compress a chunk and flush it, so a streamed response reaches
+        the client as it is produced.
+        """
+        compressor = self._compressor
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressedIterable:
+    """The body of a response compressed chunk by chunk, closing the
+    original body when it is closed, as WSGI servers expect.
+    """
+
+    def __init__(self, app_iter, encoder):
+        self._app_iter = app_iter
+        self._encoder = encoder
+
+    def __iter__(self):
+        for chunk in self._app_iter:
+            if chunk:
+                data = self._encoder.compress(chunk)
+                if data:
+                    yield data
+
+        yield self._encoder.finish()
+
+    def close(self):
+        close = getattr(self._app_iter, "close", None)
+        if close is not None:
+            close()
+
+
+class CompressionMiddleware:
+    """WSGI middleware compressing the responses of an app with brotli or
+    gzip, whichever the client prefers, brotli only if it is installed.
+
+    Only responses of the ``mimetypes`` are compressed, and only those
+    of at least ``min_size`` bytes, or of unknown length because they
+    are streamed; these are compressed as they go, never buffered. A
+    strong ``ETag`` of a compressed response is made weak, since the
+    bytes differ from those it was computed on, and ``Vary`` tells caches
+    that the body depends on ``Accept-Encoding``.
+    """
+
+    def __init__(self, app, mimetypes, min_size=500, level=6, brotli_quality=4):
+        self.app = app
+        self.mimetypes = frozenset(mimetypes)
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, environ):
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING"))
+        codings = [("br", BrotliEncoder)] if brotli is not None else []
+        codings.append(("gzip", GzipEncoder))
+        quality, _, coding = max(
+            (accepted[name], -i, (name, encoder))
+            for i, (name, encoder) in enumerate(codings)
+        )
+        return coding if quality > 0 else None
+
+    def should_compress(self, environ, status, headers):
+        mimetype = headers.get("Content-Type", "").partition(";")[0].strip()
+        length = headers.get("Content-Length")
+
+        return (
+            environ["REQUEST_METHOD"] != "HEAD"
+            and status[:3] not in ("204", "206", "304")
+            and mimetype in self.mimetypes
+            and "Content-Encoding" not in headers
+            and "no-transform" not in headers.get("Cache-Control", "")
+            and (length is None or int(length) >= self.min_size)
+        )
+
+    def __call__(self, environ, start_response):
+        chosen = {}
+
+        def compressing_start_response(status, response_headers, exc_info=None):
+            headers = Headers(response_headers)
+            mimetype = headers.get("Content-Type", "").partition(";")[0].strip()
+
+            if mimetype in self.mimetypes or status[:3] == "304":
+                vary = headers.get("Vary", "")
+                if "*" not in vary and "accept-encoding" not in vary.lower():
+                    headers["Vary"] = (
+                        f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+                    )
+
+            coding = None
+            if self.should_compress(environ, status, headers):
+                coding = self.choose_encoding(environ)
+
+            if coding is not None:
+                name, encoder = coding
+                chosen["encoder"] = encoder(
+                    self.level if name == "gzip" else self.brotli_quality
+                )
+                headers["Content-Encoding"] = name
+                headers.remove("Content-Length")
+                etag = headers.get("ETag")
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        # Werkzeug responses call start_response before returning their body
+        app_iter = self.app(environ, compressing_start_response)
+        encoder = chosen.get("encoder")
+        if encoder is None:
+            return app_iter
+
+        return CompressedIterable(app_iter, encoder)
+
+
+def init_app(app):
+    """Register the compression settings with the Flask app, and if it is
+    enabled, wrap the app in :class:`CompressionMiddleware`. This is
+    called by the application factory.
+    """
+    # compress responses for the clients accepting it
+    app.config.setdefault("COMPRESS_ENABLED", True)
+    # types of the responses to compress
+    app.config.setdefault(
+        "COMPRESS_MIMETYPES",
+        (
+            "text/html",
+            "text/css",
+            "text/plain",
+            "text/csv",
+            "text/javascript",
+            "application/javascript",
+            "application/json",
+            "application/x-ndjson",
+            "application/xml",
+            "image/svg+xml",
+        ),
+    )
+    # smaller responses are sent as they are, compression wouldn't pay
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    # gzip level from 1 to 9, and brotli quality from 0 to 11; the higher
+    # levels cost more CPU than they save bandwidth on dynamic pages
+    app.config.setdefault("COMPRESS_LEVEL", 6)
+    app.config.setdefault("COMPRESS_BROTLI_QUALITY", 4)
+
+    if app.config["COMPRESS_ENABLED"]:
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app,
+            app.config["COMPRESS_MIMETYPES"],
+            app.config["COMPRESS_MIN_SIZE"],
+            app.config["COMPRESS_LEVEL"],
+            app.config["COMPRESS_BROTLI_QUALITY"],
+        )
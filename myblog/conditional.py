@@ -0,0 +1,79 @@
+import datetime
+import functools
+import hashlib
+
+from flask import current_app
+from flask import g
+from flask import make_response
+from flask import request
+from flask import session
+
+
+def conditional(validators):
+    """View decorator answering conditional GETs from cheap metadata.
+
+    ``validators(**kwargs)`` is called before the view and returns a
+    list of values that change whenever the page does, and the time of
+    the latest change; or ``None`` to leave the request to the view, for
+    example because it will fail. A weak ETag is derived from the values
+    and the logged in user, so no two users share one. When the request's
+    ``If-None-Match`` matches, a 304 is returned without running the
+    view. Otherwise the view's 200 response gets the ``ETag``,
+    ``Last-Modified`` and the configured ``Cache-Control``.
+
+    ``If-Modified-Since`` is never answered with a 304: deleted comments
+    and blogs, or changed counts, leave the time of the latest change
+    where it was, while they change the ETag.
+
+    The ETag is kept in ``g.etag`` while the view runs, for
+    :func:`~myblog.cache.cache_anonymous` to key the cached page on it.
+    Pages with pending flashed messages are left alone, since the
+    messages are not part of the validators.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            if request.method not in ("GET", "HEAD") or "_flashes" in session:
+                return view(**kwargs)
+
+            found = validators(**kwargs)
+            if found is None:
+                return view(**kwargs)
+
+            parts, last_modified = found
+            user_id = session.get("user_id")
+            etag = hashlib.sha1(repr((user_id, parts)).encode()).hexdigest()[:20]
+
+            if last_modified is not None:
+                last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                # for the response cache to key the page on it
+                g.etag = etag
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.headers["Cache-Control"] = current_app.config[
+                "CACHE_CONTROL_AUTHENTICATED" if user_id else "CACHE_CONTROL_ANONYMOUS"
+            ]
+            response.vary.add("Cookie")
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def init_app(app):
+    """Register the HTTP caching settings with the Flask app. This is
+    called by the application factory.
+    """
+    # Cache-Control of pages answered by conditional views
+    app.config.setdefault("CACHE_CONTROL_ANONYMOUS", "public, max-age=0, must-revalidate")
+    app.config.setdefault("CACHE_CONTROL_AUTHENTICATED", "private, no-cache")
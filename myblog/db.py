@@ -1,28 +1,197 @@
+import os
+import queue
+import re
 import sqlite3
+import threading
 
 import click
 from flask import current_app
 from flask import g
 from flask.cli import with_appcontext
 
+from myblog.metrics import instrument
+from myblog.serve import closed_before_fork
+
+_pool_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """A pool of SQLite connections to one database, shared by the
+    threads of one process.
+
+    Connections are set up once, with the configured PRAGMAs, and then
+    reused by request after request so they keep their parsed schema and
+    warm page cache. At most ``size`` idle connections are kept.
+    """
+
+    def __init__(self, database, size, pragmas, uri=False):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self.uri = uri
+        self.pid = os.getpid()
+        self.closed = False
+        self._idle = queue.LifoQueue()
+
+    def connect(self):
+        """Open and set up a new connection."""
+        conn = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            uri=self.uri,
+        )
+        conn.row_factory = sqlite3.Row
+
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+        return conn
+
+    def acquire(self):
+        """Take a healthy idle connection, or open a new one. Broken idle
+        connections are evicted on the way.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+
+            try:
+                conn.execute("SELECT 1")
+            except sqlite3.Error:
+                self._discard(conn)
+            else:
+                return conn
+
+    def release(self, conn):
+        """Give a connection back to the pool, rolling back whatever the
+        borrower left uncommitted.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        if not self.closed and self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+
+    def close(self):
+        """Close every idle connection, and the borrowed ones as they are
+        released.
+        """
+        self.closed = True
+
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class PooledConnection:
+    """A connection borrowed from a :class:`ConnectionPool` for the
+    duration of one request.
+
+    It behaves like the ``sqlite3.Connection`` it wraps, and closing it
+    hands the connection back to the pool. After that it can't be used
+    any more, so a handle kept past the request can't interfere with
+    the next borrower.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = pool.acquire()
+
+    @property
+    def connection(self):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+
+        return self._conn
+
+    def execute(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.connection.executemany(sql, parameters)
+
+    def executescript(self, script):
+        return self.connection.executescript(script)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __enter__(self):
+        return self.connection.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+
+def get_pool():
+    """Get the connection pool of the current app in this process.
+
+    A pool inherited through ``fork`` is dropped, never used, since an
+    SQLite connection must not be shared with another process.
+    """
+    pool = current_app.extensions.get("myblog.db.pool")
+
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            pool = current_app.extensions.get("myblog.db.pool")
+
+            if pool is None or pool.pid != os.getpid():
+                config = current_app.config
+                pool = ConnectionPool(
+                    config["DATABASE"],
+                    config["DATABASE_POOL_SIZE"],
+                    config["DATABASE_PRAGMAS"],
+                )
+                current_app.extensions["myblog.db.pool"] = pool
+
+    return pool
+
+
+closed_before_fork("myblog.db.pool", lambda pool: (pool.pid, pool.close))
+
 
 def get_db():
     """Connect to the application's configured database. The connection
     is unique for each request and will be reused if this is called
-    again.
+    again. It is borrowed from the connection pool.
     """
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = instrument(PooledConnection(get_pool()))
 
     return g.db
 
 
 def close_db(e=None):
-    """If this request connected to the database, close the
-    connection.
+    """If this request connected to the database, give the connection
+    back to the pool.
     """
     db = g.pop("db", None)
 
@@ -30,6 +199,74 @@ def close_db(e=None):
         db.close()
 
 
+def list_migrations():
+    """List the migration scripts shipped in the ``migrations`` folder.
+
+    :return: ``(version, name, path)`` tuples in the order to apply them
+    """
+    folder = os.path.join(current_app.root_path, "migrations")
+    migrations = []
+
+    for filename in os.listdir(folder):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if match is not None:
+            migrations.append(
+                (int(match.group(1)), match.group(2), os.path.join(folder, filename))
+            )
+
+    return sorted(migrations)
+
+
+def applied_migrations(db):
+    """Map the version of each applied migration to the time it ran."""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " name TEXT NOT NULL,"
+        " applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    return dict(db.execute("SELECT version, applied FROM schema_version"))
+
+
+def upgrade_db():
+    """Apply the pending migrations in order.
+
+    Each migration runs in its own short write transaction together with
+    the insert into ``schema_version``, so a failed migration leaves no
+    trace and readers of a WAL database are never held up by more than
+    one step.
+
+    :return: the ``(version, name)`` of the migrations applied
+    """
+    db = get_db()
+    applied = applied_migrations(db)
+    upgraded = []
+
+    for version, name, path in list_migrations():
+        if version in applied:
+            continue
+
+        with open(path, encoding="utf8") as f:
+            script = f.read()
+
+        try:
+            db.executescript(
+                "BEGIN IMMEDIATE;\n"
+                f"{script}\n;\n"
+                "INSERT INTO schema_version (version, name)"
+                f" VALUES ({version}, '{name}');\n"
+                "COMMIT;"
+            )
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+        upgraded.append((version, name))
+
+    return upgraded
+
+
 def init_db():
     """Clear existing data and create new tables."""
     db = get_db()
@@ -37,6 +274,8 @@ def init_db():
     with current_app.open_resource("schema.sql") as f:
         db.executescript(f.read().decode("utf8"))
 
+    upgrade_db()
+
 
 @click.command("init-db")
 @with_appcontext
@@ -46,9 +285,51 @@ def init_db_command():
     click.echo("Initialized the database for myblog.")
 
 
+@click.command("db-upgrade")
+@with_appcontext
+def upgrade_db_command():
+    """Apply the pending schema migrations."""
+    upgraded = upgrade_db()
+
+    for version, name in upgraded:
+        click.echo(f"Applied migration {version:04d}_{name}.")
+
+    if not upgraded:
+        click.echo("The database is up to date.")
+
+
+@click.command("db-status")
+@with_appcontext
+def db_status_command():
+    """Show which schema migrations have been applied."""
+    applied = applied_migrations(get_db())
+
+    for version, name, path in list_migrations():
+        status = f"applied {applied[version]}" if version in applied else "pending"
+        click.echo(f"{version:04d}_{name}: {status}")
+
+
 def init_app(app):
     """Register database functions with the Flask app. This is called by
     the application factory.
     """
+    # at most this many idle connections are kept by each process
+    app.config.setdefault("DATABASE_POOL_SIZE", 8)
+    # applied to every new connection
+    app.config.setdefault(
+        "DATABASE_PRAGMAS",
+        {
+            "journal_mode": "wal",
+            "synchronous": "normal",
+            "cache_size": -16000,
+            "mmap_size": 64 * 1024 * 1024,
+            "temp_store": "memory",
+            "busy_timeout": 5000,
+            "foreign_keys": "on",
+        },
+    )
+
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(db_status_command)
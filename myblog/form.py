@@ -1,21 +1,99 @@
+import hashlib
+import hmac
 import secrets
-from datetime import timedelta
-from wtforms.csrf.session import SessionCSRF
+import time
+
+from flask import current_app
 from wtforms import (
     Form, BooleanField, StringField, validators, PasswordField,
     TextAreaField, IntegerField
 )
-
-
-SECRET_TOKEN = secrets.token_bytes(16)
+from wtforms.csrf.core import CSRF
+from wtforms.validators import ValidationError
+
+
+def csrf_keys():
+    """The keys signing CSRF tokens, the current one first, then those
+    still accepted while rotating. Each is derived from the configured
+    secret, so the tokens are the same in every process of the app and
+    can't be mistaken for other signatures made with the secret.
+    """
+    config = current_app.config
+    secret = config['CSRF_SECRET_KEY'] or config['SECRET_KEY']
+    fallbacks = config['CSRF_SECRET_KEY_FALLBACKS']
+    if fallbacks is None:
+        fallbacks = config.get('SECRET_KEY_FALLBACKS') or []
+
+    keys = []
+    for key in (secret, *fallbacks):
+        if isinstance(key, str):
+            key = key.encode('utf8')
+        keys.append(hmac.new(key, b'myblog.csrf', hashlib.sha256).digest())
+
+    return keys
+
+
+class SignedCSRF(CSRF):
+    """Stateless CSRF tokens: the time they were issued and an HMAC of it
+    and of whom the session, which is the ``csrf_context``, belongs to.
+    That is the user id once logged in, so any process of the app can
+    check a token made by another. Anonymous sessions get a random nonce
+    instead, stored in the session the first time a form is rendered, so
+    their tokens can't be used from another client.
+    """
+
+    def setup_form(self, form):
+        self.form_meta = form.meta
+        return super().setup_form(form)
+
+    def _subject(self, issue=False):
+        """Whom the tokens of the session are bound to, creating the
+        anonymous nonce if ``issue`` is set, or ``None`` if there is none.
+        """
+        context = self.form_meta.csrf_context
+        if context is None:
+            raise TypeError('Must provide the session as the CSRF context.')
+
+        if context.get('user_id') is not None:
+            return f'user:{context["user_id"]}'
+
+        nonce = context.get('csrf_nonce')
+        if nonce is None and issue:
+            nonce = context['csrf_nonce'] = secrets.token_hex(16)
+
+        return f'anonymous:{nonce}' if nonce is not None else None
+
+    @staticmethod
+    def _sign(key, issued, subject):
+        message = f'{issued}|{subject}'.encode('utf8')
+        return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+    def generate_csrf_token(self, csrf_token_field):
+        issued = int(time.time())
+        subject = self._subject(issue=True)
+        return f'{issued}.{self._sign(csrf_keys()[0], issued, subject)}'
+
+    def validate_csrf_token(self, form, field):
+        issued, _, signature = (field.data or '').partition('.')
+        if not issued.isdigit() or not signature:
+            raise ValidationError(field.gettext('CSRF token missing.'))
+
+        subject = self._subject()
+        if subject is None or not any(
+            hmac.compare_digest(self._sign(key, issued, subject), signature)
+            for key in csrf_keys()
+        ):
+            raise ValidationError(field.gettext('CSRF failed.'))
+
+        age = time.time() - int(issued)
+        if age > current_app.config['CSRF_TIME_LIMIT'] or age < -60:
+            raise ValidationError(field.gettext('CSRF token expired.'))
 
 
 class MyBaseForm(Form):
     class Meta:
         csrf = True
-        csrf_class = SessionCSRF
-        csrf_secret = SECRET_TOKEN
-        csrf_time_limit = timedelta(minutes=30)
+        csrf_class = SignedCSRF
 
 
 class RegistrationForm(MyBaseForm):
@@ -105,4 +183,16 @@ class DeleteBlogForm(MyBaseForm):
 
 
 class DeleteCommentForm(MyBaseForm):
-    pass
\ No newline at end of file
+    pass
+
+
+def init_app(app):
+    """Register the CSRF settings with the Flask app. This is called by
+    the application factory.
+    """
+    # key signing the CSRF tokens, SECRET_KEY by default, and the former
+    # keys still accepted, SECRET_KEY_FALLBACKS by default
+    app.config.setdefault('CSRF_SECRET_KEY', None)
+    app.config.setdefault('CSRF_SECRET_KEY_FALLBACKS', None)
+    # seconds a form can be submitted after it was rendered
+    app.config.setdefault('CSRF_TIME_LIMIT', 30 * 60)
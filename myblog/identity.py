@@ -0,0 +1,94 @@
+import collections
+
+from flask import current_app
+from flask import g
+from flask import has_app_context
+
+
+class IdentityMap:
+    """Rows loaded during one request, by kind and key, so that each row
+    is read at most once however many helpers ask for it.
+
+    The map is dropped by :func:`clear_identity_map` whenever the request
+    writes, since any row might have changed. ``stats`` counts the rows
+    served from the map (``hits``), the rows loaded (``loads``) and the
+    rows loaded again after a write (``duplicates``).
+    """
+
+    def __init__(self):
+        self.stats = {"hits": 0, "loads": 0, "duplicates": 0}
+        self._rows = {}
+        self._loaded = collections.Counter()
+
+    def get(self, kind, key, load):
+        """Get the ``kind`` row with ``key``, calling ``load(key)`` if it
+        isn't in the map yet. ``None`` results are remembered too.
+        """
+        try:
+            row = self._rows[kind, key]
+        except KeyError:
+            row = self._rows[kind, key] = load(key)
+            self._count_load(kind, key)
+        else:
+            self.stats["hits"] += 1
+
+        return row
+
+    def get_many(self, kind, keys, load_many):
+        """Get the ``kind`` rows with ``keys``, calling ``load_many(keys)``
+        once for those not in the map yet. ``load_many`` returns a dict of
+        the rows it found by key.
+
+        :return: a dict of the rows by key, ``None`` for missing ones
+        """
+        missing = [key for key in dict.fromkeys(keys) if (kind, key) not in self._rows]
+        self.stats["hits"] += len(keys) - len(missing)
+
+        if missing:
+            found = load_many(missing)
+            for key in missing:
+                self._rows[kind, key] = found.get(key)
+                self._count_load(kind, key)
+
+        return {key: self._rows[kind, key] for key in keys}
+
+    def clear(self):
+        self._rows.clear()
+
+    def _count_load(self, kind, key):
+        self.stats["loads"] += 1
+        self._loaded[kind, key] += 1
+
+        if self._loaded[kind, key] > 1:
+            self.stats["duplicates"] += 1
+            if current_app.config["IDENTITY_MAP_DEBUG"]:
+                current_app.logger.warning(
+                    "%s %r loaded %d times in one request",
+                    kind,
+                    key,
+                    self._loaded[kind, key],
+                )
+
+
+def get_identity_map():
+    """Get the identity map of the current request."""
+    if "identity_map" not in g:
+        g.identity_map = IdentityMap()
+
+    return g.identity_map
+
+
+def clear_identity_map():
+    """Forget the rows loaded so far in the current request, if any. This
+    is called after every write.
+    """
+    if has_app_context() and "identity_map" in g:
+        g.identity_map.clear()
+
+
+def init_app(app):
+    """Register the identity map settings with the Flask app. This is
+    called by the application factory.
+    """
+    # log rows loaded more than once in a request
+    app.config.setdefault("IDENTITY_MAP_DEBUG", app.debug or app.testing)
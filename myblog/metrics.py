@@ -0,0 +1,532 @@
+import bisect
+import collections
+import hmac
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+from flask import g
+from flask import request
+from werkzeug.exceptions import abort
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_registry_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """The SQL statements run by one request: how many, how long they
+    took in all, and the slowest of them.
+    """
+
+    def __init__(self, slow_threshold):
+        self.started = time.perf_counter()
+        self.slow_threshold = slow_threshold
+        self.queries = 0
+        self.seconds = 0.0
+        self.slow_queries = 0
+        self.slowest = (0.0, None)
+
+
+class TimedCursor:
+    """A cursor adding the time spent fetching its rows to its statement."""
+
+    def __init__(self, cursor, conn, sql, seconds):
+        self._cursor = cursor
+        self._conn = conn
+        self._sql = sql
+        self._seconds = seconds
+        self._logged = False
+        conn._record(self, seconds)
+
+    def _timed(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            seconds = time.perf_counter() - started
+            self._seconds += seconds
+            self._conn._record(self, seconds)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed(next, self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """A connection recording every statement it runs in the
+    :class:`RequestMetrics` of the request, and logging those slower than
+    ``SLOW_QUERY_SECONDS``.
+    """
+
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def _run(self, method, sql, *args):
+        started = time.perf_counter()
+        cursor = method(sql, *args)
+        self._metrics.queries += 1
+        return TimedCursor(cursor, self, sql, time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        return self._run(self._conn.execute, sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self._run(self._conn.executemany, sql, parameters)
+
+    def executescript(self, script):
+        return self._run(self._conn.executescript, script)
+
+    def _record(self, cursor, seconds):
+        metrics = self._metrics
+        metrics.seconds += seconds
+
+        if cursor._seconds > metrics.slowest[0]:
+            metrics.slowest = (cursor._seconds, cursor._sql)
+
+        if cursor._seconds >= metrics.slow_threshold and not cursor._logged:
+            cursor._logged = True
+            metrics.slow_queries += 1
+            current_app.logger.warning(
+                "Slow query (%.1f ms) in %s: %s",
+                cursor._seconds * 1000,
+                request.endpoint,
+                " ".join(cursor._sql.split()),
+            )
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+
+def instrument(conn):
+    """Wrap a connection of the current request to record its statements,
+    if metrics are enabled; otherwise return it as it is.
+    """
+    metrics = g.get("request_metrics")
+    if metrics is None:
+        return conn
+
+    return TimedConnection(conn, metrics)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{%s}" % ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+class Registry:
+    """The metrics of the requests served by this process, by endpoint.
+    With ``METRICS_DIR`` set, they are also written there, for the
+    ``/metrics`` of any process of the app to serve those of all.
+
+    Latencies are counted in the histogram ``buckets``, upper bounds in
+    seconds, the way Prometheus expects them.
+    """
+
+    def __init__(self, buckets):
+        self.pid = os.getpid()
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.responses = collections.Counter()
+        self.latency = {}
+        self.queries = collections.Counter()
+        self.sql_seconds = collections.Counter()
+        self.slow_queries = collections.Counter()
+        # when the metrics were last written for the other processes
+        self.shared = 0
+
+    def observe(self, endpoint, method, status, seconds, metrics):
+        with self._lock:
+            self.responses[endpoint, method, status] += 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                # a count per bucket, then +Inf, then the sum
+                histogram = self.latency[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+            self.queries[endpoint] += metrics.queries
+            self.sql_seconds[endpoint] += metrics.seconds
+            self.slow_queries[endpoint] += metrics.slow_queries
+
+    def collect(self):
+        """The metric families of this process, the counters kept by its
+        caches, writer and replica included, by name: each with its
+        ``kind``, ``help`` and ``samples``, the values by series.
+        """
+        families = {}
+
+        def family(name, kind, help=None):
+            families[name] = {"kind": kind, "help": help, "samples": {}}
+            return families[name]["samples"]
+
+        with self._lock:
+            samples = family("myblog_http_requests_total", "counter", "Responses sent.")
+            for (endpoint, method, status), count in self.responses.items():
+                labels = _labels(endpoint=endpoint, method=method, status=status)
+                samples[f"myblog_http_requests_total{labels}"] = count
+
+            name = "myblog_http_request_duration_seconds"
+            samples = family(name, "histogram", "Time to build a response.")
+            for endpoint, histogram in self.latency.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), histogram):
+                    cumulative += count
+                    labels = _labels(endpoint=endpoint, le=bound)
+                    samples[f"{name}_bucket{labels}"] = cumulative
+                labels = _labels(endpoint=endpoint)
+                samples[f"{name}_sum{labels}"] = histogram[-1]
+                samples[f"{name}_count{labels}"] = cumulative
+
+            for name, counter, help in (
+                ("myblog_sql_queries_total", self.queries, "SQL statements run."),
+                (
+                    "myblog_sql_duration_seconds_total",
+                    self.sql_seconds,
+                    "Time spent running SQL statements and fetching their rows.",
+                ),
+                (
+                    "myblog_sql_slow_queries_total",
+                    self.slow_queries,
+                    "SQL statements slower than SLOW_QUERY_SECONDS.",
+                ),
+            ):
+                samples = family(name, "counter", help)
+                for endpoint, value in counter.items():
+                    samples[f"{name}{_labels(endpoint=endpoint)}"] = value
+
+        for name, kind, series in _component_metrics():
+            family(name, kind).update(series)
+
+        return families
+
+    def share(self, folder):
+        """Write the metrics of this process to ``folder``, for any
+        process of the app to serve them with the others'.
+        """
+        self.shared = time.monotonic()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.pid}.json")
+        with open(path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self.collect(), f)
+        os.replace(path + ".tmp", path)
+
+
+def _component_metrics():
+    """The counters kept by the caches, the writer and the replica of
+    this process, those that have been started, as ``(name, kind,
+    samples)``.
+    """
+    metrics = []
+    extensions = current_app.extensions
+
+    caches = [
+        (name, extensions.get(f"myblog.{name}"))
+        for name in ("response_cache", "fragment_cache", "user_cache")
+    ]
+    caches = [
+        (name, cache[1].stats())
+        for name, cache in caches
+        if cache and cache[0] == os.getpid()
+    ]
+    if caches:
+        for stat, kind in (
+            ("hits", "counter"),
+            ("misses", "counter"),
+            ("evictions", "counter"),
+            ("entries", "gauge"),
+            ("bytes", "gauge"),
+        ):
+            suffix = "_total" if kind == "counter" else ""
+            name = f"myblog_cache_{stat}{suffix}"
+            samples = {
+                f"{name}{_labels(cache=cache)}": stats[stat]
+                for cache, stats in caches
+                if stat in stats
+            }
+            metrics.append((name, kind, samples))
+
+    writer = extensions.get("myblog.writer")
+    if writer is not None and writer.pid == os.getpid():
+        for stat, value in writer.stats.items():
+            kind = "gauge" if stat.startswith(("largest", "max")) else "counter"
+            suffix = "_total" if kind == "counter" and not stat.endswith("seconds") else ""
+            name = f"myblog_writer_{stat}{suffix}"
+            metrics.append((name, kind, {name: value}))
+
+    replica = extensions.get("myblog.replica")
+    if replica is not None and replica.pid == os.getpid():
+        name = "myblog_replica_lag_seconds"
+        metrics.append((name, "gauge", {name: replica.lag()}))
+
+    return metrics
+
+
+def _with_pid(series, pid):
+    """Add the ``pid`` label to a series."""
+    name, brace, labels = series.partition("{")
+    pid_label = f'pid="{pid}"'
+    if brace:
+        return f"{name}{{{pid_label},{labels}"
+
+    return f"{name}{{{pid_label}}}"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _add(totals, families, pid=None):
+    """Add the counters and histograms of ``families`` to ``totals``, and
+    unless ``pid`` is ``None``, their gauges labelled with it.
+    """
+    for name, family in families.items():
+        if family["kind"] == "gauge" and pid is None:
+            continue
+
+        total = totals.setdefault(
+            name, {"kind": family["kind"], "help": family["help"], "samples": {}}
+        )["samples"]
+        for series, value in family["samples"].items():
+            if family["kind"] == "gauge":
+                total[_with_pid(series, pid)] = value
+            else:
+                total[series] = total.get(series, 0) + value
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def merge(folder):
+    """Merge the metrics that the processes of the app wrote to
+    ``folder``: their counters and histograms are summed, so they don't
+    go backwards when the process answering changes, and the gauges of
+    the live ones are labelled with their pid.
+
+    The files of the processes that exited are folded into
+    ``exited.json``, their counters still part of the totals.
+    """
+    lock = open(os.path.join(folder, ".lock"), "a")
+    try:
+        if fcntl is not None:
+            # two processes must not fold the same files
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        exited_path = os.path.join(folder, "exited.json")
+        exited = {}
+        _add(exited, _read(exited_path))
+        live = {}
+        folded = []
+
+        for filename in os.listdir(folder):
+            stem, ext = os.path.splitext(filename)
+            if ext != ".json" or not stem.isdigit():
+                continue
+
+            pid = int(stem)
+            families = _read(os.path.join(folder, filename))
+            if _alive(pid):
+                live[pid] = families
+            else:
+                _add(exited, families)
+                folded.append(filename)
+
+        if folded:
+            with open(exited_path + ".tmp", "w", encoding="utf8") as f:
+                json.dump(exited, f)
+            os.replace(exited_path + ".tmp", exited_path)
+            for filename in folded:
+                os.remove(os.path.join(folder, filename))
+    finally:
+        lock.close()
+
+    totals = {}
+    _add(totals, exited)
+    for pid, families in sorted(live.items()):
+        _add(totals, families, pid)
+
+    return totals
+
+
+def render(families):
+    """Write metric families in the Prometheus text format."""
+    lines = []
+
+    for name, family in families.items():
+        if family["help"]:
+            lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for series, value in sorted(family["samples"].items()):
+            lines.append(f"{series} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def get_registry():
+    """Get the metrics registry of the current app in this process."""
+    registry = current_app.extensions.get("myblog.metrics")
+
+    if registry is None or registry.pid != os.getpid():
+        with _registry_lock:
+            registry = current_app.extensions.get("myblog.metrics")
+
+            if registry is None or registry.pid != os.getpid():
+                registry = Registry(current_app.config["METRICS_BUCKETS"])
+                current_app.extensions["myblog.metrics"] = registry
+
+    return registry
+
+
+def start_request():
+    g.request_metrics = RequestMetrics(current_app.config["SLOW_QUERY_SECONDS"])
+
+
+def finish_request(response):
+    """Count the response and tell the client about its SQL time in a
+    ``Server-Timing`` header.
+    """
+    metrics = g.get("request_metrics")
+    if metrics is None:
+        return response
+
+    seconds = time.perf_counter() - metrics.started
+    endpoint = request.endpoint or "none"
+    registry = get_registry()
+    registry.observe(endpoint, request.method, response.status_code, seconds, metrics)
+
+    config = current_app.config
+    if (
+        config["METRICS_DIR"]
+        and time.monotonic() - registry.shared >= config["METRICS_SHARE_INTERVAL"]
+    ):
+        registry.share(config["METRICS_DIR"])
+
+    response.headers.add(
+        "Server-Timing",
+        f'sql;dur={metrics.seconds * 1000:.2f};desc="{metrics.queries} queries"',
+    )
+    response.headers.add("Server-Timing", f"app;dur={seconds * 1000:.2f}")
+
+    if metrics.slowest[1] is not None:
+        current_app.logger.debug(
+            "%s %s: %d queries in %.1f ms, the slowest in %.1f ms: %s",
+            request.method,
+            request.path,
+            metrics.queries,
+            metrics.seconds * 1000,
+            metrics.slowest[0] * 1000,
+            " ".join(metrics.slowest[1].split()),
+        )
+
+    return response
+
+
+def metrics_view():
+    """Serve the metrics to the scrapers sending ``METRICS_TOKEN`` as a
+    bearer token; without one configured, to nobody.
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    auth = request.authorization
+    if (
+        not token
+        or auth is None
+        or auth.type != "bearer"
+        or not hmac.compare_digest((auth.token or "").encode(), token.encode())
+    ):
+        abort(403)
+
+    registry = get_registry()
+    folder = current_app.config["METRICS_DIR"]
+    if folder:
+        registry.share(folder)
+        families = merge(folder)
+    else:
+        families = registry.collect()
+
+    return current_app.response_class(
+        render(families), mimetype="text/plain; version=0.0.4"
+    )
+
+
+def share_between_processes(app, reset=False):
+    """Have the processes of ``app`` share their metrics through files
+    in ``METRICS_DIR``, by default the ``metrics`` folder of the instance
+    folder. With ``reset``, the files of an earlier run are dropped.
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    folder = app.config["METRICS_DIR"] or os.path.join(app.instance_path, "metrics")
+    app.config["METRICS_DIR"] = folder
+    if reset and os.path.isdir(folder):
+        for filename in os.listdir(folder):
+            if filename.endswith((".json", ".tmp")):
+                os.remove(os.path.join(folder, filename))
+
+
+def init_app(app):
+    """Register the metrics settings with the Flask app, and if they are
+    enabled, the hooks timing each request and the ``/metrics`` view.
+    This is called by the application factory.
+    """
+    # time requests and SQL statements, and serve them on /metrics
+    app.config.setdefault("METRICS_ENABLED", False)
+    # upper bounds, in seconds, of the request latency histogram buckets
+    app.config.setdefault(
+        "METRICS_BUCKETS", (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    )
+    # statements slower than this many seconds are logged
+    app.config.setdefault("SLOW_QUERY_SECONDS", 0.1)
+    # the bearer token scrapers of /metrics must send; without it, the
+    # metrics are served to nobody
+    app.config.setdefault("METRICS_TOKEN", None)
+    # folder where each process writes its metrics, at most every
+    # interval seconds, for /metrics to serve the sum of all of them;
+    # "flask serve" sets it, None keeps those of the answering process
+    app.config.setdefault("METRICS_DIR", None)
+    app.config.setdefault("METRICS_SHARE_INTERVAL", 1.0)
+
+    if app.config["METRICS_ENABLED"]:
+        app.before_request(start_request)
+        app.after_request(finish_request)
+        app.add_url_rule("/metrics", "metrics", metrics_view)
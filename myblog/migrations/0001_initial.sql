@@ -0,0 +1,37 @@
+-- The tables of the original schema. They are created only if missing so
+-- that databases made by the old drop-and-recreate init-db are adopted
+-- as they are.
+
+CREATE TABLE IF NOT EXISTS user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  email TEXT NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS blog (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  public BOOLEAN NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+CREATE TABLE IF NOT EXISTS comment (
+  id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+  text TEXT NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  author_id INTEGER NOT NULL,
+  blog_id INTEGER NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id) ON DELETE CASCADE,
+  FOREIGN KEY (blog_id) REFERENCES blog (id) ON DELETE CASCADE
+);
+
+-- the blog listing reads public blogs and the author's own blogs in
+-- order of last update; see blog.visible_blogs
+CREATE INDEX IF NOT EXISTS blog_public_updated ON blog (public, updated);
+CREATE INDEX IF NOT EXISTS blog_author_updated ON blog (author_id, updated);
@@ -0,0 +1,10 @@
+-- Indexes for the lookups made on every detail page and signup.
+-- Lookups of blogs by author are served by the leading column of
+-- blog_author_updated, so blog (author_id) needs no index of its own.
+
+-- comments of a blog in the order they are shown
+CREATE INDEX IF NOT EXISTS comment_blog_created ON comment (blog_id, created);
+
+-- register() checks that an email is not taken yet; this fails if the
+-- database already holds duplicated emails, which must be merged first
+CREATE UNIQUE INDEX IF NOT EXISTS user_email ON user (email);
@@ -0,0 +1,33 @@
+-- Full-text indexes of blogs and comments, kept up to date by triggers.
+-- They store their own copy of the text, so a row can be dropped from
+-- them whether it was indexed or not; rows that existed before this
+-- migration are indexed by "flask search-reindex".
+
+CREATE VIRTUAL TABLE IF NOT EXISTS blog_search USING fts5 (title, body);
+CREATE VIRTUAL TABLE IF NOT EXISTS comment_search USING fts5 (text);
+
+CREATE TRIGGER IF NOT EXISTS blog_search_insert AFTER INSERT ON blog BEGIN
+  INSERT INTO blog_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS blog_search_update AFTER UPDATE OF title, body ON blog BEGIN
+  DELETE FROM blog_search WHERE rowid = old.id;
+  INSERT INTO blog_search (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS blog_search_delete AFTER DELETE ON blog BEGIN
+  DELETE FROM blog_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS comment_search_insert AFTER INSERT ON comment BEGIN
+  INSERT INTO comment_search (rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS comment_search_update AFTER UPDATE OF text ON comment BEGIN
+  DELETE FROM comment_search WHERE rowid = old.id;
+  INSERT INTO comment_search (rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS comment_search_delete AFTER DELETE ON comment BEGIN
+  DELETE FROM comment_search WHERE rowid = old.id;
+END;
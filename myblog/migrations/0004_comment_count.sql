@@ -0,0 +1,21 @@
+-- Number of comments of each blog, kept up to date by triggers so that
+-- listings show it without joining or counting the comment table.
+
+ALTER TABLE blog ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE blog SET comment_count = (
+  SELECT COUNT(*) FROM comment WHERE comment.blog_id = blog.id
+);
+
+CREATE TRIGGER IF NOT EXISTS blog_comment_count_insert AFTER INSERT ON comment BEGIN
+  UPDATE blog SET comment_count = comment_count + 1 WHERE id = new.blog_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS blog_comment_count_delete AFTER DELETE ON comment BEGIN
+  UPDATE blog SET comment_count = comment_count - 1 WHERE id = old.blog_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS blog_comment_count_move AFTER UPDATE OF blog_id ON comment BEGIN
+  UPDATE blog SET comment_count = comment_count - 1 WHERE id = old.blog_id;
+  UPDATE blog SET comment_count = comment_count + 1 WHERE id = new.blog_id;
+END;
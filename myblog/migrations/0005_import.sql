@@ -0,0 +1,25 @@
+-- Bookkeeping of "flask import". Each import commits its checkpoint and
+-- the ids it gave to the imported rows in the same transaction as the
+-- rows, so an interrupted import resumes where it stopped. The indexes
+-- and triggers it sets aside during a load are kept here until it puts
+-- them back.
+
+CREATE TABLE IF NOT EXISTS import_checkpoint (
+  source TEXT PRIMARY KEY,
+  line INTEGER NOT NULL,
+  done BOOLEAN NOT NULL DEFAULT 0,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS import_id_map (
+  source TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  old_id INTEGER NOT NULL,
+  new_id INTEGER NOT NULL,
+  PRIMARY KEY (source, kind, old_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS import_deferred (
+  name TEXT PRIMARY KEY,
+  sql TEXT NOT NULL
+);
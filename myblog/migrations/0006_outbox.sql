@@ -0,0 +1,17 @@
+-- Messages waiting to be sent by "flask outbox-worker" or the outbox
+-- thread. A view enqueues a row and returns at once; the worker claims
+-- the due rows, sends them and deletes them, or reschedules them after
+-- a failure, until the last attempt leaves them "dead" for inspection.
+
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  available_at REAL NOT NULL,
+  last_error TEXT,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, available_at);
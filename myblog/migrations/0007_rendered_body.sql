@@ -0,0 +1,8 @@
+-- Derived from the body when a blog is written, so that listings read
+-- neither the body nor render it, and the detail page serves the stored
+-- HTML. Blogs written before this migration get them from
+-- "flask render-backfill"; until then their body is rendered on view.
+
+ALTER TABLE blog ADD COLUMN excerpt TEXT;
+ALTER TABLE blog ADD COLUMN body_html TEXT;
+ALTER TABLE blog ADD COLUMN word_count INTEGER;
@@ -0,0 +1,9 @@
+-- Versions of the tags of the cached pages, kept in the database so an
+-- invalidation made by one process reaches the caches of all of them:
+-- pages are cached under the versions of their tags, and bumping a tag
+-- makes every page built from it unreachable.
+
+CREATE TABLE IF NOT EXISTS cache_tag (
+  tag TEXT PRIMARY KEY,
+  version INTEGER NOT NULL
+);
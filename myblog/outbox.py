@@ -0,0 +1,387 @@
+import email.message
+import json
+import os
+import random
+import smtplib
+import sys
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from myblog.db import get_pool
+from myblog.writer import execute_write
+
+_worker_lock = threading.Lock()
+
+
+class StdoutTransport:
+    """Prints the mails instead of sending them, for development."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def send(self, messages):
+        stream = self.stream or sys.stdout
+        for message in messages:
+            mail = message["payload"]
+            stream.write(
+                f"To: {mail['to']}\nSubject: {mail['subject']}\n\n{mail['body']}\n\n"
+            )
+        stream.flush()
+        return {}
+
+
+class FileTransport:
+    """Appends the mails to a file as JSON lines, for tests."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf8") as f:
+            for message in messages:
+                f.write(json.dumps({"id": message["id"], **message["payload"]}) + "\n")
+        return {}
+
+
+class SMTPTransport:
+    """Sends a batch of mails over a single SMTP connection."""
+
+    def __init__(
+        self, host, port, sender, username=None, password=None, tls=False, timeout=10
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.tls = tls
+        self.timeout = timeout
+
+    def send(self, messages):
+        errors = {}
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+
+            for message in messages:
+                mail = message["payload"]
+                msg = email.message.EmailMessage()
+                msg["From"] = self.sender
+                msg["To"] = mail["to"]
+                msg["Subject"] = mail["subject"]
+                msg.set_content(mail["body"])
+                try:
+                    smtp.send_message(msg)
+                except smtplib.SMTPException as e:
+                    errors[message["id"]] = repr(e)
+
+        return errors
+
+
+def make_transport(config):
+    kind = config["OUTBOX_TRANSPORT"]
+    if kind == "smtp":
+        return SMTPTransport(
+            config["MAIL_SERVER"],
+            config["MAIL_PORT"],
+            config["MAIL_SENDER"],
+            config["MAIL_USERNAME"],
+            config["MAIL_PASSWORD"],
+            config["MAIL_USE_TLS"],
+            config["MAIL_TIMEOUT"],
+        )
+    if kind == "file":
+        return FileTransport(
+            config["OUTBOX_FILE"] or os.path.join(current_app.instance_path, "outbox.jsonl")
+        )
+    if kind == "stdout":
+        return StdoutTransport()
+
+    raise ValueError(f"Unknown OUTBOX_TRANSPORT {kind!r}.")
+
+
+def enqueue(kind, payload):
+    """Add a message to the outbox, committed before this returns, and
+    wake the outbox thread of this process if there is one.
+
+    :return: the id of the message
+    """
+    result = execute_write(
+        "INSERT INTO outbox (kind, payload, available_at) VALUES (?, ?, ?)",
+        (kind, json.dumps(payload), time.time()),
+    )
+
+    worker = start_worker()
+    if worker is not None:
+        worker.set()
+
+    return result.lastrowid
+
+
+def claim(conn, batch_size, lease):
+    """Take up to ``batch_size`` due messages, and hide them from other
+    workers for ``lease`` seconds, after which they are due again if
+    this worker died before settling them.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "UPDATE outbox SET attempts = attempts + 1, available_at = ?"
+            " WHERE id IN (SELECT id FROM outbox"
+            "  WHERE status = 'pending' AND available_at <= ?"
+            "  ORDER BY available_at, id LIMIT ?)"
+            " RETURNING id, kind, payload, attempts",
+            (now + lease, now, batch_size),
+        ).fetchall()
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    return sorted(
+        (
+            {
+                "id": row["id"],
+                "kind": row["kind"],
+                "payload": json.loads(row["payload"]),
+                "attempts": row["attempts"],
+            }
+            for row in rows
+        ),
+        key=lambda message: message["id"],
+    )
+
+
+def backoff(attempts, base, limit):
+    """Seconds to wait before the next attempt: doubling with each failed
+    attempt up to ``limit``, less a random part so that messages which
+    failed together are not retried together.
+    """
+    delay = min(base * 2 ** (attempts - 1), limit)
+    return delay * random.uniform(0.5, 1)
+
+
+def deliver_batch(conn, transport, config, batch_size):
+    """Claim and send one batch of due messages, then delete those that
+    were sent and reschedule or dead-letter the others.
+
+    :return: the number of messages sent, retried and dead-lettered
+    """
+    counts = {"sent": 0, "retried": 0, "dead": 0}
+    messages = claim(conn, batch_size, config["OUTBOX_LEASE"])
+    if not messages:
+        return counts
+
+    mails = [message for message in messages if message["kind"] == "mail"]
+    errors = {
+        message["id"]: f"Unknown kind {message['kind']!r}."
+        for message in messages
+        if message["kind"] != "mail"
+    }
+    try:
+        errors.update(transport.send(mails))
+    except Exception as e:
+        current_app.logger.exception("Could not send %d messages.", len(mails))
+        errors.update((message["id"], repr(e)) for message in mails)
+
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for message in messages:
+            error = errors.get(message["id"])
+            if error is None:
+                conn.execute("DELETE FROM outbox WHERE id = ?", (message["id"],))
+                counts["sent"] += 1
+            elif message["attempts"] >= config["OUTBOX_MAX_ATTEMPTS"]:
+                conn.execute(
+                    "UPDATE outbox SET status = 'dead', last_error = ? WHERE id = ?",
+                    (error, message["id"]),
+                )
+                counts["dead"] += 1
+                current_app.logger.error(
+                    "Outbox message %d failed %d times, giving up: %s",
+                    message["id"],
+                    message["attempts"],
+                    error,
+                )
+            else:
+                delay = backoff(
+                    message["attempts"],
+                    config["OUTBOX_BACKOFF"],
+                    config["OUTBOX_MAX_BACKOFF"],
+                )
+                conn.execute(
+                    "UPDATE outbox SET available_at = ?, last_error = ? WHERE id = ?",
+                    (now + delay, error, message["id"]),
+                )
+                counts["retried"] += 1
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    return counts
+
+
+def work(conn, transport, config, batch_size, interval, once=False, wake=None):
+    """Deliver batches of messages as long as some are due, then wait
+    ``interval`` seconds, or until ``wake`` is set, and look again. With
+    ``once``, return instead of waiting.
+
+    :return: the totals of :func:`deliver_batch` when ``once`` is set
+    """
+    totals = {"sent": 0, "retried": 0, "dead": 0}
+    while True:
+        try:
+            counts = deliver_batch(conn, transport, config, batch_size)
+        except Exception:
+            if once:
+                raise
+            current_app.logger.exception("Could not deliver the outbox.")
+            counts = None
+
+        if counts is not None:
+            for key, value in counts.items():
+                totals[key] += value
+
+            # a full batch means more messages may be due already
+            if sum(counts.values()) == batch_size:
+                continue
+
+        if once:
+            return totals
+
+        if wake is None:
+            time.sleep(interval)
+        else:
+            wake.wait(interval)
+            wake.clear()
+
+
+def start_worker():
+    """Start the thread delivering the outbox, once per app and process,
+    with its first request or queued message, unless
+    ``OUTBOX_BACKGROUND`` is off because a separate ``flask outbox-worker``
+    process does it.
+
+    :return: the event waking the thread, or ``None``
+    """
+    config = current_app.config
+    if not config["OUTBOX_BACKGROUND"]:
+        return None
+
+    worker = current_app.extensions.get("myblog.outbox")
+    if worker is not None and worker[0] == os.getpid():
+        return worker[1]
+
+    with _worker_lock:
+        worker = current_app.extensions.get("myblog.outbox")
+        if worker is not None and worker[0] == os.getpid():
+            return worker[1]
+
+        app = current_app._get_current_object()
+        wake = threading.Event()
+
+        def run():
+            with app.app_context():
+                conn = get_pool().connect()
+                conn.isolation_level = None
+                work(
+                    conn,
+                    make_transport(config),
+                    config,
+                    config["OUTBOX_BATCH_SIZE"],
+                    config["OUTBOX_INTERVAL"],
+                    wake=wake,
+                )
+
+        threading.Thread(target=run, name="myblog-outbox", daemon=True).start()
+        current_app.extensions["myblog.outbox"] = (os.getpid(), wake)
+
+    return wake
+
+
+def start_worker_before_request():
+    """Start the outbox thread of this process with its first request, so
+    the messages left pending by a previous process are sent without
+    waiting for a new one to be queued.
+    """
+    start_worker()
+
+
+@click.command("outbox-worker")
+@click.option("--once", is_flag=True, help="Deliver the due messages and exit.")
+@click.option("--batch-size", type=int, help="Messages claimed at a time.")
+@click.option("--interval", type=float, help="Seconds between two looks at the outbox.")
+@click.option("--retry-dead", is_flag=True, help="Give the dead messages another chance.")
+@with_appcontext
+def outbox_worker_command(once, batch_size, interval, retry_dead):
+    """Send the messages queued in the outbox."""
+    config = current_app.config
+    conn = get_pool().connect()
+    conn.isolation_level = None
+
+    try:
+        if retry_dead:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, available_at = ?"
+                " WHERE status = 'dead'",
+                (time.time(),),
+            )
+            click.echo(f"Retrying {cursor.rowcount} dead messages.")
+
+        totals = work(
+            conn,
+            make_transport(config),
+            config,
+            batch_size or config["OUTBOX_BATCH_SIZE"],
+            interval or config["OUTBOX_INTERVAL"],
+            once=once,
+        )
+    finally:
+        conn.close()
+
+    click.echo("Sent {sent}, retrying {retried}, dead {dead}.".format(**totals))
+
+
+def init_app(app):
+    """Register the outbox settings and worker command with the Flask app.
+    This is called by the application factory.
+    """
+    # deliver the outbox from a thread of each app process, started with
+    # its first request
+    app.config.setdefault("OUTBOX_BACKGROUND", True)
+    # "stdout" to print the mails, "file" to append them to OUTBOX_FILE,
+    # by default "outbox.jsonl" in the instance folder, or "smtp"
+    app.config.setdefault("OUTBOX_TRANSPORT", "stdout")
+    app.config.setdefault("OUTBOX_FILE", None)
+    # messages claimed and sent at a time, and seconds between two looks
+    # at the outbox when it is empty
+    app.config.setdefault("OUTBOX_BATCH_SIZE", 50)
+    app.config.setdefault("OUTBOX_INTERVAL", 5)
+    # attempts before a message is left dead, and the seconds to wait
+    # after the first failure, doubling up to the maximum
+    app.config.setdefault("OUTBOX_MAX_ATTEMPTS", 8)
+    app.config.setdefault("OUTBOX_BACKOFF", 30)
+    app.config.setdefault("OUTBOX_MAX_BACKOFF", 3600)
+    # seconds a claimed message is hidden from other workers
+    app.config.setdefault("OUTBOX_LEASE", 300)
+    # the mail server of the "smtp" transport
+    app.config.setdefault("MAIL_SERVER", "localhost")
+    app.config.setdefault("MAIL_PORT", 25)
+    app.config.setdefault("MAIL_USE_TLS", False)
+    app.config.setdefault("MAIL_USERNAME", None)
+    app.config.setdefault("MAIL_PASSWORD", None)
+    app.config.setdefault("MAIL_SENDER", "myblog@localhost")
+    app.config.setdefault("MAIL_TIMEOUT", 10)
+
+    app.before_request(start_worker_before_request)
+    app.cli.add_command(outbox_worker_command)
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+
+from werkzeug.exceptions import abort
+
+
+class Page:
+    """One page of a keyset paginated listing.
+
+    ``next_cursor`` and ``prev_cursor`` are opaque tokens for the pages
+    after and before this one, or ``None`` at either end of the listing.
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(direction, key):
+    """Pack a seek direction (``"next"`` or ``"prev"``) and the sort key of
+    the row to seek from into an opaque, URL safe token.
+    """
+    data = json.dumps([direction, list(key)], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).rstrip(b"=").decode()
+
+
+def _is_key_value(value):
+    """Whether a value of a decoded key can be bound as an SQL parameter."""
+    if isinstance(value, int):
+        # SQLite integers are 64 bit
+        return -(2**63) <= value < 2**63
+
+    return isinstance(value, (str, float))
+
+
+def decode_cursor(token, length=2):
+    """Unpack a token made by :func:`encode_cursor`.
+
+    :param length: number of values in the sort keys of the listing
+    :return: the direction and the sort key as a tuple
+    :raise 400: if the token is malformed
+    """
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, key = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, "Invalid cursor.")
+
+    if (
+        direction not in ("next", "prev")
+        or not isinstance(key, list)
+        or len(key) != length
+        or not all(_is_key_value(value) for value in key)
+    ):
+        abort(400, "Invalid cursor.")
+
+    return direction, tuple(key)
+
+
+def paginate(fetch, token, size, key):
+    """Load the page of a listing that ``token`` points at.
+
+    The listing is walked by seeking from the sort key stored in the
+    cursor, so every page costs the same however deep it is.
+
+    :param fetch: ``fetch(direction, start, limit)`` returning up to
+        ``limit`` rows after (``"next"``) or before (``"prev"``) the sort
+        key ``start`` in walking order; ``start`` is ``None`` for the
+        first page
+    :param token: the cursor from the request, or ``None``
+    :param size: number of rows per page
+    :param key: function returning the sort key of a row
+    :return: a :class:`Page`
+    """
+    if token:
+        direction, start = decode_cursor(token)
+    else:
+        direction, start = "next", None
+
+    # fetch one extra row to know if there is a page beyond this one
+    rows = list(fetch(direction, start, size + 1))
+    more = len(rows) > size
+    rows = rows[:size]
+
+    if direction == "prev":
+        rows.reverse()
+        has_next, has_prev = start is not None, more
+    else:
+        has_next, has_prev = more, start is not None
+
+    page = Page(rows)
+    if rows and has_next:
+        page.next_cursor = encode_cursor("next", key(rows[-1]))
+    if rows and has_prev:
+        page.prev_cursor = encode_cursor("prev", key(rows[0]))
+
+    return page
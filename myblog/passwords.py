@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+from myblog.serve import closed_before_fork
+
+_hasher_lock = threading.Lock()
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already pending, so the
+    request is turned away instead of queueing behind them.
+    """
+
+
+class Hasher:
+    """Runs password hashing off the request threads.
+
+    Hashes are computed by a pool of ``workers`` processes, or inline if
+    ``workers`` is 0. At most ``max_pending`` hashes may be queued or
+    running at once; a caller waiting longer than ``timeout`` seconds for
+    a slot gets :exc:`HasherBusy`.
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self.pid = os.getpid()
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+
+        if workers:
+            # spawned, not forked, so the workers don't inherit the
+            # threads and connections of the app process
+            self._executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def run(self, function, *args):
+        """Call ``function(*args)`` in the pool and return its result."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+
+        try:
+            if self._executor is None:
+                return function(*args)
+
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def hash_workers(config):
+    """The processes of the hasher of each app process: as configured, or
+    one per CPU shared between the ``SERVE_WORKERS`` processes, so that
+    ``flask serve`` doesn't start one per CPU in each of them.
+    """
+    workers = config["PASSWORD_HASH_WORKERS"]
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // (config["SERVE_WORKERS"] or 1))
+
+    return workers
+
+
+def get_hasher():
+    """Get the password hasher of the current app in this process."""
+    hasher = current_app.extensions.get("myblog.hasher")
+
+    if hasher is None or hasher.pid != os.getpid():
+        with _hasher_lock:
+            hasher = current_app.extensions.get("myblog.hasher")
+
+            if hasher is None or hasher.pid != os.getpid():
+                config = current_app.config
+                workers = hash_workers(config)
+                max_pending = config["PASSWORD_HASH_MAX_PENDING"]
+                if max_pending is None:
+                    max_pending = 2 * workers or 4
+
+                hasher = Hasher(
+                    workers, max_pending, config["PASSWORD_HASH_QUEUE_TIMEOUT"]
+                )
+                current_app.extensions["myblog.hasher"] = hasher
+
+    return hasher
+
+
+closed_before_fork("myblog.hasher", lambda hasher: (hasher.pid, hasher.shutdown))
+
+
+def hash_password(password):
+    """Hash a password with the configured method and salt length.
+
+    :raise HasherBusy: if the hasher is overloaded
+    """
+    config = current_app.config
+    return get_hasher().run(
+        generate_password_hash,
+        password,
+        config["PASSWORD_HASH_METHOD"],
+        config["PASSWORD_SALT_LENGTH"],
+    )
+
+
+def check_password(pwhash, password):
+    """Check a password against a stored hash.
+
+    :raise HasherBusy: if the hasher is overloaded
+    """
+    return get_hasher().run(check_password_hash, pwhash, password)
+
+
+def _hash_parameters(method):
+    """Spell out the parameters of a werkzeug hash method, filling in
+    werkzeug's defaults for those it leaves out, e.g. ``pbkdf2`` gives
+    ``("pbkdf2", "sha256", 1000000)``.
+    """
+    name, *args = method.split(":")
+
+    if name == "scrypt":
+        return (name, *map(int, args or (2**15, 8, 1)))
+
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return (name, hash_name, iterations)
+
+    return (name, *args)
+
+
+def needs_rehash(pwhash):
+    """Tell if a stored hash was made with other parameters than the
+    configured ``PASSWORD_HASH_METHOD`` and ``PASSWORD_SALT_LENGTH``.
+    """
+    config = current_app.config
+    method, salt = pwhash.split("$", 2)[:2]
+    return (
+        _hash_parameters(method) != _hash_parameters(config["PASSWORD_HASH_METHOD"])
+        or len(salt) != config["PASSWORD_SALT_LENGTH"]
+    )
+
+
+def init_app(app):
+    """Register the password hashing settings with the Flask app. This is
+    called by the application factory.
+    """
+    # method and cost of new hashes; older hashes are upgraded on login
+    app.config.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    app.config.setdefault("PASSWORD_SALT_LENGTH", 16)
+    # processes computing hashes, or 0 to hash on the request thread; by
+    # default one per CPU, divided between the workers of "flask serve"
+    app.config.setdefault("PASSWORD_HASH_WORKERS", None)
+    # hashes queued or running at once, by default twice the processes,
+    # and seconds to wait for a slot before answering 503
+    app.config.setdefault("PASSWORD_HASH_MAX_PENDING", None)
+    app.config.setdefault("PASSWORD_HASH_QUEUE_TIMEOUT", 2.0)
@@ -0,0 +1,287 @@
+import collections
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+import click
+from flask import current_app
+from flask import g
+from flask import request
+from flask.cli import with_appcontext
+from itsdangerous import BadSignature
+from itsdangerous import URLSafeTimedSerializer
+
+# one profiled request at a time per process, since profilers can't
+# overlap and the overhead should stay bounded
+_profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """A lightweight profiler recording the stack of one thread every
+    ``interval`` seconds from a background thread, so the profiled code
+    doesn't run any slower.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="myblog-profiler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Write the stacks in the collapsed format of flame graph tools,
+        one ``caller;callee count`` line per distinct stack.
+        """
+        with open(path, "w", encoding="utf8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt="myblog.profiler")
+
+
+def make_token():
+    """Make a value of the ``PROFILER_HEADER`` asking for a profile."""
+    return _serializer().dumps("profile")
+
+
+def check_token(token):
+    try:
+        _serializer().loads(token, max_age=current_app.config["PROFILER_TOKEN_MAX_AGE"])
+    except BadSignature:
+        return False
+
+    return True
+
+
+def get_profile_dir():
+    return current_app.config["PROFILER_DIR"] or os.path.join(
+        current_app.instance_path, "profiles"
+    )
+
+
+def rotate(folder, max_files, max_bytes):
+    """Delete the oldest dumps until at most ``max_files`` are left and
+    they take at most ``max_bytes``.
+    """
+    dumps = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith((".prof", ".collapsed")):
+            stat = os.stat(path)
+            dumps.append((stat.st_mtime, stat.st_size, path))
+
+    dumps.sort()
+    total = sum(size for mtime, size, path in dumps)
+
+    while dumps and (len(dumps) > max_files or total > max_bytes):
+        mtime, size, path = dumps.pop(0)
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def start_profile():
+    """Profile this request if it carries a valid signed header, or was
+    picked at the ``PROFILER_SAMPLE_RATE``.
+    """
+    config = current_app.config
+    token = request.headers.get(config["PROFILER_HEADER"])
+    if token:
+        wanted = check_token(token)
+    else:
+        wanted = random.random() < config["PROFILER_SAMPLE_RATE"]
+
+    if not wanted or not _profile_lock.acquire(blocking=False):
+        return
+
+    if config["PROFILER_MODE"] == "sample":
+        profiler = StackSampler(threading.get_ident(), config["PROFILER_INTERVAL"])
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    name = "%s-%s" % (time.strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8])
+    g.profile = (profiler, time.perf_counter(), name, bool(token))
+
+
+def add_dump_header(response):
+    """Tell whoever asked for the profile the name its dump starts with."""
+    profile = g.get("profile")
+    if profile is not None and profile[3]:
+        response.headers["X-Profile-Dump"] = profile[2]
+
+    return response
+
+
+def stop_profile(e=None):
+    """Stop the profiler of this request, if any, and dump what it saw."""
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+
+    profiler, started, name, requested = profile
+    try:
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            extension = ".collapsed"
+        else:
+            profiler.disable()
+            extension = ".prof"
+
+        milliseconds = (time.perf_counter() - started) * 1000
+        folder = get_profile_dir()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(
+            folder,
+            f"{name}-{request.endpoint or 'none'}-{milliseconds:.0f}ms{extension}",
+        )
+
+        if isinstance(profiler, StackSampler):
+            profiler.dump(path)
+        else:
+            profiler.dump_stats(path)
+
+        config = current_app.config
+        rotate(folder, config["PROFILER_MAX_FILES"], config["PROFILER_MAX_BYTES"])
+    finally:
+        _profile_lock.release()
+
+
+def report(paths, limit, sort):
+    """Summarize profile dumps: the ``.prof`` files together through
+    :mod:`pstats`, and the ``.collapsed`` files by the samples in which
+    each function was running (self) or on the stack (total).
+    """
+    out = io.StringIO()
+    profiles = [path for path in paths if path.endswith(".prof")]
+    collapsed = [path for path in paths if path.endswith(".collapsed")]
+
+    if profiles:
+        stats = pstats.Stats(*profiles, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+    if collapsed:
+        own = collections.Counter()
+        total = collections.Counter()
+        samples = 0
+
+        for path in collapsed:
+            with open(path, encoding="utf8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    frames = stack.split(";")
+                    count = int(count)
+                    samples += count
+                    own[frames[-1]] += count
+                    for frame in set(frames):
+                        total[frame] += count
+
+        ranking = own if sort == "tottime" else total
+        out.write(f"{samples} samples in {len(collapsed)} dumps\n\n")
+        samples = samples or 1
+        out.write(f"{'self':>7} {'total':>7}  function\n")
+        for frame, _ in ranking.most_common(limit):
+            out.write(
+                f"{own[frame] / samples:>7.1%} {total[frame] / samples:>7.1%}  {frame}\n"
+            )
+
+    return out.getvalue()
+
+
+@click.command("profile-report")
+@click.option("--limit", default=20, show_default=True, help="Functions to show.")
+@click.option(
+    "--sort",
+    type=click.Choice(["tottime", "cumulative"]),
+    default="cumulative",
+    show_default=True,
+    help="Rank by the time in the function itself or with its callees.",
+)
+@click.option("--endpoint", help="Only the dumps of this endpoint.")
+@with_appcontext
+def profile_report_command(limit, sort, endpoint):
+    """Show the hottest functions across the profile dumps."""
+    folder = get_profile_dir()
+    names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    paths = [
+        os.path.join(folder, name)
+        for name in names
+        if name.endswith((".prof", ".collapsed"))
+        and (endpoint is None or f"-{endpoint}-" in name)
+    ]
+
+    if not paths:
+        raise click.ClickException(f"No profile dumps in {folder}.")
+
+    click.echo(report(paths, limit, sort))
+
+
+@click.command("profile-token")
+@with_appcontext
+def profile_token_command():
+    """Print a header value asking for a request to be profiled."""
+    click.echo(f"{current_app.config['PROFILER_HEADER']}: {make_token()}")
+
+
+def init_app(app):
+    """Register the profiler settings and commands with the Flask app, and
+    if it is enabled, the hooks profiling the chosen requests. This is
+    called by the application factory.
+    """
+    # profile requests carrying a signed header or picked at random
+    app.config.setdefault("PROFILER_ENABLED", False)
+    # share of all requests to profile
+    app.config.setdefault("PROFILER_SAMPLE_RATE", 0.0)
+    # header asking for a profile, and seconds its signed value is valid
+    app.config.setdefault("PROFILER_HEADER", "X-Profile")
+    app.config.setdefault("PROFILER_TOKEN_MAX_AGE", 3600)
+    # "cprofile" for exact call counts, or "sample" for the stack sampler
+    # and its interval in seconds
+    app.config.setdefault("PROFILER_MODE", "cprofile")
+    app.config.setdefault("PROFILER_INTERVAL", 0.005)
+    # folder of the dumps, by default "profiles" in the instance folder,
+    # and how many of them, and how many bytes of them, to keep
+    app.config.setdefault("PROFILER_DIR", None)
+    app.config.setdefault("PROFILER_MAX_FILES", 200)
+    app.config.setdefault("PROFILER_MAX_BYTES", 100 * 1024 * 1024)
+
+    app.cli.add_command(profile_report_command)
+    app.cli.add_command(profile_token_command)
+
+    if app.config["PROFILER_ENABLED"]:
+        app.before_request(start_profile)
+        app.after_request(add_dump_header)
+        app.teardown_request(stop_profile)
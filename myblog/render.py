@@ -0,0 +1,155 @@
+import re
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from markupsafe import escape
+
+from myblog.cache import invalidate
+from myblog.db import get_db
+
+# inline markup of the blog bodies, applied in order to the escaped text
+# outside of code spans
+_CODE = re.compile(r"`([^`\n]+)`")
+_INLINE = (
+    (re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*"), r"<strong>\1</strong>"),
+    (re.compile(r"\*(?=\S)(.+?)(?<=\S)\*"), r"<em>\1</em>"),
+)
+_URL = re.compile(r"https?://[^\s<>\"'`*]*[^\s<>\"'`*.,;:!?)]")
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+
+def _escape_and_link(text):
+    """Escape ``text``, turning the URLs in it into links."""
+    parts = []
+    start = 0
+    for match in _URL.finditer(text):
+        url = escape(match.group())
+        parts.append(str(escape(text[start : match.start()])))
+        parts.append(f'<a href="{url}" rel="nofollow">{url}</a>')
+        start = match.end()
+
+    parts.append(str(escape(text[start:])))
+    return "".join(parts)
+
+
+def render_html(body):
+    """Render a blog body to HTML.
+
+    The body is plain text with a little markup: blank lines separate
+    paragraphs, ``**strong**``, ``*emphasis*`` and ```code``` spans, and
+    links for bare http(s) URLs. Everything else is escaped, so the HTML
+    is safe to show as it is.
+    """
+    paragraphs = []
+    for text in _PARAGRAPHS.split(body.replace("\r\n", "\n").strip()):
+        if not text.strip():
+            continue
+
+        # odd pieces are the code spans
+        pieces = _CODE.split(_escape_and_link(text.strip()))
+        for i in range(0, len(pieces), 2):
+            for pattern, replacement in _INLINE:
+                pieces[i] = pattern.sub(replacement, pieces[i])
+        for i in range(1, len(pieces), 2):
+            pieces[i] = f"<code>{pieces[i]}</code>"
+
+        html = "".join(pieces)
+        paragraphs.append("<p>%s</p>" % html.replace("\n", "<br>\n"))
+
+    return Markup("\n".join(paragraphs))
+
+
+def make_excerpt(body, length):
+    """The beginning of a blog body as plain text on one line, cut at a
+    word boundary to at most ``length`` characters.
+    """
+    text = _CODE.sub(r"\1", body)
+    for pattern, replacement in _INLINE:
+        text = pattern.sub(r"\1", text)
+    text = " ".join(text.split())
+
+    if len(text) <= length:
+        return text
+
+    cut = text[: length - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(".,;:!?") + "…"
+
+
+def derive(body):
+    """Compute what is stored with a blog body when it is written.
+
+    :return: the ``(excerpt, body_html, word_count)`` of the body
+    """
+    return (
+        make_excerpt(body, current_app.config["EXCERPT_LENGTH"]),
+        str(render_html(body)),
+        len(body.split()),
+    )
+
+
+def backfill(chunk_size, everything=False, echo=None):
+    """Store the excerpt, HTML and word count of the blogs that lack
+    them, or of every blog with ``everything``, after the renderer
+    changed.
+
+    Blogs are rendered ``chunk_size`` at a time by id, each chunk in its
+    own short transaction, so the app keeps writing meanwhile and an
+    interrupted run can simply be started again.
+
+    :return: the number of blogs rendered
+    """
+    db = get_db()
+    last_id = 0
+    rendered = 0
+    missing = "" if everything else " AND body_html IS NULL"
+
+    while True:
+        rows = db.execute(
+            f"SELECT id, body FROM blog WHERE id > ?{missing} ORDER BY id LIMIT ?",
+            (last_id, chunk_size),
+        ).fetchall()
+        if not rows:
+            break
+
+        with db:
+            # the body is compared so that an edit made meanwhile, which
+            # stored its own rendering, is not overwritten
+            db.executemany(
+                "UPDATE blog SET excerpt = ?, body_html = ?, word_count = ?"
+                " WHERE id = ? AND body = ?",
+                [(*derive(row["body"]), row["id"], row["body"]) for row in rows],
+            )
+
+        last_id = rows[-1]["id"]
+        rendered += len(rows)
+        if echo is not None:
+            echo(f"Rendered blogs up to id {last_id}.")
+
+    if rendered:
+        invalidate("blogs")
+    return rendered
+
+
+@click.command("render-backfill")
+@click.option(
+    "--chunk-size", default=500, show_default=True, help="Blogs per transaction."
+)
+@click.option("--all", "everything", is_flag=True, help="Render every blog again.")
+@with_appcontext
+def backfill_command(chunk_size, everything):
+    """Store the excerpts and rendered HTML of the blogs."""
+    rendered = backfill(chunk_size, everything, echo=click.echo)
+    click.echo(f"Rendered {rendered} blogs.")
+
+
+def init_app(app):
+    """Register the rendering settings and the backfill command with the
+    Flask app. This is called by the application factory.
+    """
+    # characters of the excerpts shown in the listings
+    app.config.setdefault("EXCERPT_LENGTH", 200)
+    app.cli.add_command(backfill_command)
@@ -0,0 +1,296 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import session
+from flask.cli import with_appcontext
+
+from myblog.db import ConnectionPool
+from myblog.db import PooledConnection
+from myblog.db import get_db
+from myblog.metrics import instrument
+from myblog.serve import closed_before_fork
+
+_replica_lock = threading.Lock()
+
+# PRAGMAs that write to the database file, which a read-only replica
+# connection can't apply
+_WRITE_PRAGMAS = {"journal_mode", "synchronous"}
+
+
+def snapshot(database, replica, pages, sleep=0):
+    """Copy the ``database`` into the ``replica`` file.
+
+    The copy is made with the online backup API ``pages`` pages at a
+    time, so writers to the primary are only locked out for one step at
+    a time. It is written next to the replica and then renamed over it:
+    connections already reading the old replica keep their file, and new
+    ones see the complete new copy.
+
+    :return: the time the copy was started, which is recorded in the
+        replica's ``replica_info`` table
+    """
+    started = time.time()
+    partial = f"{replica}.{os.getpid()}.tmp"
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(partial)
+
+    try:
+        try:
+            source.backup(target, pages=pages, sleep=sleep)
+            # readers open the replica read-only, which a WAL file can't be
+            target.execute("PRAGMA journal_mode = delete")
+            target.execute(
+                "CREATE TABLE replica_info (snapshot_started REAL NOT NULL)"
+            )
+            target.execute("INSERT INTO replica_info VALUES (?)", (started,))
+            target.commit()
+        finally:
+            target.close()
+            source.close()
+
+        os.replace(partial, replica)
+    finally:
+        # left behind by a failed copy
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial)
+
+    return started
+
+
+class Replica:
+    """The replica file as seen by one process: a read-only connection
+    pool for the copy currently in place and the time it was taken.
+    """
+
+    def __init__(self, path, inode, pool_size, pragmas):
+        self.inode = inode
+        self.pid = os.getpid()
+        self.pool = ConnectionPool(f"file:{path}?mode=ro", pool_size, pragmas, uri=True)
+
+        conn = self.pool.acquire()
+        try:
+            self.snapshot_started = conn.execute(
+                "SELECT snapshot_started FROM replica_info"
+            ).fetchone()[0]
+        finally:
+            self.pool.release(conn)
+
+    def lag(self):
+        """Seconds since the copy in place was taken from the primary."""
+        return time.time() - self.snapshot_started
+
+
+def get_replica():
+    """Get the current replica of the app's database, or ``None`` if
+    read replicas are disabled or no copy has been made yet.
+
+    A new copy is noticed by its inode, and the pool of the previous one
+    is closed as its connections are released.
+    """
+    path = current_app.config["READ_REPLICA"]
+    if not path:
+        return None
+
+    start_replicator()
+
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+    replica = current_app.extensions.get("myblog.replica")
+    if replica is None or replica.inode != inode or replica.pid != os.getpid():
+        with _replica_lock:
+            replica = current_app.extensions.get("myblog.replica")
+
+            if replica is None or replica.inode != inode or replica.pid != os.getpid():
+                pragmas = {
+                    name: value
+                    for name, value in current_app.config["DATABASE_PRAGMAS"].items()
+                    if name not in _WRITE_PRAGMAS
+                }
+                old, replica = replica, Replica(
+                    path, inode, current_app.config["DATABASE_POOL_SIZE"], pragmas
+                )
+                current_app.extensions["myblog.replica"] = replica
+
+                if old is not None and old.pid == os.getpid():
+                    old.pool.close()
+
+    return replica
+
+
+closed_before_fork(
+    "myblog.replica", lambda replica: (replica.pid, replica.pool.close)
+)
+
+
+def get_read_db():
+    """Connect to the database for a read-only view.
+
+    This is a read-only connection to the replica when it is enabled, no
+    older than ``REPLICA_MAX_STALENESS`` seconds, and taken after the
+    current user's last write, so users always read their own writes.
+    Otherwise it is the primary connection from :func:`get_db`.
+    """
+    if "read_db" in g:
+        return g.read_db
+
+    if g.get("read_primary"):
+        return get_db()
+
+    replica = get_replica()
+    if (
+        replica is None
+        or replica.lag() > current_app.config["REPLICA_MAX_STALENESS"]
+        or session.get("last_write", 0) >= replica.snapshot_started
+    ):
+        return get_db()
+
+    g.read_db = instrument(PooledConnection(replica.pool))
+    return g.read_db
+
+
+def close_read_db(e=None):
+    """If this request read from the replica, give the connection back."""
+    db = g.pop("read_db", None)
+
+    if db is not None:
+        db.close()
+
+
+def read_from_primary():
+    """Send the rest of the request's reads to the primary, for a page
+    that must not be older than what the primary has, such as one about
+    to be cached.
+    """
+    g.read_primary = True
+    close_read_db()
+
+
+def note_write():
+    """Record that the current user has just written, so their reads stay
+    on the primary until the replica has caught up.
+    """
+    if current_app.config["READ_REPLICA"] and has_request_context():
+        session["last_write"] = time.time()
+
+
+def replicate_forever(database, replica, interval, pages, sleep):
+    """Refresh the replica every ``interval`` seconds."""
+    while True:
+        try:
+            snapshot(database, replica, pages, sleep)
+        except Exception:
+            # a full disk or a failed rename must not end the loop
+            current_app.logger.exception("Could not refresh the read replica.")
+
+        time.sleep(interval)
+
+
+def start_replicator():
+    """Start the background thread refreshing the replica, once per app
+    and process, unless ``REPLICA_BACKGROUND`` is off because a separate
+    ``flask replicate`` process does it.
+    """
+    config = current_app.config
+    if not config["REPLICA_BACKGROUND"]:
+        return
+
+    if current_app.extensions.get("myblog.replicator") == os.getpid():
+        return
+
+    with _replica_lock:
+        if current_app.extensions.get("myblog.replicator") == os.getpid():
+            return
+
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                replicate_forever(
+                    config["DATABASE"],
+                    config["READ_REPLICA"],
+                    config["REPLICA_INTERVAL"],
+                    config["REPLICA_PAGES_PER_STEP"],
+                    config["REPLICA_STEP_SLEEP"],
+                )
+
+        threading.Thread(target=run, name="myblog-replicator", daemon=True).start()
+        current_app.extensions["myblog.replicator"] = os.getpid()
+
+
+@click.command("replicate")
+@click.option("--once", is_flag=True, help="Take a single copy and exit.")
+@with_appcontext
+def replicate_command(once):
+    """Keep the read replica up to date."""
+    config = current_app.config
+    if not config["READ_REPLICA"]:
+        raise click.UsageError("READ_REPLICA is not configured.")
+
+    args = (
+        config["DATABASE"],
+        config["READ_REPLICA"],
+        config["REPLICA_PAGES_PER_STEP"],
+        config["REPLICA_STEP_SLEEP"],
+    )
+    if once:
+        snapshot(*args)
+        click.echo("Refreshed the read replica.")
+    else:
+        replicate_forever(args[0], args[1], config["REPLICA_INTERVAL"], *args[2:])
+
+
+@click.command("replica-status")
+@with_appcontext
+def replica_status_command():
+    """Show how far the read replica lags behind the primary."""
+    config = current_app.config
+    if not config["READ_REPLICA"]:
+        click.echo("Read replica disabled.")
+        return
+
+    try:
+        conn = sqlite3.connect(f"file:{config['READ_REPLICA']}?mode=ro", uri=True)
+        try:
+            started = conn.execute("SELECT snapshot_started FROM replica_info").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        click.echo("No replica has been made yet.")
+        return
+
+    lag = time.time() - started
+    stale = " (stale)" if lag > config["REPLICA_MAX_STALENESS"] else ""
+    click.echo(f"Replica lag: {lag:.1f}s{stale}")
+
+
+def init_app(app):
+    """Register the read replica settings and commands with the Flask
+    app. This is called by the application factory.
+    """
+    # path of the read replica, or None to read from the primary only
+    app.config.setdefault("READ_REPLICA", None)
+    # refresh the replica from a thread of each app process as well; by
+    # default a single "flask replicate" process does it, rather than
+    # every worker of "flask serve" copying the same data
+    app.config.setdefault("REPLICA_BACKGROUND", False)
+    # seconds between two copies of the primary
+    app.config.setdefault("REPLICA_INTERVAL", 5)
+    # older replicas are not read from
+    app.config.setdefault("REPLICA_MAX_STALENESS", 30)
+    # pages copied in each step of the backup, and the pause between steps
+    app.config.setdefault("REPLICA_PAGES_PER_STEP", 256)
+    app.config.setdefault("REPLICA_STEP_SLEEP", 0.0)
+
+    app.teardown_appcontext(close_read_db)
+    app.cli.add_command(replicate_command)
+    app.cli.add_command(replica_status_command)
@@ -1,35 +1,15 @@
--- Initialize the database.
--- Drop any existing data and create empty tables.
-
-DROP TABLE IF EXISTS user;
-DROP TABLE IF EXISTS blog;
+-- Reset the database.
+-- Drop any existing data; the tables are then created by the migrations
+-- in the migrations folder.
+
+DROP TABLE IF EXISTS cache_tag;
+DROP TABLE IF EXISTS outbox;
+DROP TABLE IF EXISTS import_deferred;
+DROP TABLE IF EXISTS import_id_map;
+DROP TABLE IF EXISTS import_checkpoint;
+DROP TABLE IF EXISTS comment_search;
+DROP TABLE IF EXISTS blog_search;
 DROP TABLE IF EXISTS comment;
-
-CREATE TABLE user (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  username TEXT UNIQUE NOT NULL,
-  email TEXT NOT NULL,
-  password TEXT NOT NULL
-);
-
-CREATE TABLE blog (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  author_id INTEGER NOT NULL,
-  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  title TEXT NOT NULL,
-  body TEXT NOT NULL,
-  public BOOLEAN NOT NULL,
-  FOREIGN KEY (author_id) REFERENCES user (id)
-);
-
-CREATE TABLE comment (
-  id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
-  text TEXT NOT NULL,
-  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  author_id INTEGER NOT NULL,
-  blog_id INTEGER NOT NULL,
-  FOREIGN KEY (author_id) REFERENCES user (id) ON DELETE CASCADE,
-  FOREIGN KEY (blog_id) REFERENCES blog (id)ON DELETE CASCADE
-);
\ No newline at end of file
+DROP TABLE IF EXISTS blog;
+DROP TABLE IF EXISTS user;
+DROP TABLE IF EXISTS schema_version;
@@ -0,0 +1,182 @@
+import re
+
+import click
+from flask import Blueprint
+from flask import current_app
+from flask import g
+from flask import render_template
+from flask import request
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from markupsafe import escape
+
+from myblog.blog import VISIBLE
+from myblog.db import get_db
+from myblog.pagination import paginate
+from myblog.replica import get_read_db
+
+bp = Blueprint("search", __name__)
+
+# marks around the matched terms in snippets, replaced by <mark> tags
+# once the snippet has been escaped
+_OPEN, _CLOSE = "\x02", "\x03"
+
+# each match is ranked by BM25, with title terms weighing more than body
+# terms; a blog matched several times keeps its best rank (the lowest)
+# and the snippet of that match
+SEARCH_SQL = f"""
+WITH hit (blog_id, rank, snippet) AS (
+  SELECT rowid, bm25(blog_search, 10.0, 1.0),
+         snippet(blog_search, -1, '{_OPEN}', '{_CLOSE}', '…', 16)
+  FROM blog_search WHERE blog_search MATCH ?
+  UNION ALL
+  SELECT c.blog_id, bm25(comment_search),
+         snippet(comment_search, 0, '{_OPEN}', '{_CLOSE}', '…', 16)
+  FROM comment_search JOIN comment c ON c.id = comment_search.rowid
+  WHERE comment_search MATCH ?
+),
+best AS (
+  SELECT blog_id, MIN(rank) AS rank, snippet FROM hit GROUP BY blog_id
+)
+SELECT p.id, title, p.updated, author_id, username, best.rank, best.snippet
+FROM best JOIN blog p ON p.id = best.blog_id JOIN user u ON u.id = p.author_id
+WHERE {VISIBLE} {{seek}}
+ORDER BY best.rank {{order}}, p.id {{order}}
+LIMIT ?
+"""
+
+
+def match_query(text):
+    """Turn what the user typed into an FTS5 query matching blogs with
+    all of its words, so that no input is a syntax error.
+    """
+    words = re.findall(r"\w+", text)
+    return " ".join('"%s"' % word for word in words)
+
+
+def highlight(snippet):
+    """Escape a snippet and mark up the matched terms."""
+    return Markup(
+        str(escape(snippet)).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+    )
+
+
+def search_key(result):
+    """Sort key of a search result, as stored in its cursors."""
+    return result["rank"], result["id"]
+
+
+def search_blogs(text, token, size, db):
+    """Find the blogs visible to the current user whose title, body or
+    comments match ``text``, best match first.
+
+    :param token: the cursor of the page to load, or ``None``
+    :return: a :class:`~myblog.pagination.Page`
+    """
+    query = match_query(text)
+    user_id = g.user["id"] if g.user else None
+
+    def fetch(direction, start, limit):
+        if not query:
+            return []
+
+        params = [query, query, user_id]
+        seek = ""
+        if start is not None:
+            seek = "AND (best.rank, p.id) %s (?, ?)" % (
+                ">" if direction == "next" else "<"
+            )
+            params += start
+
+        sql = SEARCH_SQL.format(
+            seek=seek, order="ASC" if direction == "next" else "DESC"
+        )
+        return db.execute(sql, params + [limit]).fetchall()
+
+    return paginate(fetch, token, size, search_key)
+
+
+@bp.route("/search")
+def index():
+    """Show a page of the blogs matching the ``search`` query argument."""
+    search = request.args.get("search", "").strip()
+    page = search_blogs(
+        search,
+        request.args.get("cursor"),
+        current_app.config["SEARCH_RESULTS_PER_PAGE"],
+        get_read_db(),
+    )
+
+    return render_template(
+        "search/index.html",
+        search=search,
+        results=page,
+        page=page,
+        highlight=highlight,
+    )
+
+
+def reindex(chunk_size, echo=None):
+    """Rebuild the full-text indexes from the blog and comment tables.
+
+    Rows are reindexed ``chunk_size`` at a time by id range, each chunk
+    in its own short transaction, so the app keeps writing meanwhile and
+    an interrupted run can simply be started again.
+    """
+    db = get_db()
+
+    for table, index, columns in (
+        ("blog", "blog_search", "title, body"),
+        ("comment", "comment_search", "text"),
+    ):
+        last_id = 0
+        (max_id,) = db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()
+
+        while last_id < max_id:
+            (upper,) = db.execute(
+                f"SELECT MAX(id) FROM (SELECT id FROM {table}"
+                " WHERE id > ? ORDER BY id LIMIT ?)",
+                (last_id, chunk_size),
+            ).fetchone()
+
+            with db:
+                db.execute(
+                    f"DELETE FROM {index} WHERE rowid > ? AND rowid <= ?",
+                    (last_id, upper),
+                )
+                db.execute(
+                    f"INSERT INTO {index} (rowid, {columns})"
+                    f" SELECT id, {columns} FROM {table} WHERE id > ? AND id <= ?",
+                    (last_id, upper),
+                )
+
+            last_id = upper
+            if echo is not None:
+                echo(f"Indexed {table} rows up to id {last_id}.")
+
+        # drop leftovers of deleted rows, sparing rows indexed meanwhile
+        with db:
+            db.execute(
+                f"DELETE FROM {index} WHERE rowid > ?"
+                f" AND rowid NOT IN (SELECT id FROM {table} WHERE id > ?)",
+                (max_id, max_id),
+            )
+
+
+@click.command("search-reindex")
+@click.option(
+    "--chunk-size", default=1000, show_default=True, help="Rows per transaction."
+)
+@with_appcontext
+def reindex_command(chunk_size):
+    """Rebuild the full-text search indexes."""
+    reindex(chunk_size, echo=click.echo)
+    click.echo("Rebuilt the search indexes.")
+
+
+def init_app(app):
+    """Register the search settings and commands with the Flask app. This
+    is called by the application factory.
+    """
+    app.config.setdefault("SEARCH_RESULTS_PER_PAGE", 20)
+    app.cli.add_command(reindex_command)
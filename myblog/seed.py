@@ -0,0 +1,221 @@
+import datetime
+import random
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+from myblog.cache import invalidate
+from myblog.db import get_pool
+from myblog.render import derive
+from myblog.transfer import put_back
+from myblog.transfer import set_aside
+
+WORDS = (
+    "the of and to in is that for it as was with be by on not he this are or"
+    " his from at which but have an they you were her she there been one all"
+    " we their has would when if so no will more out up into do any your what"
+    " bread flour water salt yeast oven crust crumb dough loaf rye wheat starter"
+    " mountain trail river camp summit valley lake forest weather map compass"
+    " python flask sqlite query index cache request server thread process page"
+).split()
+
+# rows inserted by each executemany
+_BATCH = 5000
+
+
+def paragraph(rng, words):
+    """Make up ``words`` words of text in sentences."""
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(6, 18))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+
+    return " ".join(sentences)
+
+
+def seed(
+    users=100,
+    blogs=1000,
+    comments=5000,
+    public_ratio=0.8,
+    body_words=200,
+    comment_words=30,
+    password="password",
+    random_seed=0,
+):
+    """Add a synthetic dataset to the database, in bulk.
+
+    Users are named ``user<id>`` and all share ``password``, which is
+    hashed once with the configured method. Blogs and comments are spread
+    over the past year, bodies are ``body_words`` long on average, and
+    comments go mostly to a few popular blogs, as they do in real life.
+    The indexes and derived data are set aside for the load and rebuilt
+    after it, as by ``flask import``.
+
+    :return: the ids of the first user, blog and comment added
+    """
+    rng = random.Random(random_seed)
+    pwhash = generate_password_hash(
+        password,
+        current_app.config["PASSWORD_HASH_METHOD"],
+        current_app.config["PASSWORD_SALT_LENGTH"],
+    )
+    now = datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None, microsecond=0
+    )
+    year = 365 * 24 * 3600
+
+    def moment(after=None):
+        """A random time in the past year, or between ``after`` and now."""
+        if after is None:
+            return now - datetime.timedelta(seconds=rng.randrange(year))
+        span = int((now - after).total_seconds())
+        return after + datetime.timedelta(seconds=rng.randint(0, span))
+
+    conn = get_pool().connect()
+    conn.isolation_level = None
+
+    try:
+        set_aside(conn)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            first = {
+                table: conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM sqlite_sequence"
+                    " WHERE name = ?",
+                    (table,),
+                ).fetchone()[0]
+                for table in ("user", "blog", "comment")
+            }
+
+            def insert(sql, rows):
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == _BATCH:
+                        conn.executemany(sql, batch)
+                        batch = []
+                conn.executemany(sql, batch)
+
+            user_ids = range(first["user"], first["user"] + users)
+            insert(
+                "INSERT INTO user (id, username, email, password) VALUES (?, ?, ?, ?)",
+                (
+                    (n, f"user{n}", f"user{n}@example.com", pwhash)
+                    for n in user_ids
+                ),
+            )
+
+            created = {}
+
+            def blog_rows():
+                for n in range(first["blog"], first["blog"] + blogs):
+                    created[n] = moment()
+                    words = rng.randint(body_words // 2, body_words * 3 // 2 + 1)
+                    body = paragraph(rng, words)
+                    yield (
+                        n,
+                        rng.choice(user_ids),
+                        paragraph(rng, rng.randint(2, 8)).rstrip("."),
+                        body,
+                        *derive(body),
+                        rng.random() < public_ratio,
+                        str(created[n]),
+                        str(moment(created[n])),
+                    )
+
+            insert(
+                "INSERT INTO blog (id, author_id, title, body, excerpt, body_html,"
+                " word_count, public, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                blog_rows(),
+            )
+
+            def comment_rows():
+                for n in range(first["comment"], first["comment"] + comments):
+                    # the lower the id, the more popular the blog
+                    blog_id = first["blog"] + int(blogs * rng.random() ** 3)
+                    words = rng.randint(comment_words // 2, comment_words * 3 // 2 + 1)
+                    when = str(moment(created[blog_id]))
+                    yield (
+                        n,
+                        rng.choice(user_ids),
+                        blog_id,
+                        paragraph(rng, words),
+                        when,
+                        when,
+                    )
+
+            if blogs:
+                insert(
+                    "INSERT INTO comment"
+                    " (id, author_id, blog_id, text, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    comment_rows(),
+                )
+
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            put_back(conn)
+    finally:
+        conn.close()
+
+    invalidate("blogs")
+    return first["user"], first["blog"], first["comment"]
+
+
+@click.command("seed")
+@click.option("--users", default=100, show_default=True)
+@click.option("--blogs", default=1000, show_default=True)
+@click.option("--comments", default=5000, show_default=True)
+@click.option(
+    "--public-ratio",
+    default=0.8,
+    show_default=True,
+    type=click.FloatRange(0, 1),
+    help="Share of the blogs that are public.",
+)
+@click.option(
+    "--body-words", default=200, show_default=True, help="Average words per blog."
+)
+@click.option(
+    "--comment-words",
+    default=30,
+    show_default=True,
+    help="Average words per comment.",
+)
+@click.option(
+    "--password", default="password", show_default=True, help="Password of every user."
+)
+@click.option(
+    "--random-seed", default=0, show_default=True, help="Seed of the generator."
+)
+@with_appcontext
+def seed_command(**options):
+    """Add synthetic users, blogs and comments to the database."""
+    if options["blogs"] and not options["users"]:
+        raise click.BadParameter("Blogs need users.", param_hint="--blogs")
+    if options["comments"] and not options["blogs"]:
+        raise click.BadParameter("Comments need blogs.", param_hint="--comments")
+
+    seed(**options)
+    click.echo(
+        f"Added {options['users']} users, {options['blogs']} blogs"
+        f" and {options['comments']} comments."
+    )
+
+
+def init_app(app):
+    """Register the seed command with the Flask app. This is called by the
+    application factory.
+    """
+    app.cli.add_command(seed_command)
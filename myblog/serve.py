@@ -0,0 +1,464 @@
+import os
+import random
+import select
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask.cli import ScriptInfo
+from flask.cli import pass_script_info
+from werkzeug.serving import BaseWSGIServer
+from werkzeug.serving import WSGIRequestHandler
+
+from myblog.assets import check_assets
+from myblog.metrics import share_between_processes
+
+# seconds between two checks of a worker for a stop, and of the master
+# for its workers
+_POLL_INTERVAL = 0.5
+
+
+def make_socket(host, port, backlog=128):
+    """Bind the listening socket, once in the master, before the workers
+    are forked to share it.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return socket.create_server((host, port), family=family, backlog=backlog)
+
+
+# the app.extensions entries holding resources of the process that made
+# them, by name, with the function unpacking their value; see
+# closed_before_fork
+_closeables = {}
+
+
+def closed_before_fork(name, unpack):
+    """Register the ``app.extensions`` entry ``name`` as holding resources
+    that no forked worker may inherit, such as SQLite connections.
+
+    :param unpack: takes the value of the entry and returns the pid of
+        the process that made it and the function releasing it
+    """
+    _closeables[name] = unpack
+
+
+def close_connections(app):
+    """Release the resources the app made in this process, registered
+    with :func:`closed_before_fork`, so none of them is inherited by the
+    workers forked next. They make their own on first use, as the
+    extensions check the pid.
+    """
+    for name, unpack in _closeables.items():
+        value = app.extensions.get(name)
+        if value is None:
+            continue
+
+        pid, close = unpack(value)
+        if pid == os.getpid():
+            del app.extensions[name]
+            close()
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Handles the request of one connection, which Werkzeug closes after
+    it, dropping clients silent for the server's ``timeout`` seconds.
+    """
+
+    def setup(self):
+        self.timeout = self.server.timeout
+        super().setup()
+
+    def run_wsgi(self):
+        try:
+            super().run_wsgi()
+        finally:
+            self.server.request_done()
+
+
+class WorkerServer(BaseWSGIServer):
+    """The server of a worker process, handling connections on the
+    listening socket it shares with the other workers, one per thread.
+
+    A connection is only accepted while a thread is free to handle it,
+    so the busy workers leave the waiting ones to the idle workers.
+    After ``max_requests`` requests, if set, the worker stops.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, sock, app, threads, max_requests=0, timeout=30):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        # the workers race for each connection, the losers get EAGAIN
+        self.socket.setblocking(False)
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.requests = 0
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._free = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="myblog-serve")
+
+    def request_done(self):
+        with self._lock:
+            self.requests += 1
+            if self.max_requests and self.requests >= self.max_requests:
+                self.stopping.set()
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free.release()
+
+    def serve(self, parent):
+        """Accept connections until :attr:`stopping` is set, or the master
+        ``parent`` is gone, then wait for the requests in progress.
+        """
+
+        def done():
+            return self.stopping.is_set() or os.getppid() != parent
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+
+            while not done():
+                if not self._free.acquire(timeout=_POLL_INTERVAL):
+                    continue
+
+                request = None
+                try:
+                    if not done() and selector.select(_POLL_INTERVAL):
+                        request, client_address = self.get_request()
+                except OSError:
+                    # another worker accepted the connection first
+                    pass
+
+                if request is None:
+                    self._free.release()
+                else:
+                    self._executor.submit(self._handle, request, client_address)
+
+        self.server_close()
+        self._executor.shutdown(wait=True)
+
+
+class Arbiter:
+    """The master process, keeping ``workers`` processes forked from the
+    preloaded ``app`` serving the listening socket ``sock``.
+
+    Workers that exit, whether they crashed or served their
+    ``max_requests``, are replaced. ``SIGHUP`` loads the app again with
+    ``load_app`` and replaces every worker, the old ones finishing their
+    requests first; ``SIGTERM`` and ``SIGINT`` stop them that way and
+    exit, a second ``SIGINT`` kills them. A worker still busy
+    ``graceful_timeout`` seconds after it was told to stop is killed.
+    """
+
+    def __init__(
+        self,
+        app,
+        load_app,
+        sock,
+        workers,
+        threads,
+        max_requests=0,
+        max_requests_jitter=0,
+        graceful_timeout=30,
+        timeout=30,
+    ):
+        self.app = app
+        self.load_app = load_app
+        self.sock = sock
+        self.num_workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.timeout = timeout
+        self.pid = os.getpid()
+        # pids of the serving workers, and when they started
+        self.workers = {}
+        # pids of the stopping workers, and when they are killed
+        self.retiring = {}
+        self.stopping = False
+        self._signals = []
+        self._spawn_after = 0
+        self._pipe = None
+
+    def run(self):
+        """Serve until told to stop, and all the workers have exited."""
+        wakeup, wakeup_write = os.pipe()
+        os.set_blocking(wakeup, False)
+        os.set_blocking(wakeup_write, False)
+        self._pipe = (wakeup, wakeup_write)
+        old_wakeup = signal.set_wakeup_fd(wakeup_write)
+        handled = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD)
+        old_handlers = {
+            signum: signal.signal(signum, self._signal) for signum in handled
+        }
+
+        try:
+            while True:
+                self.handle_signals()
+                self.reap()
+                self.kill_overdue()
+
+                if self.stopping:
+                    if not self.workers and not self.retiring:
+                        return
+                else:
+                    self.spawn_missing()
+
+                # sleep until a signal, a worker exiting included, or the
+                # next check
+                select.select([wakeup], [], [], _POLL_INTERVAL)
+                try:
+                    while os.read(wakeup, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+        finally:
+            signal.set_wakeup_fd(old_wakeup)
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+            os.close(wakeup)
+            os.close(wakeup_write)
+
+    def _signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def handle_signals(self):
+        while self._signals:
+            signum = self._signals.pop(0)
+
+            if signum == signal.SIGHUP:
+                self.reload()
+            elif signum in (signal.SIGTERM, signal.SIGINT):
+                if self.stopping and signum == signal.SIGINT:
+                    click.echo("Killing the workers.")
+                    for pid in self.retiring:
+                        self.retiring[pid] = 0
+                elif not self.stopping:
+                    click.echo("Stopping the workers.")
+                    self.stopping = True
+                    for pid in list(self.workers):
+                        self.retire(pid)
+
+    def reload(self):
+        """Load the app again, and replace the workers with new ones
+        forked from it.
+        """
+        try:
+            app = self.load_app()
+        except Exception:
+            traceback.print_exc()
+            click.echo("Could not load the app, the workers keep running.")
+            return
+
+        click.echo("Reloading the app.")
+        self.app = app
+        old = list(self.workers)
+        for _ in range(self.num_workers):
+            self.spawn()
+        for pid in old:
+            self.retire(pid)
+
+    def retire(self, pid):
+        """Tell a worker to finish its requests and exit."""
+        self.workers.pop(pid, None)
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in self.retiring.items():
+            if deadline <= now:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        """Collect the workers that exited."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            if self.retiring.pop(pid, None) is not None:
+                continue
+
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code == 0:
+                click.echo(f"Worker {pid} served its requests, replacing it.")
+            else:
+                reason = f"signal {-code}" if code < 0 else f"exit code {code}"
+                click.echo(f"Worker {pid} died with {reason}, replacing it.")
+                # don't fork in a loop when the workers crash on start
+                if time.monotonic() - started < 1:
+                    self._spawn_after = time.monotonic() + 1
+
+    def spawn_missing(self):
+        if time.monotonic() < self._spawn_after:
+            return
+
+        while len(self.workers) < self.num_workers:
+            self.spawn()
+
+    def spawn(self):
+        """Fork a worker from the app."""
+        max_requests = self.max_requests
+        if max_requests:
+            # so the workers aren't all replaced at once
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        close_connections(self.app)
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+
+        code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self._pipe[0])
+            os.close(self._pipe[1])
+            for signum in (signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+
+            server = WorkerServer(
+                self.sock,
+                self.app,
+                self.threads,
+                max_requests,
+                self.timeout,
+            )
+
+            def stop(signum, frame):
+                server.stopping.set()
+
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+            server.serve(self.pid)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+
+@click.command("serve")
+@click.option("--host", "-h", default="127.0.0.1", help="The interface to bind to.")
+@click.option("--port", "-p", default=8000, help="The port to bind to.")
+@click.option("--workers", "-w", type=int, help="Worker processes, one per CPU by default.")
+@click.option("--threads", "-t", type=int, help="Threads of each worker.")
+@click.option(
+    "--max-requests",
+    type=int,
+    help="Requests a worker serves before it is replaced, 0 for no limit.",
+)
+@pass_script_info
+def serve_command(info, host, port, workers, threads, max_requests):
+    """Serve the app with several processes, forked from it once it is
+    loaded. SIGHUP loads it again and replaces them gracefully.
+    """
+    app = info.load_app()
+    config = app.config
+
+    def load_app():
+        new_app = ScriptInfo(
+            app_import_path=info.app_import_path,
+            create_app=info.create_app,
+            set_debug_flag=False,
+        ).load_app()
+        new_app.config["SERVE_WORKERS"] = workers
+        share_between_processes(new_app)
+        check_assets(new_app)
+        return new_app
+
+    try:
+        check_assets(app)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    workers = workers or config["SERVE_WORKERS"] or os.cpu_count() or 1
+    # the resources made per process, such as the hasher's, are sized by it
+    config["SERVE_WORKERS"] = workers
+    # whichever worker answers /metrics serves those of all of them
+    share_between_processes(app, reset=True)
+    threads = threads or config["SERVE_THREADS"]
+    if max_requests is None:
+        max_requests = config["SERVE_MAX_REQUESTS"]
+
+    try:
+        sock = make_socket(host, port, config["SERVE_BACKLOG"])
+    except OSError as e:
+        raise click.ClickException(f"Could not listen on {host}:{port}: {e}")
+
+    with sock:
+        host, port = sock.getsockname()[:2]
+        click.echo(
+            f"Serving on http://{host}:{port} with {workers} workers"
+            f" of {threads} threads, master pid {os.getpid()}."
+        )
+        Arbiter(
+            app,
+            load_app,
+            sock,
+            workers,
+            threads,
+            max_requests,
+            config["SERVE_MAX_REQUESTS_JITTER"],
+            config["SERVE_GRACEFUL_TIMEOUT"],
+            config["SERVE_TIMEOUT"],
+        ).run()
+
+
+def init_app(app):
+    """Register the server settings and command with the Flask app. This
+    is called by the application factory.
+    """
+    # worker processes of "flask serve", by default one per CPU, and the
+    # requests each of them handles at once, one per thread
+    app.config.setdefault("SERVE_WORKERS", None)
+    app.config.setdefault("SERVE_THREADS", 4)
+    # requests a worker serves before it is replaced, to bound the growth
+    # of its memory, plus up to the jitter so they aren't all replaced at
+    # once; 0 keeps them
+    app.config.setdefault("SERVE_MAX_REQUESTS", 10000)
+    app.config.setdefault("SERVE_MAX_REQUESTS_JITTER", 1000)
+    # seconds a stopping worker has to finish its requests before it is
+    # killed
+    app.config.setdefault("SERVE_GRACEFUL_TIMEOUT", 30)
+    # seconds a client may stay silent while it holds a thread
+    app.config.setdefault("SERVE_TIMEOUT", 30)
+    # connections waiting for a free worker
+    app.config.setdefault("SERVE_BACKLOG", 128)
+
+    app.cli.add_command(serve_command)
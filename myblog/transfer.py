@@ -0,0 +1,457 @@
+import gzip
+import json
+import os
+import sqlite3
+
+import click
+from flask.cli import with_appcontext
+
+from myblog.cache import invalidate
+from myblog.db import get_pool
+from myblog.render import derive
+from myblog.search import reindex
+
+# the fields of each kind of record, in the order the kinds are exported
+# and must be imported
+FIELDS = {
+    "user": ("id", "username", "email", "password"),
+    "blog": ("id", "author_id", "created", "updated", "title", "body", "public"),
+    "comment": ("id", "author_id", "blog_id", "created", "updated", "text"),
+}
+
+# the fields of each kind that refer to records imported before it
+REFERENCES = {
+    "user": {},
+    "blog": {"author_id": "user"},
+    "comment": {"author_id": "user", "blog_id": "blog"},
+}
+
+# columns computed from the body of the imported blogs, by derive()
+DERIVED_COLUMNS = ("excerpt", "body_html", "word_count")
+
+# triggers maintaining derived data, which is rebuilt after a load
+DERIVED_TRIGGERS = ("blog_search_", "comment_search_", "blog_comment_count_")
+
+# most parameters bound to one IN list
+_IN_CHUNK = 500
+
+
+def open_dump(path, mode):
+    """Open a JSONL dump for reading (``"r"``) or writing (``"w"``) text,
+    gzipped if ``path`` ends with ``.gz``.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf8")
+
+    return open(path, mode, encoding="utf8")
+
+
+def export_data(fp):
+    """Write every user, blog and comment to ``fp`` as JSON lines.
+
+    The rows are streamed from one read transaction, so the dump is a
+    consistent snapshot of the database, and in WAL mode the app keeps
+    writing meanwhile.
+
+    :return: the number of records of each kind
+    """
+    conn = get_pool().connect()
+    conn.isolation_level = None
+    counts = dict.fromkeys(FIELDS, 0)
+
+    try:
+        conn.execute("BEGIN")
+
+        for kind, fields in FIELDS.items():
+            rows = conn.execute(f"SELECT {', '.join(fields)} FROM {kind} ORDER BY id")
+
+            for row in rows:
+                record = {"type": kind, **dict(zip(fields, row))}
+                fp.write(json.dumps(record, default=str) + "\n")
+                counts[kind] += 1
+
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    return counts
+
+
+def parse_record(line, number):
+    """Parse one line of a dump.
+
+    :raise ValueError: if it isn't a complete record
+    """
+    try:
+        record = json.loads(line)
+        fields = FIELDS[record["type"]]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Line {number} is not a user, blog or comment record.")
+
+    missing = [field for field in fields if field not in record]
+    if missing:
+        raise ValueError(f"Line {number} lacks {', '.join(missing)}.")
+
+    return record
+
+
+def set_aside(conn):
+    """Drop the non-unique indexes of the content tables and the triggers
+    maintaining derived data, keeping their definitions in
+    ``import_deferred``. The unique indexes stay, to enforce their
+    constraints during the load.
+    """
+    triggers = " OR ".join("name LIKE ?" for prefix in DERIVED_TRIGGERS)
+    conn.execute("BEGIN IMMEDIATE")
+    objects = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master"
+        " WHERE tbl_name IN ('user', 'blog', 'comment') AND sql IS NOT NULL"
+        " AND (type = 'index' AND sql NOT LIKE 'CREATE UNIQUE %'"
+        f" OR type = 'trigger' AND ({triggers}))",
+        [prefix + "%" for prefix in DERIVED_TRIGGERS],
+    ).fetchall()
+
+    for kind, name, sql in objects:
+        conn.execute(
+            "INSERT OR REPLACE INTO import_deferred (name, sql) VALUES (?, ?)",
+            (name, sql),
+        )
+        conn.execute(f"DROP {kind.upper()} {name}")
+
+    conn.execute("COMMIT")
+
+
+def put_back(conn, rebuild=True):
+    """Recreate what :func:`set_aside` dropped, by this or an interrupted
+    import, and with ``rebuild``, the comment counts and search indexes,
+    which an import that loaded nothing can skip.
+
+    :return: whether anything was put back
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    deferred = conn.execute("SELECT name, sql FROM import_deferred").fetchall()
+
+    for name, sql in deferred:
+        conn.execute(sql)
+
+    if deferred:
+        conn.execute("DELETE FROM import_deferred")
+
+    if deferred and rebuild:
+        conn.execute(
+            "UPDATE blog SET comment_count ="
+            " (SELECT COUNT(*) FROM comment WHERE comment.blog_id = blog.id)"
+        )
+
+    conn.execute("COMMIT")
+
+    if deferred and rebuild:
+        # the triggers exist again, so rows written from now on are
+        # indexed by them and the rebuild doesn't miss any
+        reindex(chunk_size=5000)
+
+    return bool(deferred)
+
+
+class Importer:
+    """Loads records of one source in batches, giving them new ids.
+
+    Every record gets the next free id of its table, and the mapping from
+    its id in the source is kept in ``import_id_map``, which is how the
+    references of later records are translated. A user whose username
+    already exists is mapped to that user instead of being added.
+    Records already mapped are skipped, and so are records referring to
+    one that wasn't imported. A new user whose email is taken is skipped
+    too, and described in :attr:`conflicts`.
+    """
+
+    def __init__(self, conn, source):
+        self.conn = conn
+        self.source = source
+        self.imported = dict.fromkeys(FIELDS, 0)
+        self.skipped = 0
+        self.conflicts = []
+
+    def lookup(self, kind, old_ids):
+        """Map the given source ids of ``kind`` records to their new ids."""
+        old_ids = list(old_ids)
+        found = {}
+
+        for i in range(0, len(old_ids), _IN_CHUNK):
+            chunk = old_ids[i : i + _IN_CHUNK]
+            found.update(
+                self.conn.execute(
+                    "SELECT old_id, new_id FROM import_id_map"
+                    " WHERE source = ? AND kind = ? AND old_id IN (%s)"
+                    % ", ".join("?" * len(chunk)),
+                    (self.source, kind, *chunk),
+                )
+            )
+
+        return found
+
+    def existing_users(self, values, column="username"):
+        """Map the given values of a unique ``column`` of existing users
+        to their ids.
+        """
+        values = list(values)
+        found = {}
+
+        for i in range(0, len(values), _IN_CHUNK):
+            chunk = values[i : i + _IN_CHUNK]
+            found.update(
+                self.conn.execute(
+                    f"SELECT {column}, id FROM user WHERE {column} IN (%s)"
+                    % ", ".join("?" * len(chunk)),
+                    chunk,
+                )
+            )
+
+        return found
+
+    def last_id(self, kind):
+        """The highest id ever given in a table, which new rows follow."""
+        (last,) = self.conn.execute(
+            "SELECT MAX("
+            " COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),"
+            f" COALESCE((SELECT MAX(id) FROM {kind}), 0))",
+            (kind,),
+        ).fetchone()
+        return last
+
+    def load(self, kind, records):
+        """Insert a batch of ``kind`` records with ``executemany``."""
+        mapped = self.lookup(kind, (record["id"] for record in records))
+        references = {
+            field: self.lookup(target, {record[field] for record in records})
+            for field, target in REFERENCES[kind].items()
+        }
+        existing = {}
+        emails = {}
+        if kind == "user":
+            existing = self.existing_users(record["username"] for record in records)
+            emails = self.existing_users(
+                {record["email"] for record in records}, "email"
+            )
+
+        fields = FIELDS[kind]
+        columns = fields + DERIVED_COLUMNS if kind == "blog" else fields
+        rows = []
+        mapping = []
+        new_id = self.last_id(kind)
+
+        for record in records:
+            if record["id"] in mapped or any(
+                record[field] not in ids for field, ids in references.items()
+            ):
+                self.skipped += 1
+                continue
+
+            values = {field: record[field] for field in fields}
+            for field, ids in references.items():
+                values[field] = ids[record[field]]
+
+            if kind == "user" and record["username"] in existing:
+                mapping.append(
+                    (self.source, kind, record["id"], existing[record["username"]])
+                )
+                self.skipped += 1
+                continue
+
+            if kind == "user":
+                if record["email"] in emails:
+                    self.conflicts.append(
+                        f"User {record['username']!r} was skipped, the email"
+                        f" {record['email']!r} is taken."
+                    )
+                    self.skipped += 1
+                    continue
+
+            new_id += 1
+            values["id"] = new_id
+            if kind == "user":
+                # the later records of the batch meet this one
+                existing[record["username"]] = emails[record["email"]] = new_id
+            mapping.append((self.source, kind, record["id"], new_id))
+            row = tuple(values[field] for field in fields)
+            if kind == "blog":
+                row += derive(values["body"])
+            rows.append(row)
+
+        self.conn.executemany(
+            f"INSERT INTO {kind} ({', '.join(columns)})"
+            f" VALUES ({', '.join('?' * len(columns))})",
+            rows,
+        )
+        self.conn.executemany(
+            "INSERT INTO import_id_map (source, kind, old_id, new_id)"
+            " VALUES (?, ?, ?, ?)",
+            mapping,
+        )
+        self.imported[kind] += len(rows)
+
+    def checkpoint(self, line, done=False):
+        self.conn.execute(
+            "INSERT INTO import_checkpoint (source, line, done) VALUES (?, ?, ?)"
+            " ON CONFLICT (source) DO UPDATE SET line = excluded.line,"
+            " done = excluded.done, updated = CURRENT_TIMESTAMP",
+            (self.source, line, done),
+        )
+
+
+def import_data(fp, source, batch_size=1000, commit_every=50000, defer=True):
+    """Load the JSON lines of a dump made by :func:`export_data`.
+
+    Records are inserted ``batch_size`` at a time, and committed with a
+    checkpoint every ``commit_every`` lines, so that running the import
+    of the same ``source`` again resumes after the last checkpoint. With
+    ``defer``, the indexes and triggers that need not be maintained row
+    by row are dropped for the load and rebuilt in one go at the end,
+    even if the load fails.
+
+    :return: the :class:`Importer`, or ``None`` if ``source`` was
+        already imported
+    :raise ValueError: if a line is not a record
+    :raise sqlite3.IntegrityError: if a record breaks another constraint
+    """
+    conn = get_pool().connect()
+    conn.isolation_level = None
+    importer = Importer(conn, source)
+
+    try:
+        row = conn.execute(
+            "SELECT line, done FROM import_checkpoint WHERE source = ?", (source,)
+        ).fetchone()
+        if row is not None and row["done"]:
+            return None
+
+        start = row["line"] if row is not None else 0
+        # whether rows were committed, by this run or an interrupted one,
+        # that the rebuild must cover
+        loaded = start > 0
+        if defer:
+            set_aside(conn)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            kind = None
+            records = []
+            committed = start
+            number = start
+
+            for number, line in enumerate(fp, 1):
+                if number <= start or not line.strip():
+                    continue
+
+                record = parse_record(line, number)
+                if records and (record["type"] != kind or len(records) >= batch_size):
+                    importer.load(kind, records)
+                    records = []
+
+                kind = record["type"]
+                records.append(record)
+
+                if number - committed >= commit_every:
+                    importer.load(kind, records)
+                    records = []
+                    importer.checkpoint(number)
+                    conn.execute("COMMIT")
+                    loaded = True
+                    conn.execute("BEGIN IMMEDIATE")
+                    committed = number
+
+            if records:
+                importer.load(kind, records)
+
+            importer.checkpoint(number, done=True)
+            conn.execute("COMMIT")
+            loaded = True
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            put_back(conn, rebuild=loaded)
+    finally:
+        conn.close()
+
+    invalidate("blogs")
+    return importer
+
+
+@click.command("export")
+@click.argument("path")
+@with_appcontext
+def export_command(path):
+    """Dump the users, blogs and comments to PATH as JSON lines, gzipped
+    if PATH ends with .gz.
+    """
+    with open_dump(path, "w") as f:
+        counts = export_data(f)
+
+    click.echo(
+        "Exported {user} users, {blog} blogs and {comment} comments.".format(**counts)
+    )
+
+
+@click.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--source", help="Name of the import to resume, by default the file's path."
+)
+@click.option(
+    "--batch-size", default=1000, show_default=True, help="Rows per insert batch."
+)
+@click.option(
+    "--commit-every",
+    default=50000,
+    show_default=True,
+    help="Lines per transaction and checkpoint.",
+)
+@click.option(
+    "--defer/--no-defer",
+    default=True,
+    show_default=True,
+    help="Rebuild the indexes, search index and comment counts after the load.",
+)
+@with_appcontext
+def import_command(path, source, batch_size, commit_every, defer):
+    """Load users, blogs and comments from a dump made by export.
+
+    New ids are given to the records; users whose username exists are
+    merged with the existing ones. An interrupted import resumes when it
+    is run again.
+    """
+    source = source or os.path.abspath(path)
+
+    try:
+        with open_dump(path, "r") as f:
+            importer = import_data(f, source, batch_size, commit_every, defer)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except sqlite3.IntegrityError as e:
+        raise click.ClickException(
+            f"Could not import {path}, a record conflicts with the data: {e}"
+        )
+
+    if importer is None:
+        click.echo(f"{source} was already imported.")
+        return
+
+    for conflict in importer.conflicts:
+        click.echo(conflict)
+
+    click.echo(
+        "Imported {user} users, {blog} blogs and {comment} comments".format(
+            **importer.imported
+        )
+        + f", skipped {importer.skipped} records."
+    )
+
+
+def init_app(app):
+    """Register the import and export commands with the Flask app. This
+    is called by the application factory.
+    """
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
@@ -0,0 +1,236 @@
+import collections
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from myblog.db import get_db
+from myblog.db import get_pool
+from myblog.identity import clear_identity_map
+from myblog.replica import note_write
+
+_writer_lock = threading.Lock()
+
+#: what :func:`execute_write` returns for a write statement
+WriteResult = collections.namedtuple("WriteResult", "lastrowid rowcount")
+
+
+class Writer:
+    """A thread owning the only write connection of a process.
+
+    Write operations are queued with :meth:`submit`. The thread takes
+    every operation that arrives within ``window`` seconds of the first
+    one, up to ``max_batch`` of them, and applies the batch in a single
+    transaction: one lock acquisition and one fsync for all of them
+    (group commit). Each operation runs in its own savepoint, so one
+    that fails is rolled back alone and its error is reported only to
+    its submitter.
+    """
+
+    def __init__(self, connect, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.pid = os.getpid()
+        self.stats = {
+            "batches": 0,
+            "operations": 0,
+            "largest_batch": 0,
+            "queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+        }
+        self._connect = connect
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="myblog-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, operation):
+        """Queue ``operation(conn)`` to run on the write connection.
+
+        :return: a future resolved with what the operation returns, or
+            the error it raises, once its batch has been committed
+        """
+        future = Future()
+        self._queue.put((operation, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        conn = None
+
+        while True:
+            batch = self._next_batch()
+
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    # transactions are managed explicitly, one per batch
+                    conn.isolation_level = None
+
+                self._apply(conn, batch)
+            except Exception as e:
+                # the thread must survive, or every later write would wait
+                # for its timeout; the connection is made again in a known
+                # state, any transaction left open rolled back
+                for operation, future, queued in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+                    conn = None
+
+    def _next_batch(self):
+        """Wait for an operation, then take those arriving within the
+        window, up to ``max_batch``.
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.perf_counter()
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _apply(self, conn, batch):
+        started = time.perf_counter()
+        outcomes = []
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            for operation, future, queued in batch:
+                wait = started - queued
+                self.stats["queue_wait_seconds"] += wait
+                self.stats["max_queue_wait_seconds"] = max(
+                    self.stats["max_queue_wait_seconds"], wait
+                )
+
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                conn.execute("SAVEPOINT operation")
+                try:
+                    result = operation(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operation")
+                    conn.execute("RELEASE operation")
+                    outcomes.append((future, e, False))
+                else:
+                    conn.execute("RELEASE operation")
+                    outcomes.append((future, result, True))
+
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # the batch could not be committed, so nothing in it happened
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+            # including those never started because BEGIN failed
+            for operation, future, queued in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+            return
+
+        for future, value, ok in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        self.stats["batches"] += 1
+        self.stats["operations"] += len(batch)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+
+
+def get_writer():
+    """Get the writer of the current app in this process, starting it on
+    first use. A writer inherited through ``fork`` is replaced, since its
+    thread does not exist in the child.
+    """
+    writer = current_app.extensions.get("myblog.writer")
+
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            writer = current_app.extensions.get("myblog.writer")
+
+            if writer is None or writer.pid != os.getpid():
+                config = current_app.config
+                writer = Writer(
+                    get_pool().connect,
+                    config["WRITER_BATCH_WINDOW"],
+                    config["WRITER_MAX_BATCH"],
+                )
+                current_app.extensions["myblog.writer"] = writer
+
+    return writer
+
+
+def write(operation):
+    """Run ``operation(conn)`` as a committed write and wait for it.
+
+    The operation goes through the writer thread, or runs directly on the
+    request's connection if ``WRITER_ENABLED`` is off. Rows the request
+    loaded through the identity map are forgotten afterwards.
+
+    :return: what the operation returned
+    :raise: whatever the operation or the commit raised
+    """
+    if not current_app.config["WRITER_ENABLED"]:
+        db = get_db()
+        try:
+            result = operation(db)
+        except Exception:
+            db.rollback()
+            raise
+        db.commit()
+    else:
+        future = get_writer().submit(operation)
+        result = future.result(current_app.config["WRITER_TIMEOUT"])
+
+    note_write()
+    clear_identity_map()
+    return result
+
+
+def execute_write(sql, parameters=()):
+    """Run a single write statement with :func:`write`.
+
+    :return: a :data:`WriteResult` with the row id and count of the
+        statement
+    """
+
+    def operation(db):
+        cursor = db.execute(sql, parameters)
+        return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+    return write(operation)
+
+
+def init_app(app):
+    """Register the writer settings with the Flask app. This is called by
+    the application factory.
+    """
+    # send writes through a single writer thread with group commit
+    app.config.setdefault("WRITER_ENABLED", True)
+    # seconds to wait for more writes to join a batch
+    app.config.setdefault("WRITER_BATCH_WINDOW", 0.002)
+    # maximum number of writes in a batch
+    app.config.setdefault("WRITER_MAX_BATCH", 64)
+    # seconds a request waits for its write to be committed
+    app.config.setdefault("WRITER_TIMEOUT", 30)
@@ -1,4 +1,5 @@
 import os
+import re
 import tempfile
 
 import pytest
@@ -18,7 +19,19 @@ def app():
     # create a temporary file to isolate the database for each test
     db_fd, db_path = tempfile.mkstemp()
     # create the app with common test config
-    app = create_app({"TESTING": True, "DATABASE": db_path})
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": db_path,
+            # the method and salt length of the hashes in data.sql, hashed on
+            # the test thread
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:50000",
+            "PASSWORD_SALT_LENGTH": 8,
+            "PASSWORD_HASH_WORKERS": 0,
+            # the tests that need the outbox thread turn it on
+            "OUTBOX_BACKGROUND": False,
+        }
+    )
 
     # create the database and load test data
     with app.app_context():
@@ -48,8 +61,20 @@ class AuthActions:
     def __init__(self, client):
         self._client = client
 
+    def csrf_token(self, path):
+        """Render the form at ``path`` and return its CSRF token."""
+        response = self._client.get(path)
+        return re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"',
+                         response.data).group(1).decode()
+
+    def post(self, path, data, form_path=None):
+        """Submit ``data`` to ``path`` with a valid CSRF token taken from
+        the form rendered at ``form_path`` (``path`` by default)."""
+        data = dict(data, csrf_token=self.csrf_token(form_path or path))
+        return self._client.post(path, data=data)
+
     def login(self, username="test", password="test"):
-        return self._client.blog(
+        return self.post(
             "/auth/login", data={"username": username, "password": password}
         )
 
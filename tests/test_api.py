@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from myblog.db import get_db
+
+
+@pytest.fixture
+def blogs(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE blog SET updated = '2018-01-01 00:00:00'")
+        db.executemany(
+            "INSERT INTO blog (title, body, author_id, public, updated)"
+            " VALUES (?, 'x', ?, ?, ?)",
+            [
+                ("second", 1, 1, "2019-01-01 00:00:00"),
+                ("secret", 2, 0, "2019-01-02 00:00:00"),
+                ("third", 2, 1, "2019-01-02 00:00:00"),
+            ],
+        )
+        db.executemany(
+            "INSERT INTO comment (text, author_id, blog_id, created) VALUES (?, 2, 1, ?)",
+            [("old", "2019-01-01 00:00:00"), ("new", "2019-02-01 00:00:00")],
+        )
+        db.commit()
+
+
+def lines(response):
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+def test_blogs_json(client, blogs):
+    response = client.get("/api/blogs")
+    assert response.mimetype == "application/json"
+    assert response.is_streamed
+
+    data = response.get_json()
+    assert [blog["title"] for blog in data["blogs"]] == ["test title", "second", "third"]
+    assert data["next_cursor"] is None
+    assert data["blogs"][0] == {
+        "id": 1,
+        "title": "test title",
+        "body": "test\nbody",
+        "author_id": 1,
+        "author": "test",
+        "public": 1,
+        "created": "2018-01-01T00:00:00",
+        "updated": "2018-01-01T00:00:00",
+        "comment_count": 2,
+    }
+
+
+def test_blogs_ndjson(client, auth, blogs):
+    auth.login("other", "other")
+    response = client.get(
+        "/api/blogs?fields=id,title", headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.mimetype == "application/x-ndjson"
+    # the author's private blog is listed too, and only the asked fields
+    assert lines(response) == [
+        {"id": 1, "title": "test title"},
+        {"id": 2, "title": "second"},
+        {"id": 3, "title": "secret"},
+        {"id": 4, "title": "third"},
+    ]
+
+
+@pytest.mark.parametrize("format", ("json", "ndjson"))
+def test_blogs_cursor(app, client, blogs, format):
+    # small chunks, so that the extra row arrives in a chunk of its own
+    app.config["API_CHUNK_ROWS"] = 2
+    seen = []
+    cursor = ""
+
+    while cursor is not None:
+        response = client.get(
+            "/api/blogs", query_string={"format": format, "limit": 2, "cursor": cursor}
+        )
+        if format == "json":
+            data = response.get_json()
+            records, cursor = data["blogs"], data["next_cursor"]
+        else:
+            records = lines(response)
+            cursor = records.pop()["next_cursor"] if "next_cursor" in records[-1] else None
+        seen += [record["id"] for record in records]
+
+    assert seen == [1, 2, 4]
+
+
+def test_blogs_updated_since(client, blogs):
+    response = client.get("/api/blogs?format=ndjson&fields=id&updated_since=2019-01-01")
+    assert lines(response) == [{"id": 2}, {"id": 4}]
+
+    response = client.get(
+        "/api/blogs?format=ndjson&fields=id&updated_since=2019-01-02T01:00:00%2B01:00"
+    )
+    assert lines(response) == [{"id": 4}]
+
+
+@pytest.mark.parametrize(
+    "query",
+    ("fields=id,password", "updated_since=yesterday", "limit=0", "cursor=x", "format=xml"),
+)
+def test_invalid_arguments(client, query):
+    assert client.get("/api/blogs?" + query).status_code == 400
+
+
+def test_comments(client, blogs):
+    response = client.get("/api/blogs/1/comments?format=ndjson&fields=text")
+    assert lines(response) == [{"text": "old"}, {"text": "new"}]
+
+    response = client.get("/api/blogs/1/comments?updated_since=2019-01-15")
+    assert [c["text"] for c in response.get_json()["comments"]] == ["new"]
+
+
+def test_comments_follow_blog_visibility(client, blogs):
+    assert client.get("/api/blogs/3/comments").status_code == 403
+    assert client.get("/api/blogs/42/comments").status_code == 404
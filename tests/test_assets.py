@@ -0,0 +1,144 @@
+import gzip
+import json
+import os
+import re
+
+import pytest
+
+from myblog import assets
+
+VENDOR_URL = "https://cdn.example.com/lib/css/lib.css"
+
+
+@pytest.fixture
+def static(app, tmp_path):
+    """A static folder with an app stylesheet and script, and a library
+    stylesheet that was vendored already.
+    """
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "bg.png").write_bytes(b"\x89PNG fake")
+    (tmp_path / "style.css").write_text(
+        "body { background: url('/static/img/bg.png'); }\n"
+        + "p { color: red; }\n" * 50
+    )
+    (tmp_path / "app.js").write_text("var a = 1\n")
+    (tmp_path / "more.js").write_text("var b = 2;\n//# sourceMappingURL=more.js.map\n")
+
+    vendored = assets.vendor_path(str(tmp_path), VENDOR_URL)
+    os.makedirs(os.path.dirname(vendored))
+    with open(vendored, "w") as f:
+        f.write('.icon { src: url("../fonts/icons.woff2?v=1#x"), url(data:abc); }')
+    font = assets.vendor_path(
+        str(tmp_path), "https://cdn.example.com/lib/fonts/icons.woff2"
+    )
+    os.makedirs(os.path.dirname(font))
+    with open(font, "wb") as f:
+        f.write(b"wOF2")
+
+    app.static_folder = str(tmp_path)
+    app.config["ASSETS_BUNDLES"] = {
+        "vendor.css": (VENDOR_URL,),
+        "app.css": ("style.css",),
+        "app.js": ("app.js", "more.js"),
+    }
+    return tmp_path
+
+
+def built(static, name):
+    with open(static / "dist" / "manifest.json") as f:
+        return static / json.load(f)["bundles"][name]
+
+
+def test_unbuilt_assets_load_sources(app, client):
+    response = client.get("/auth/login")
+    assert b"https://maxcdn.bootstrapcdn.com/bootstrap/" in response.data
+    assert b'<script src="/static/app.js"></script>' in response.data
+
+
+def test_unbuilt_assets_fail_in_production(app, caplog):
+    app.testing = False
+    with pytest.raises(RuntimeError, match="flask assets-build"):
+        assets.check_assets(app)
+
+    # served otherwise, the pages load the sources and it is logged once
+    with app.test_request_context():
+        assert assets.asset_urls("app.js") == ["/static/app.js"]
+        assets.asset_urls("app.css")
+    assert len([r for r in caplog.records if "isn't built" in r.message]) == 1
+
+    app.config["ASSETS_SOURCES_FALLBACK"] = True
+    assets.check_assets(app)
+
+
+def test_built_assets_pass_the_check(app, runner, static):
+    app.testing = False
+    runner.invoke(args=["assets-build"])
+    assets.check_assets(app)
+
+
+def test_build(app, runner, static):
+    result = runner.invoke(args=["assets-build"])
+    assert result.exit_code == 0, result.output
+
+    css = built(static, "app.css")
+    assert re.fullmatch(r"app\.[0-9a-f]{12}\.css", css.name)
+    assert re.search(r'url\("bg\.[0-9a-f]{12}\.png"\)', css.read_text())
+    assert gzip.decompress((static / "dist" / (css.name + ".gz")).read_bytes()) == (
+        css.read_bytes()
+    )
+    # images are not compressed again
+    assert not any(name.endswith(".png.gz") for name in os.listdir(static / "dist"))
+
+    vendor = built(static, "vendor.css").read_text()
+    assert re.search(r'url\("icons\.[0-9a-f]{12}\.woff2\?v=1#x"\)', vendor)
+    assert "url(data:abc)" in vendor
+
+    script = built(static, "app.js").read_text()
+    assert script == "var a = 1;\nvar b = 2;\n"
+
+    with app.test_request_context():
+        url = "/static/dist/" + built(static, "app.js").name
+        assert assets.asset_urls("app.js") == [url]
+
+
+def test_build_keeps_previous_files(app, runner, static):
+    runner.invoke(args=["assets-build"])
+    first = built(static, "app.js").name
+    (static / "app.js").write_text("var a = 3;\n")
+    runner.invoke(args=["assets-build"])
+    second = built(static, "app.js").name
+    (static / "app.js").write_text("var a = 4;\n")
+    runner.invoke(args=["assets-build"])
+
+    files = os.listdir(static / "dist")
+    assert first not in files
+    assert second in files
+    assert built(static, "app.js").name in files
+
+
+def test_serve_fingerprinted(app, client, runner, static):
+    runner.invoke(args=["assets-build"])
+    url = "/static/dist/" + built(static, "app.css").name
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/css"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "max-age=31536000" in response.headers["Cache-Control"]
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.data) == built(static, "app.css").read_bytes()
+
+    if assets.brotli is not None:
+        response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+        assert response.headers["Content-Encoding"] == "br"
+
+    response = client.get(url)
+    assert "Content-Encoding" not in response.headers
+    assert response.data == built(static, "app.css").read_bytes()
+
+    # other static files are served as before
+    response = client.get("/static/app.js")
+    assert response.data == b"var a = 1\n"
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+
+    assert client.get("/static/dist/missing.css").status_code == 404
@@ -5,33 +5,49 @@ from flask import session
 from myblog.db import get_db
 
 
-def test_register(client, app):
+def test_register(client, app, auth):
     # test that viewing the page renders without template errors
     assert client.get("/auth/register").status_code == 200
 
     # test that successful registration redirects to the login page
-    response = client.post("/auth/register", data={"username": "a", "password": "a"})
-    assert "http://localhost/auth/login" == response.headers["Location"]
+    response = auth.post(
+        "/auth/register",
+        data={
+            "username": "abcd",
+            "email": "abcd@example.com",
+            "password": "abcd",
+            "confirm": "abcd",
+        },
+    )
+    assert response.headers["Location"] == "/auth/login"
 
     # test that the user was inserted into the database
     with app.app_context():
         assert (
-            get_db().execute("select * from user where username = 'a'").fetchone()
+            get_db().execute("select * from user where username = 'abcd'").fetchone()
             is not None
         )
 
 
 @pytest.mark.parametrize(
-    ("username", "password", "message"),
+    ("username", "email", "password", "message"),
     (
-        ("", "", b"Username is required."),
-        ("a", "", b"Password is required."),
-        ("test", "test", b"already registered"),
+        ("", "a@example.com", "abcd", b"Username:</b> This field is required."),
+        ("abcd", "a@example.com", "", b"Password:</b> This field is required."),
+        ("abcd", "not an email", "abcd", b"Invalid email address."),
+        ("test", "a@example.com", "abcd", b"User test is already registered."),
+        ("abcd", "test@example.com", "abcd", b"already registered"),
     ),
 )
-def test_register_validate_input(client, username, password, message):
-    response = client.post(
-        "/auth/register", data={"username": username, "password": password}
+def test_register_validate_input(auth, username, email, password, message):
+    response = auth.post(
+        "/auth/register",
+        data={
+            "username": username,
+            "email": email,
+            "password": password,
+            "confirm": password,
+        },
     )
     assert message in response.data
 
@@ -42,7 +58,7 @@ def test_login(client, auth):
 
     # test that successful login redirects to the index page
     response = auth.login()
-    assert response.headers["Location"] == "http://localhost/"
+    assert response.headers["Location"] == "/"
 
     # login request set the user_id in the session
     # check that the user is loaded from the session
@@ -67,3 +83,49 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert "user_id" not in session
+
+
+def test_user_is_loaded_lazily(app):
+    with app.test_request_context("/"):
+        session["user_id"] = 1
+        assert "user" not in g
+
+        assert g.user == {"id": 1, "username": "test", "email": "test@example.com"}
+        assert "user" in g
+
+
+def test_user_cache(app):
+    from myblog.auth import get_user_cache
+    from myblog.auth import invalidate_user
+
+    def username():
+        with app.test_request_context("/"):
+            session["user_id"] = 1
+            return g.user["username"]
+
+    assert username() == "test"
+
+    with app.app_context():
+        get_db().execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        get_db().commit()
+
+    # served from the cache until the user is invalidated
+    assert username() == "test"
+
+    with app.app_context():
+        invalidate_user(1)
+
+    assert username() == "renamed"
+
+    with app.app_context():
+        stats = get_user_cache().stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+
+
+def test_anonymous_user(app):
+    with app.test_request_context("/"):
+        assert g.user is None
+
+    with app.app_context():
+        assert g.user is None
@@ -1,3 +1,7 @@
+import base64
+import json
+import re
+
 import pytest
 
 from myblog.db import get_db
@@ -5,32 +9,32 @@ from myblog.db import get_db
 
 def test_index(client, auth):
     response = client.get("/")
-    assert b"Log In" in response.data
+    assert b"Login" in response.data
     assert b"Register" in response.data
 
     auth.login()
     response = client.get("/")
     assert b"test title" in response.data
-    assert b"by test on 2018-01-01" in response.data
-    assert b"test\nbody" in response.data
+    assert b"Posted by test on" in response.data
+    assert b'href="/1/detail"' in response.data
     assert b'href="/1/update"' in response.data
 
 
 @pytest.mark.parametrize("path", ("/create", "/1/update", "/1/delete"))
 def test_login_required(client, path):
     response = client.post(path)
-    assert response.headers["Location"] == "http://localhost/auth/login"
+    assert response.headers["Location"] == "/auth/login"
 
 
 def test_author_required(app, client, auth):
-    # change the post author to another user
+    # change the blog author to another user
     with app.app_context():
         db = get_db()
-        db.execute("UPDATE post SET author_id = 2 WHERE id = 1")
+        db.execute("UPDATE blog SET author_id = 2 WHERE id = 1")
         db.commit()
 
     auth.login()
-    # current user can't modify other user's post
+    # current user can't modify other user's blog
     assert client.post("/1/update").status_code == 403
     assert client.post("/1/delete").status_code == 403
     # current user doesn't see edit link
@@ -46,38 +50,208 @@ def test_exists_required(client, auth, path):
 def test_create(client, auth, app):
     auth.login()
     assert client.get("/create").status_code == 200
-    client.post("/create", data={"title": "created", "body": ""})
+    auth.post("/create", data={"title": "created", "body": "body"})
 
     with app.app_context():
         db = get_db()
-        count = db.execute("SELECT COUNT(id) FROM post").fetchone()[0]
+        count = db.execute("SELECT COUNT(id) FROM blog").fetchone()[0]
         assert count == 2
 
 
 def test_update(client, auth, app):
     auth.login()
     assert client.get("/1/update").status_code == 200
-    client.post("/1/update", data={"title": "updated", "body": ""})
+    auth.post("/1/update", data={"title": "updated", "body": "body"})
 
     with app.app_context():
         db = get_db()
-        post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
-        assert post["title"] == "updated"
+        blog = db.execute("SELECT * FROM blog WHERE id = 1").fetchone()
+        assert blog["title"] == "updated"
 
 
 @pytest.mark.parametrize("path", ("/create", "/1/update"))
-def test_create_update_validate(client, auth, path):
+def test_create_update_validate(app, auth, path):
     auth.login()
-    response = client.post(path, data={"title": "", "body": ""})
-    assert b"Title is required." in response.data
+    response = auth.post(path, data={"title": "", "body": "body"})
+    assert b"Title:</b> This field is required." in response.data
+
+    with app.app_context():
+        titles = get_db().execute("SELECT title FROM blog").fetchall()
+        assert [row["title"] for row in titles] == ["test title"]
 
 
 def test_delete(client, auth, app):
     auth.login()
-    response = client.post("/1/delete")
-    assert response.headers["Location"] == "http://localhost/"
+    response = auth.post("/1/delete", data={})
+    assert response.headers["Location"] == "/"
+
+    with app.app_context():
+        db = get_db()
+        blog = db.execute("SELECT * FROM blog WHERE id = 1").fetchone()
+        assert blog is None
 
+
+def test_index_visibility(app, client, auth):
     with app.app_context():
         db = get_db()
-        post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
-        assert post is None
+        db.executescript(
+            "INSERT INTO blog (title, body, author_id, public)"
+            " VALUES ('own secret', 'x', 1, 0), ('other secret', 'x', 2, 0);"
+        )
+
+    assert b"own secret" not in client.get("/").data
+
+    auth.login()
+    response = client.get("/")
+    assert b"test title" in response.data
+    assert b"own secret" in response.data
+    assert b"other secret" not in response.data
+
+
+@pytest.mark.parametrize("user_id", (None, 1))
+@pytest.mark.parametrize(
+    ("direction", "start"), (("next", None), ("next", ("2018-01-01", 1)), ("prev", ("2018-01-01", 1)))
+)
+def test_index_query_plan(app, user_id, direction, start):
+    from myblog.blog import visible_blogs
+
+    with app.app_context():
+        sql, params = visible_blogs(
+            user_id, "p.id, title, p.updated, username", direction, start, 20
+        )
+        plan = get_db().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+
+    details = [row["detail"] for row in plan]
+    assert not any(d.startswith("SCAN") for d in details)
+    assert not any("TEMP B-TREE" in d for d in details)
+
+
+def test_index_pagination(app, client):
+    app.config["BLOGS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE blog SET updated = created")
+        db.executemany(
+            "INSERT INTO blog (title, body, author_id, public, updated)"
+            " VALUES (?, 'x', 1, 1, ?)",
+            [(f"page blog {n}", f"2019-01-0{n} 00:00:00") for n in range(1, 6)],
+        )
+        db.commit()
+
+    def titles(response):
+        return re.findall(rb"(page blog \d|test title)", response.data)
+
+    def cursor(response, label):
+        match = re.search(rb'href="/\?cursor=([^"]+)">[^<]*' + label, response.data)
+        return match and match.group(1).decode()
+
+    first = client.get("/")
+    assert titles(first) == [b"page blog 5", b"page blog 4"]
+    assert cursor(first, b"Newer") is None
+
+    second = client.get("/?cursor=" + cursor(first, b"Older"))
+    assert titles(second) == [b"page blog 3", b"page blog 2"]
+
+    last = client.get("/?cursor=" + cursor(second, b"Older"))
+    assert titles(last) == [b"page blog 1", b"test title"]
+    assert cursor(last, b"Older") is None
+
+    back = client.get("/?cursor=" + cursor(last, b"Newer"))
+    assert titles(back) == titles(second)
+
+
+def test_index_invalid_cursor(client):
+    assert client.get("/?cursor=garbage").status_code == 400
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    (
+        ["next", []],
+        ["next", [1]],
+        ["next", ["2018-01-01", 1, 2]],
+        ["next", [{"a": 1}, 1]],
+        ["next", [[1], 1]],
+        ["next", [None, 1]],
+        ["next", ["2018-01-01", 2**64]],
+        ["next", "ab"],
+        ["sideways", ["2018-01-01", 1]],
+    ),
+)
+@pytest.mark.parametrize(
+    "path", ("/?cursor=", "/1/detail?comments=", "/api/blogs?cursor=")
+)
+def test_malformed_cursor(client, cursor, path):
+    token = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+    assert client.get(path + token).status_code == 400
+
+
+def test_comment_count(app, client, auth):
+    def count():
+        with app.app_context():
+            return get_db().execute("SELECT comment_count FROM blog").fetchone()[0]
+
+    assert count() == 0
+    assert b"0 comments" in client.get("/").data
+
+    auth.login()
+    auth.post("/1/comment", data={"text": "first"}, form_path="/1/detail")
+    auth.post("/1/comment", data={"text": "second"}, form_path="/1/detail")
+    assert count() == 2
+    assert b"2 comments" in client.get("/").data
+
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM comment WHERE text = 'first'")
+        db.commit()
+    assert count() == 1
+
+
+def test_detail_comment_pagination(app, client):
+    app.config["COMMENTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO comment (text, author_id, blog_id, created)"
+            " VALUES (?, 2, 1, ?)",
+            # two comments share a timestamp, to be told apart by id
+            [(f"comment {n}", f"2019-01-0{min(n, 4)} 00:00:00") for n in range(1, 6)],
+        )
+        db.commit()
+
+    def texts(response):
+        return re.findall(rb"comment \d", response.data)
+
+    def cursor(response, label):
+        match = re.search(rb'comments=([^"]+)">[^<]*' + label, response.data)
+        return match and match.group(1).decode()
+
+    first = client.get("/1/detail")
+    assert b"Comments (5)" in first.data
+    assert texts(first) == [b"comment 5", b"comment 4"]
+    assert cursor(first, b"Newer") is None
+
+    second = client.get("/1/detail?comments=" + cursor(first, b"Older"))
+    assert texts(second) == [b"comment 3", b"comment 2"]
+
+    last = client.get("/1/detail?comments=" + cursor(second, b"Older"))
+    assert texts(last) == [b"comment 1"]
+    assert cursor(last, b"Older") is None
+
+    back = client.get("/1/detail?comments=" + cursor(last, b"Newer"))
+    assert texts(back) == texts(second)
+
+
+@pytest.mark.parametrize(
+    ("direction", "start"), (("next", None), ("next", ("2019-01-01", 1)), ("prev", ("2019-01-01", 1)))
+)
+def test_comments_query_plan(app, direction, start):
+    from myblog.blog import blog_comments
+
+    with app.app_context():
+        sql, params = blog_comments(1, "c.id, c.text, c.created", direction, start, 20)
+        plan = get_db().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+
+    details = [row["detail"] for row in plan]
+    assert any("comment_blog_created" in d for d in details)
+    assert not any("TEMP B-TREE" in d for d in details)
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from myblog import create_app
+from myblog.cache import MemoryCache
+from myblog.cache import SQLiteCache
+from myblog.cache import invalidate
+from myblog.cache import tag_versions
+from myblog.db import get_db
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_bytes=10)
+    cache.set("a", b"12345", 60)
+    cache.set("b", b"12345", 60)
+    assert cache.get("a") == b"12345"
+
+    # "b" is the least recently used entry
+    cache.set("c", b"12345", 60)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 10
+
+
+def test_memory_cache_ttl():
+    cache = MemoryCache(max_bytes=100)
+    cache.set("a", b"value", -1)
+    assert cache.get("a") is None
+    assert cache.stats() == {
+        "hits": 0, "misses": 1, "evictions": 0, "entries": 0, "bytes": 0
+    }
+
+
+def test_tag_versions(app):
+    with app.app_context():
+        assert tag_versions(["a", "b"]) == [0, 0]
+        invalidate("b")
+        invalidate("b", "c")
+        assert tag_versions(["a", "b", "c"]) == [0, 2, 1]
+
+
+def test_sqlite_cache_is_shared(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first, second = SQLiteCache(path, 10), SQLiteCache(path, 10)
+
+    first.set("a", b"12345", 60)
+    assert second.get("a") == b"12345"
+
+    time.sleep(0.01)
+    second.set("b", b"12345", 60)
+    first.set("c", b"12345", 60)
+    assert first.get("a") is None
+    assert second.stats()["entries"] == 2
+
+
+def test_anonymous_pages_are_cached(app, client):
+    assert client.get("/").headers["X-Cache"] == "MISS"
+
+    # a change made behind the views' back is not seen until the TTL
+    with app.app_context():
+        get_db().execute("UPDATE blog SET title = 'changed'")
+        get_db().commit()
+
+    response = client.get("/")
+    assert response.headers["X-Cache"] == "HIT"
+    assert b"test title" in response.data
+    assert client.get("/1/detail").headers["X-Cache"] == "MISS"
+
+
+def test_logged_in_pages_are_not_cached(client, auth):
+    auth.login()
+    assert "X-Cache" not in client.get("/").headers
+
+
+def test_writes_invalidate_pages(client, auth):
+    client.get("/")
+    client.get("/1/detail")
+
+    auth.login()
+    auth.post("/create", data={"title": "brand new", "body": "x", "public": "y"})
+    auth.post("/1/comment", data={"text": "first!"}, form_path="/1/detail")
+    auth.logout()
+
+    response = client.get("/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert b"brand new" in response.data
+
+    response = client.get("/1/detail")
+    assert response.headers["X-Cache"] == "MISS"
+    assert b"first!" in response.data
+
+
+def test_cache_disabled(app, client):
+    app.config["RESPONSE_CACHE"] = None
+    assert "X-Cache" not in client.get("/").headers
+
+
+def test_fragments_are_cached(app, client, auth):
+    auth.login()
+    client.get("/")
+
+    with app.app_context():
+        stats = app.extensions["myblog.fragment_cache"][1].stats()
+        assert stats["misses"] == 1
+
+        # the fragment key is unchanged, so the cached block is reused
+        get_db().execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        get_db().commit()
+
+    assert b"Posted by test on" in client.get("/").data
+    assert app.extensions["myblog.fragment_cache"][1].stats()["hits"] == 1
+
+
+def test_fragments_vary_by_viewer(app, client, auth):
+    auth.login("other", "other")
+    assert b'href="/1/update"' not in client.get("/").data
+    auth.logout()
+
+    auth.login()
+    assert b'href="/1/update"' in client.get("/").data
+
+
+def test_fragments_follow_updates(client, auth):
+    auth.login()
+    client.get("/1/detail")
+    auth.post("/1/update", data={"title": "new title", "body": "new body"})
+
+    response = client.get("/1/detail")
+    assert b"new body" in response.data
+    assert b"new title" in client.get("/").data
+
+
+def test_invalidation_reaches_other_processes(app, client, auth):
+    # another worker, with its own memory cache, on the same database
+    other = create_app(
+        {"TESTING": True, "DATABASE": app.config["DATABASE"]}
+    ).test_client()
+    assert other.get("/").headers["X-Cache"] == "MISS"
+    assert other.get("/").headers["X-Cache"] == "HIT"
+
+    auth.login()
+    auth.post("/create", data={"title": "brand new", "body": "x", "public": "y"})
+
+    response = other.get("/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert b"brand new" in response.data
+
+
+def test_cached_page_keeps_its_etag(app, client):
+    first = client.get("/")
+
+    # a change behind the views' back changes the ETag but not the tags
+    with app.app_context():
+        get_db().execute("UPDATE blog SET comment_count = 5")
+        get_db().commit()
+
+    response = client.get("/", headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.headers["ETag"] != first.headers["ETag"]
+    assert b"5 comments" in response.data
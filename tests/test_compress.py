@@ -0,0 +1,125 @@
+import gzip
+import zlib
+
+import pytest
+
+from myblog import compress
+from myblog import create_app
+
+
+@pytest.fixture
+def routes(app):
+    closed = []
+
+    @app.route("/test/stream")
+    def stream():
+        def generate():
+            try:
+                for n in range(3):
+                    yield f"line {n}\n" * 100
+            finally:
+                closed.append(True)
+
+        return app.response_class(generate(), mimetype="text/plain")
+
+    @app.route("/test/small")
+    def small():
+        return "tiny"
+
+    @app.route("/test/etag")
+    def etag():
+        response = app.response_class("x" * 1000, mimetype="text/plain")
+        response.set_etag("abc")
+        return response
+
+    @app.route("/test/encoded")
+    def encoded():
+        body = gzip.compress(b"x" * 1000)
+        response = app.response_class(body, mimetype="text/plain")
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    return closed
+
+
+def test_gzip_page(client):
+    plain = client.get("/")
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == plain.data
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert "Cookie" in response.headers["Vary"]
+
+    # without Accept-Encoding the page is sent as it is, but still varies
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+
+def test_etag_revalidates(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+
+    response = client.get(
+        "/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_strong_etag_is_weakened(client, routes):
+    response = client.get("/test/etag", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["ETag"] == 'W/"abc"'
+    assert client.get("/test/etag").headers["ETag"] == '"abc"'
+
+
+@pytest.mark.skipif(compress.brotli is None, reason="brotli is not installed")
+def test_brotli_preferred(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert compress.brotli.decompress(response.data) == client.get("/").data
+
+    response = client.get("/", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_refused_encoding(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_stream_is_compressed_incrementally(client, routes):
+    response = client.get(
+        "/test/stream", headers={"Accept-Encoding": "gzip"}, buffered=False
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    decompressor = zlib.decompressobj(31)
+    chunks = iter(response.response)
+    # each chunk of the body can be decompressed as soon as it arrives
+    assert decompressor.decompress(next(chunks)) == b"line 0\n" * 100
+    rest = b"".join(decompressor.decompress(chunk) for chunk in chunks)
+    assert rest == b"line 1\n" * 100 + b"line 2\n" * 100
+    response.close()
+    assert routes == [True]
+
+
+def test_skipped_responses(client, routes):
+    response = client.get("/test/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == b"tiny"
+
+    response = client.get("/test/encoded", headers={"Accept-Encoding": "gzip"})
+    assert gzip.decompress(response.data) == b"x" * 1000
+
+    response = client.head("/", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_disabled(app):
+    app = create_app(
+        {"TESTING": True, "DATABASE": app.config["DATABASE"], "COMPRESS_ENABLED": False}
+    )
+    assert not isinstance(app.wsgi_app, compress.CompressionMiddleware)
@@ -0,0 +1,71 @@
+from myblog.db import get_db
+
+
+def test_index_not_modified(client, auth):
+    response = client.get("/")
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert response.headers["Cache-Control"] == "public, max-age=0, must-revalidate"
+    assert "Cookie" in response.headers["Vary"]
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    auth.login()
+    auth.post("/create", data={"title": "changes it", "body": "x", "public": "y"})
+    auth.logout()
+
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_if_modified_since_is_not_enough(app, client, auth):
+    with app.app_context():
+        get_db().execute(
+            "INSERT INTO comment (id, text, author_id, blog_id) VALUES (1, 'x', 1, 1)"
+        )
+        get_db().commit()
+
+    auth.login()
+    response = client.get("/1/detail")
+    last_modified, etag = response.headers["Last-Modified"], response.headers["ETag"]
+
+    # the deleted comment leaves the latest change where it was
+    assert auth.post("/1/comment_delete?blog_id=1", {}).status_code == 302
+    response = client.get("/1/detail", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] == last_modified
+    assert response.headers["ETag"] != etag
+
+
+def test_comments_change_detail_etag(app, client):
+    etag = client.get("/1/detail").headers["ETag"]
+
+    with app.app_context():
+        get_db().execute(
+            "INSERT INTO comment (text, author_id, blog_id) VALUES ('new', 2, 1)"
+        )
+        get_db().commit()
+
+    assert client.get("/1/detail", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_etag_is_per_user(client, auth):
+    anonymous = client.get("/").headers["ETag"]
+
+    auth.login()
+    response = client.get("/")
+    assert response.headers["ETag"] != anonymous
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert client.get("/", headers={"If-None-Match": anonymous}).status_code == 200
+
+
+def test_private_blog_is_not_revalidated(app, client):
+    with app.app_context():
+        get_db().execute("UPDATE blog SET public = 0")
+        get_db().commit()
+
+    response = client.get("/1/detail", headers={"If-None-Match": "*"})
+    assert response.status_code == 403
+    assert "ETag" not in response.headers
@@ -0,0 +1,154 @@
+import re
+import time
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from myblog import create_app
+from myblog.form import LoginForm
+
+
+@pytest.fixture
+def make_app(app):
+    """Create another app on the same database, as another worker
+    process would.
+    """
+
+    def make(**config):
+        return create_app(
+            {
+                "TESTING": True,
+                "DATABASE": app.config["DATABASE"],
+                "PASSWORD_HASH_METHOD": "pbkdf2:sha256:50000",
+                "PASSWORD_HASH_WORKERS": 0,
+                **config,
+            }
+        )
+
+    return make
+
+
+def token_from(client, path="/auth/login"):
+    response = client.get(path)
+    return re.search(
+        rb'name="csrf_token" type="hidden" value="([^"]+)"', response.data
+    ).group(1).decode()
+
+
+def carry_session(source, target):
+    """Give ``target`` the session cookie of ``source``, as a browser
+    posting a form rendered by another worker would.
+    """
+    target.set_cookie("session", source.get_cookie("session").value)
+    return target
+
+
+def login(client, token):
+    return client.post(
+        "/auth/login",
+        data={"username": "test", "password": "test", "csrf_token": token},
+    )
+
+
+def test_token_works_across_apps(make_app):
+    first = make_app(SECRET_KEY="shared")
+    second = make_app(SECRET_KEY="shared")
+
+    context = {}
+    with first.test_request_context():
+        token = LoginForm(meta={"csrf_context": context}).csrf_token.current_token
+
+    with second.test_request_context():
+        form = LoginForm(
+            MultiDict({"username": "u", "password": "p", "csrf_token": token}),
+            meta={"csrf_context": context},
+        )
+        assert form.validate(), form.errors
+
+    # a form rendered by one worker and posted to another
+    client = first.test_client()
+    token = token_from(client)
+    response = login(carry_session(client, second.test_client()), token)
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/"
+
+
+def test_anonymous_session_keeps_its_nonce(client):
+    assert "Set-Cookie" in client.get("/auth/login").headers
+    # the next forms reuse it, and leave the session alone
+    assert "Set-Cookie" not in client.get("/auth/register").headers
+
+
+def test_token_is_bound_to_the_client(app):
+    token = token_from(app.test_client())
+
+    rendered = app.test_client()
+    token_from(rendered)
+
+    # another client, whether it has a nonce of its own or none
+    for other in (rendered, app.test_client()):
+        response = login(other, token)
+        assert response.status_code == 200
+        assert b"invalid CSRF token" in response.data
+
+
+def test_other_secret_fails(make_app):
+    client = make_app(SECRET_KEY="one").test_client()
+    token = token_from(client)
+    # the session is still readable, only the key of the token is gone
+    other = make_app(
+        SECRET_KEY="two", SECRET_KEY_FALLBACKS=["one"], CSRF_SECRET_KEY_FALLBACKS=[]
+    )
+    response = login(carry_session(client, other.test_client()), token)
+    assert response.status_code == 200
+    assert b"invalid CSRF token" in response.data
+
+
+def test_rotated_secret(make_app):
+    client = make_app(SECRET_KEY="old").test_client()
+    token = token_from(client)
+
+    rotated = make_app(SECRET_KEY="new", SECRET_KEY_FALLBACKS=["old"])
+    assert login(carry_session(client, rotated.test_client()), token).status_code == 302
+
+    dedicated = make_app(
+        SECRET_KEY="new",
+        SECRET_KEY_FALLBACKS=["old"],
+        CSRF_SECRET_KEY="csrf",
+        CSRF_SECRET_KEY_FALLBACKS=["old"],
+    )
+    assert login(carry_session(client, dedicated.test_client()), token).status_code == 302
+    garbage = carry_session(client, dedicated.test_client())
+    assert login(garbage, "garbage").status_code == 200
+
+
+def test_expired_token(app, client, monkeypatch):
+    token = token_from(client)
+    issued = time.time()
+    expired = issued + app.config["CSRF_TIME_LIMIT"] + 1
+    monkeypatch.setattr(time, "time", lambda: expired)
+
+    response = login(client, token)
+    assert response.status_code == 200
+    assert b"invalid CSRF token" in response.data
+
+
+def test_token_is_bound_to_the_user(client, auth):
+    anonymous = token_from(client, "/auth/login")
+    auth.login()
+
+    response = client.post(
+        "/create", data={"title": "forged", "body": "x", "csrf_token": anonymous}
+    )
+    assert response.status_code == 200
+    assert b"invalid CSRF token" in response.data
+
+    response = client.post(
+        "/create",
+        data={
+            "title": "genuine",
+            "body": "x",
+            "csrf_token": token_from(client, "/create"),
+        },
+    )
+    assert response.status_code == 302
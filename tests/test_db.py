@@ -27,3 +27,143 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_upgrade_db(app):
+    from myblog.db import list_migrations
+    from myblog.db import upgrade_db
+
+    with app.app_context():
+        # init_db already applied every migration
+        assert upgrade_db() == []
+
+        db = get_db()
+        versions = [row[0] for row in db.execute("SELECT version FROM schema_version")]
+        assert versions == [version for version, name, path in list_migrations()]
+
+        plan = db.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM comment"
+            " WHERE blog_id = 1 ORDER BY created"
+        ).fetchall()
+        assert "comment_blog_created" in plan[0]["detail"]
+
+        with pytest.raises(sqlite3.IntegrityError):
+            db.execute(
+                "INSERT INTO user (username, email, password)"
+                " VALUES ('copy', 'test@example.com', 'x')"
+            )
+
+
+def test_upgrade_db_adopts_legacy_database(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.executescript(
+            "DROP TABLE schema_version;"
+            " DROP INDEX comment_blog_created;"
+            " DROP INDEX user_email;"
+            " DROP TABLE blog_search;"
+            " DROP TABLE comment_search;"
+            " DROP TRIGGER blog_search_insert;"
+            " DROP TRIGGER blog_search_update;"
+            " DROP TRIGGER blog_search_delete;"
+            " DROP TRIGGER comment_search_insert;"
+            " DROP TRIGGER comment_search_update;"
+            " DROP TRIGGER comment_search_delete;"
+            " DROP TRIGGER blog_comment_count_insert;"
+            " DROP TRIGGER blog_comment_count_delete;"
+            " DROP TRIGGER blog_comment_count_move;"
+            " ALTER TABLE blog DROP COLUMN comment_count;"
+            " ALTER TABLE blog DROP COLUMN excerpt;"
+            " ALTER TABLE blog DROP COLUMN body_html;"
+            " ALTER TABLE blog DROP COLUMN word_count;"
+            " INSERT INTO comment (text, author_id, blog_id) VALUES ('old', 2, 1);"
+        )
+
+    result = runner.invoke(args=["db-status"])
+    assert "0002_hot_query_indexes: pending" in result.output
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 0001_initial." in result.output
+    assert "Applied migration 0002_hot_query_indexes." in result.output
+
+    with app.app_context():
+        # the existing data survives the upgrade
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM blog").fetchone()[0] == 1
+        # and the comment counts are filled in
+        assert db.execute("SELECT comment_count FROM blog").fetchone()[0] == 1
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "up to date" in result.output
+
+
+def test_failed_migration_is_rolled_back(app, monkeypatch, tmp_path):
+    from myblog import db as db_module
+
+    (tmp_path / "0099_broken.sql").write_text(
+        "CREATE TABLE half_done (id INTEGER); SELECT * FROM missing_table;"
+    )
+    migrations = db_module.list_migrations
+
+    with app.app_context():
+        monkeypatch.setattr(
+            db_module,
+            "list_migrations",
+            lambda: migrations() + [(99, "broken", str(tmp_path / "0099_broken.sql"))],
+        )
+        with pytest.raises(sqlite3.OperationalError):
+            db_module.upgrade_db()
+
+        db = get_db()
+        assert 99 not in db_module.applied_migrations(db)
+        assert db.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'half_done'"
+        ).fetchone() is None
+
+
+def test_pool_reuses_connections(app):
+    with app.app_context():
+        first = get_db().connection
+
+    with app.app_context():
+        assert get_db().connection is first
+
+
+def test_pool_applies_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert db.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_pool_evicts_broken_connections(app):
+    with app.app_context():
+        broken = get_db().connection
+
+    broken.close()
+
+    with app.app_context():
+        db = get_db()
+        assert db.connection is not broken
+        assert db.execute("SELECT 1").fetchone()[0] == 1
+
+
+def test_pool_size(app):
+    from myblog.db import ConnectionPool
+
+    pool = ConnectionPool(app.config["DATABASE"], 1, {})
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is first
+    assert pool.acquire() is not second
+
+
+def test_pool_rolls_back_on_release(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM blog")
+
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM blog").fetchone()[0] == 1
@@ -0,0 +1,80 @@
+from flask import g
+
+from myblog.blog import get_blog
+from myblog.blog import get_blogs
+from myblog.blog import get_comment
+from myblog.identity import IdentityMap
+from myblog.identity import get_identity_map
+from myblog.writer import execute_write
+
+
+def test_get_loads_once():
+    identity_map = IdentityMap()
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return key * 2 if key else None
+
+    assert identity_map.get("n", 1, load) == 2
+    assert identity_map.get("n", 1, load) == 2
+    # missing rows are remembered too
+    assert identity_map.get("n", 0, load) is None
+    assert identity_map.get("n", 0, load) is None
+    assert loads == [1, 0]
+    assert identity_map.stats == {"hits": 2, "loads": 2, "duplicates": 0}
+
+
+def test_get_many_loads_missing_keys(app):
+    identity_map = IdentityMap()
+    batches = []
+
+    def load_many(keys):
+        batches.append(keys)
+        return {key: key * 2 for key in keys if key < 10}
+
+    assert identity_map.get_many("n", [1, 2], load_many) == {1: 2, 2: 4}
+    assert identity_map.get_many("n", [2, 3, 3, 10], load_many) == {
+        2: 4,
+        3: 6,
+        10: None,
+    }
+    assert batches == [[1, 2], [3, 10]]
+
+    identity_map.clear()
+    with app.app_context():
+        identity_map.get_many("n", [1], load_many)
+    assert identity_map.stats["duplicates"] == 1
+
+
+def test_helpers_share_rows(app):
+    with app.test_request_context():
+        g.user = {"id": 1}
+        blog = get_blog(1)
+        assert get_blog(1, check_author=False) is blog
+        assert get_blogs([1, 42]) == {1: blog, 42: None}
+        assert get_identity_map().stats == {"hits": 2, "loads": 2, "duplicates": 0}
+
+
+def test_write_clears_identity_map(app, caplog):
+    with app.test_request_context():
+        g.user = {"id": 1}
+        get_blog(1)
+        execute_write("UPDATE blog SET title = 'changed' WHERE id = 1")
+        assert get_blog(1)["title"] == "changed"
+        assert get_identity_map().stats["duplicates"] == 1
+        assert "blog 1 loaded 2 times in one request" in caplog.text
+
+        execute_write(
+            "INSERT INTO comment (text, author_id, blog_id) VALUES ('hi', 1, 1)"
+        )
+        assert get_comment(1)["text"] == "hi"
+
+
+def test_views_load_rows_once(client, auth):
+    auth.login()
+
+    with client:
+        assert client.get("/1/delete").status_code == 200
+        assert g.identity_map.stats["loads"] == 1
+        assert g.identity_map.stats["duplicates"] == 0
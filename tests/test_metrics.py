@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+from flask import g
+
+from myblog import metrics
+from myblog.db import PooledConnection
+from myblog.db import get_db
+
+
+@pytest.fixture
+def metrics_app(app):
+    app.config.update(METRICS_ENABLED=True, METRICS_TOKEN="scraper")
+    metrics.init_app(app)
+    return app
+
+
+def scrape(client, token="scraper"):
+    return client.get("/metrics", headers={"Authorization": f"Bearer {token}"})
+
+
+def sample(text, name):
+    match = re.search("^%s (\\S+)$" % re.escape(name), text, re.M)
+    return match and float(match.group(1))
+
+
+def test_disabled(app, client):
+    response = client.get("/")
+    assert "Server-Timing" not in response.headers
+    assert scrape(client).status_code == 404
+
+    with app.test_request_context():
+        assert type(get_db()) is PooledConnection
+
+
+def test_request_metrics(metrics_app, client):
+    response = client.get("/")
+    timings = response.headers.getlist("Server-Timing")
+    assert re.fullmatch(r'sql;dur=[\d.]+;desc="\d+ queries"', timings[0])
+
+    client.get("/1/detail")
+    client.get("/1/detail")
+    client.get("/404/detail")
+
+    text = scrape(client).data.decode()
+    assert sample(
+        text, 'myblog_http_requests_total{endpoint="blog.detail",method="GET",status="200"}'
+    ) == 2
+    assert sample(
+        text, 'myblog_http_requests_total{endpoint="blog.detail",method="GET",status="404"}'
+    ) == 1
+    assert sample(
+        text, 'myblog_http_request_duration_seconds_bucket{endpoint="blog.detail",le="+Inf"}'
+    ) == 3
+    assert sample(text, 'myblog_http_request_duration_seconds_count{endpoint="blog.index"}') == 1
+    assert sample(text, 'myblog_sql_queries_total{endpoint="blog.detail"}') > 3
+    assert sample(text, 'myblog_sql_duration_seconds_total{endpoint="blog.detail"}') > 0
+    # the response cache served the second detail page
+    assert sample(text, 'myblog_cache_hits_total{cache="response_cache"}') == 1
+
+
+def test_writer_metrics(metrics_app, client, auth):
+    auth.login()
+    auth.post("/create", data={"title": "created", "body": "text"})
+
+    # the blog, then the bump of the cached pages' tags
+    text = scrape(client).data.decode()
+    assert sample(text, "myblog_writer_operations_total") == 2
+
+
+def test_slow_query_log(metrics_app, client, caplog):
+    metrics_app.config["SLOW_QUERY_SECONDS"] = 0
+    client.get("/")
+
+    assert "Slow query" in caplog.text
+    text = scrape(client).data.decode()
+    assert sample(text, 'myblog_sql_slow_queries_total{endpoint="blog.index"}') > 0
+
+
+def test_fetch_time_is_counted(metrics_app):
+    with metrics_app.test_request_context():
+        metrics.start_request()
+        db = get_db()
+        rows = list(db.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL"
+                               " SELECT i + 1 FROM n WHERE i < 50000) SELECT i FROM n"))
+        assert len(rows) == 50000
+        request_metrics = g.request_metrics
+        assert request_metrics.queries == 1
+        assert request_metrics.slowest[0] == request_metrics.seconds
+        assert "RECURSIVE" in request_metrics.slowest[1]
+
+
+def test_label_escaping():
+    assert metrics._labels(a='say "hi"\\\n') == '{a="say \\"hi\\"\\\\\\n"}'
+
+
+def test_metrics_need_the_token(metrics_app, client):
+    assert client.get("/metrics").status_code == 403
+    assert scrape(client, "guess").status_code == 403
+    assert scrape(client).status_code == 200
+
+    metrics_app.config["METRICS_TOKEN"] = None
+    assert scrape(client, "None").status_code == 403
+
+
+def test_user_cache_reports_no_bytes(metrics_app, client, auth):
+    auth.login()
+    client.get("/")
+
+    text = scrape(client).data.decode()
+    assert sample(text, 'myblog_cache_entries{cache="user_cache"}') == 1
+    assert 'myblog_cache_bytes{cache="user_cache"}' not in text
+
+
+def test_shared_between_processes(metrics_app, client, tmp_path):
+    folder = tmp_path / "metrics"
+    metrics_app.config["METRICS_DIR"] = str(folder)
+    client.get("/")
+
+    # an exited worker, and one still serving
+    exited = subprocess.Popen([sys.executable, "-c", ""])
+    exited.wait()
+    series = (
+        'myblog_http_requests_total{endpoint="blog.index",method="GET",status="200"}'
+    )
+    for pid, count in ((exited.pid, 5), (os.getppid(), 2)):
+        families = {
+            "myblog_http_requests_total": {
+                "kind": "counter", "help": "Responses sent.", "samples": {series: count}
+            },
+            "myblog_replica_lag_seconds": {
+                "kind": "gauge", "help": None,
+                "samples": {"myblog_replica_lag_seconds": 1.5},
+            },
+        }
+        (folder / f"{pid}.json").write_text(json.dumps(families))
+
+    for _ in range(2):
+        text = scrape(client).data.decode()
+        # the counters of all of them are summed, whichever answers
+        assert sample(text, series) == 8
+        # the gauges of the live ones are labelled with their pid
+        lag = 'myblog_replica_lag_seconds{pid="%d"}' % os.getppid()
+        assert sample(text, lag) == 1.5
+        assert str(exited.pid) not in text
+
+    assert not (folder / f"{exited.pid}.json").exists()
+    assert (folder / "exited.json").exists()
@@ -0,0 +1,149 @@
+import json
+import time
+
+import pytest
+
+from myblog.db import get_db
+from myblog.db import get_pool
+from myblog.outbox import backoff
+from myblog.outbox import deliver_batch
+from myblog.outbox import enqueue
+
+
+@pytest.fixture
+def mail_file(app, tmp_path):
+    path = tmp_path / "outbox.jsonl"
+    app.config.update(
+        OUTBOX_BACKGROUND=False, OUTBOX_TRANSPORT="file", OUTBOX_FILE=str(path)
+    )
+    return path
+
+
+def sent_mails(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class FailingTransport:
+    def send(self, messages):
+        raise ConnectionRefusedError("no mail server")
+
+
+def test_forgot_queues_mail(app, auth, mail_file):
+    response = auth.post("/auth/forgot", data={"email": "test@example.com"})
+    assert response.headers["Location"] == "/"
+
+    with app.app_context():
+        row = get_db().execute("SELECT * FROM outbox").fetchone()
+
+    assert row["kind"] == "mail"
+    assert row["status"] == "pending"
+    mail = json.loads(row["payload"])
+    assert mail["to"] == "test@example.com"
+    assert "Your username is test." in mail["body"]
+    # nothing is sent until a worker runs
+    assert not mail_file.exists()
+
+
+def test_worker_command(app, runner, mail_file):
+    with app.app_context():
+        for n in range(3):
+            enqueue("mail", {"to": f"{n}@example.com", "subject": "hi", "body": "b"})
+
+    result = runner.invoke(args=["outbox-worker", "--once", "--batch-size", "2"])
+    assert "Sent 3, retrying 0, dead 0." in result.output
+    assert [mail["to"] for mail in sent_mails(mail_file)] == [
+        "0@example.com",
+        "1@example.com",
+        "2@example.com",
+    ]
+
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 0
+
+
+def test_retry_then_dead_letter(app, runner, mail_file):
+    app.config.update(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_BACKOFF=0)
+
+    with app.app_context():
+        message_id = enqueue("mail", {"to": "a@example.com", "subject": "s", "body": "b"})
+        conn = get_pool().connect()
+        conn.isolation_level = None
+        db = get_db()
+
+        counts = deliver_batch(conn, FailingTransport(), app.config, 10)
+        assert counts == {"sent": 0, "retried": 1, "dead": 0}
+        row = db.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        assert row["status"] == "pending"
+        assert row["attempts"] == 1
+        assert "no mail server" in row["last_error"]
+
+        counts = deliver_batch(conn, FailingTransport(), app.config, 10)
+        assert counts == {"sent": 0, "retried": 0, "dead": 1}
+        row = db.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        assert row["status"] == "dead"
+
+        # dead messages are not claimed again
+        assert deliver_batch(conn, FailingTransport(), app.config, 10)["dead"] == 0
+        conn.close()
+
+    result = runner.invoke(args=["outbox-worker", "--once", "--retry-dead"])
+    assert "Retrying 1 dead messages." in result.output
+    assert "Sent 1" in result.output
+    assert len(sent_mails(mail_file)) == 1
+
+
+def test_claimed_messages_are_leased(app, mail_file):
+    with app.app_context():
+        enqueue("mail", {"to": "a@example.com", "subject": "s", "body": "b"})
+        conn = get_pool().connect()
+        conn.isolation_level = None
+
+        class CrashingTransport:
+            def send(self, messages):
+                raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            deliver_batch(conn, CrashingTransport(), app.config, 10)
+
+        # another worker doesn't take it until the lease runs out
+        assert deliver_batch(conn, FailingTransport(), app.config, 10)["retried"] == 0
+        conn.close()
+
+
+def test_backoff():
+    delays = [backoff(attempts, 30, 3600) for attempts in range(1, 10)]
+    assert 15 <= delays[0] <= 30
+    assert 60 <= delays[2] <= 120
+    assert all(delay <= 3600 for delay in delays)
+    assert delays[-1] >= 1800
+
+
+def wait_for_mail(path):
+    # wait for the whole line, the file is created before it is written
+    for _ in range(100):
+        if path.exists() and path.read_text().endswith("\n"):
+            break
+        time.sleep(0.05)
+
+
+def test_background_thread(app, mail_file):
+    app.config["OUTBOX_BACKGROUND"] = True
+
+    with app.app_context():
+        enqueue("mail", {"to": "a@example.com", "subject": "s", "body": "b"})
+
+    wait_for_mail(mail_file)
+    assert sent_mails(mail_file)[0]["to"] == "a@example.com"
+
+
+def test_background_thread_starts_with_requests(app, client, mail_file):
+    # left pending by a process without the thread
+    with app.app_context():
+        enqueue("mail", {"to": "a@example.com", "subject": "s", "body": "b"})
+
+    app.config["OUTBOX_BACKGROUND"] = True
+    client.get("/")
+
+    wait_for_mail(mail_file)
+    assert sent_mails(mail_file)[0]["to"] == "a@example.com"
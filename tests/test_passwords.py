@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.security import generate_password_hash
+
+from myblog.db import get_db
+from myblog.passwords import Hasher
+from myblog.passwords import HasherBusy
+from myblog.passwords import check_password
+from myblog.passwords import hash_workers
+from myblog.passwords import hash_password
+from myblog.passwords import needs_rehash
+
+
+def test_hash_password(app):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+
+    with app.app_context():
+        pwhash = hash_password("secret")
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert check_password(pwhash, "secret")
+        assert not check_password(pwhash, "wrong")
+        assert not needs_rehash(pwhash)
+
+        app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:2000"
+        assert needs_rehash(pwhash)
+
+
+def test_needs_rehash_defaults(app):
+    # werkzeug's defaults fill in the parameters the method leaves out
+    method = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+    pwhash = generate_password_hash("secret", method)
+    app.config["PASSWORD_SALT_LENGTH"] = 16
+
+    with app.app_context():
+        for method in ("pbkdf2", "pbkdf2:sha256"):
+            app.config["PASSWORD_HASH_METHOD"] = method
+            assert not needs_rehash(pwhash)
+
+        app.config["PASSWORD_HASH_METHOD"] = "scrypt"
+        assert needs_rehash(pwhash)
+        assert not needs_rehash(generate_password_hash("secret", "scrypt:32768:8:1"))
+
+        # so is a change of the salt length
+        app.config["PASSWORD_HASH_METHOD"] = "pbkdf2"
+        app.config["PASSWORD_SALT_LENGTH"] = 24
+        assert needs_rehash(pwhash)
+
+
+def test_process_pool():
+    hasher = Hasher(workers=1, max_pending=1, timeout=30)
+    try:
+        assert hasher.run(pow, 2, 10) == 1024
+    finally:
+        hasher.shutdown()
+
+
+def test_overload_fails_fast():
+    hasher = Hasher(workers=0, max_pending=1, timeout=0.01)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=hasher.run, args=(slow,))
+    thread.start()
+    started.wait(5)
+
+    with pytest.raises(HasherBusy):
+        hasher.run(pow, 2, 10)
+
+    release.set()
+    thread.join()
+
+
+def test_hash_workers(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    config = {"PASSWORD_HASH_WORKERS": None, "SERVE_WORKERS": None}
+    assert hash_workers(config) == 8
+
+    # split between the workers of "flask serve"
+    config["SERVE_WORKERS"] = 3
+    assert hash_workers(config) == 2
+    config["SERVE_WORKERS"] = 16
+    assert hash_workers(config) == 1
+
+    config["PASSWORD_HASH_WORKERS"] = 0
+    assert hash_workers(config) == 0
+
+
+def test_rehash_on_login(app, auth):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    assert auth.login().status_code == 302
+
+    with app.app_context():
+        pwhash = get_db().execute("SELECT password FROM user WHERE id = 1").fetchone()[0]
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+
+    # the upgraded hash still accepts the password
+    auth.logout()
+    assert auth.login().status_code == 302
+
+
+def test_login_overloaded(app, auth, monkeypatch):
+    def busy(*args):
+        raise HasherBusy()
+
+    monkeypatch.setattr("myblog.auth.check_password", busy)
+    assert auth.login().status_code == 503
@@ -0,0 +1,99 @@
+import os
+import pstats
+
+import pytest
+
+from myblog import profiler
+
+
+@pytest.fixture
+def profiled_app(app, tmp_path):
+    app.config.update(PROFILER_ENABLED=True, PROFILER_DIR=str(tmp_path))
+    profiler.init_app(app)
+    return app
+
+
+def dumps(app):
+    return sorted(os.listdir(app.config["PROFILER_DIR"]))
+
+
+def test_disabled(app, client):
+    with app.app_context():
+        token = profiler.make_token()
+
+    response = client.get("/", headers={"X-Profile": token})
+    assert "X-Profile-Dump" not in response.headers
+    assert not os.path.exists(os.path.join(app.instance_path, "profiles"))
+
+
+def test_signed_header(profiled_app, client):
+    assert client.get("/auth/login", headers={"X-Profile": "forged"}).status_code == 200
+    assert dumps(profiled_app) == []
+
+    with profiled_app.app_context():
+        token = profiler.make_token()
+    response = client.get("/", headers={"X-Profile": token})
+    name = response.headers["X-Profile-Dump"]
+
+    (dump,) = dumps(profiled_app)
+    assert dump.startswith(name + "-blog.index-")
+    assert dump.endswith("ms.prof")
+    stats = pstats.Stats(os.path.join(profiled_app.config["PROFILER_DIR"], dump))
+    assert any(func[2] == "index" for func in stats.stats)
+
+
+def test_sampling_and_rotation(profiled_app, client):
+    profiled_app.config.update(
+        PROFILER_SAMPLE_RATE=1.0,
+        PROFILER_MODE="sample",
+        PROFILER_INTERVAL=0.0001,
+        PROFILER_MAX_FILES=2,
+    )
+
+    for _ in range(4):
+        response = client.get("/1/detail")
+        # only those asking for a profile are told about it
+        assert "X-Profile-Dump" not in response.headers
+
+    names = dumps(profiled_app)
+    assert len(names) == 2
+    assert all("-blog.detail-" in name and name.endswith(".collapsed") for name in names)
+
+
+def test_rotation_by_size(tmp_path):
+    for n in range(3):
+        path = tmp_path / f"{n}.prof"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (n, n))
+    (tmp_path / "notes.txt").write_text("kept")
+
+    profiler.rotate(str(tmp_path), max_files=10, max_bytes=150)
+    assert sorted(os.listdir(tmp_path)) == ["2.prof", "notes.txt"]
+
+
+def test_profile_report(profiled_app, client, runner):
+    result = runner.invoke(args=["profile-report"])
+    assert "No profile dumps" in result.output
+
+    profiled_app.config["PROFILER_SAMPLE_RATE"] = 1.0
+    client.get("/")
+    client.get("/1/detail")
+
+    result = runner.invoke(args=["profile-report", "--endpoint", "blog.detail"])
+    assert "detail" in result.output
+    assert "function calls" in result.output
+
+    profiled_app.config.update(PROFILER_MODE="sample", PROFILER_INTERVAL=0.0001)
+    client.get("/")
+    result = runner.invoke(args=["profile-report", "--sort", "tottime"])
+    assert "samples in 1 dumps" in result.output
+
+
+def test_profile_token(profiled_app, runner):
+    result = runner.invoke(args=["profile-token"])
+    header, token = result.output.strip().split(": ")
+    assert header == "X-Profile"
+
+    with profiled_app.app_context():
+        assert profiler.check_token(token)
+        assert not profiler.check_token(token + "x")
@@ -0,0 +1,91 @@
+from myblog.db import get_db
+from myblog.render import make_excerpt
+from myblog.render import render_html
+
+
+def test_render_html():
+    html = render_html(
+        "Some **bold** and *light* `x*y*z`\nsee https://example.com/a?b=1&c=2.\n\n"
+        "<script>alert(1)</script>"
+    )
+    assert html == (
+        "<p>Some <strong>bold</strong> and <em>light</em> <code>x*y*z</code><br>\n"
+        'see <a href="https://example.com/a?b=1&amp;c=2" rel="nofollow">'
+        "https://example.com/a?b=1&amp;c=2</a>.</p>\n"
+        "<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>"
+    )
+    assert render_html("  \n\n ") == ""
+
+
+def test_make_excerpt():
+    assert make_excerpt("A **short**\n\nbody", 50) == "A short body"
+    assert make_excerpt("one two three four", 12) == "one two…"
+    assert len(make_excerpt("word " * 100, 40)) <= 40
+
+
+def test_create_stores_derived_columns(app, client, auth):
+    auth.login()
+    auth.post(
+        "/create",
+        data={"title": "rendered", "body": "Hello *there*\n\nsecond", "public": "y"},
+    )
+
+    with app.app_context():
+        blog = get_db().execute(
+            "SELECT excerpt, body_html, word_count FROM blog WHERE title = 'rendered'"
+        ).fetchone()
+
+    assert blog["excerpt"] == "Hello there second"
+    assert blog["body_html"] == "<p>Hello <em>there</em></p>\n<p>second</p>"
+    assert blog["word_count"] == 3
+
+    response = client.get("/")
+    assert b"Hello there second" in response.data
+    assert b"3 words" in response.data
+
+    response = client.get("/2/detail")
+    assert b"<p>Hello <em>there</em></p>" in response.data
+
+
+def test_update_renders_again(app, auth):
+    auth.login()
+    auth.post("/1/update", data={"title": "updated", "body": "**new** body"})
+
+    with app.app_context():
+        blog = get_db().execute("SELECT * FROM blog WHERE id = 1").fetchone()
+
+    assert blog["body_html"] == "<p><strong>new</strong> body</p>"
+    assert blog["excerpt"] == "new body"
+    assert blog["word_count"] == 2
+
+
+def test_backfill_command(app, client, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO blog (title, body, author_id, public)"
+            " VALUES ('second', 'a *b*', 1, 1)"
+        )
+        db.commit()
+
+    # blogs written before the backfill are rendered on view
+    assert b"test<br>\nbody" in client.get("/1/detail").data
+
+    result = runner.invoke(args=["render-backfill", "--chunk-size", "1"])
+    assert "Rendered blogs up to id 2." in result.output
+    assert "Rendered 2 blogs." in result.output
+
+    with app.app_context():
+        rows = get_db().execute(
+            "SELECT excerpt, body_html, word_count FROM blog ORDER BY id"
+        ).fetchall()
+
+    assert [tuple(row) for row in rows] == [
+        ("test body", "<p>test<br>\nbody</p>", 2),
+        ("a b", "<p>a <em>b</em></p>", 2),
+    ]
+
+    result = runner.invoke(args=["render-backfill"])
+    assert "Rendered 0 blogs." in result.output
+    result = runner.invoke(args=["render-backfill", "--all"])
+    assert "Rendered 2 blogs." in result.output
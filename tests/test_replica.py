@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+from myblog.db import get_db
+from myblog.replica import get_read_db
+from myblog.replica import get_replica
+from myblog.replica import replicate_forever
+from myblog.replica import snapshot
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    path = str(tmp_path / "replica.sqlite")
+    app.config["READ_REPLICA"] = path
+    snapshot(app.config["DATABASE"], path, pages=1)
+    return path
+
+
+def test_disabled_reads_primary(app):
+    with app.app_context():
+        assert get_read_db() is get_db()
+
+
+def test_reads_from_replica(app, replica):
+    with app.test_request_context("/"):
+        db = get_read_db()
+        assert db is not get_db()
+        assert db.execute("SELECT title FROM blog").fetchone()["title"] == "test title"
+
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("DELETE FROM blog")
+
+
+def test_new_snapshot_is_picked_up(app, replica):
+    with app.test_request_context("/"):
+        first = get_replica()
+
+        get_db().execute("DELETE FROM blog")
+        get_db().commit()
+        snapshot(app.config["DATABASE"], replica, pages=1)
+
+        assert get_replica() is not first
+        assert first.pool.closed
+        assert get_read_db().execute("SELECT COUNT(*) FROM blog").fetchone()[0] == 0
+
+
+def test_stale_replica_is_skipped(app, replica):
+    app.config["REPLICA_MAX_STALENESS"] = -1
+
+    with app.test_request_context("/"):
+        assert get_read_db() is get_db()
+
+
+def test_read_your_own_writes(app, client, auth, replica):
+    auth.login()
+    auth.post("/create", data={"title": "fresh post", "body": "x", "public": "y"})
+
+    # the replica predates the write, so the author reads the primary
+    assert b"fresh post" in client.get("/").data
+
+
+def test_replica_status_command(app, runner, replica):
+    result = runner.invoke(args=["replica-status"])
+    assert "Replica lag:" in result.output
+
+
+def test_failed_snapshot_leaves_no_partial_copy(app, tmp_path, monkeypatch):
+    def full_disk(source, target):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr("os.replace", full_disk)
+    with pytest.raises(OSError):
+        snapshot(app.config["DATABASE"], str(tmp_path / "replica.sqlite"), pages=1)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replicator_survives_errors(app, monkeypatch):
+    class Stop(Exception):
+        pass
+
+    attempts = []
+
+    def failing(*args):
+        attempts.append(None)
+        raise OSError("rename failed")
+
+    def sleep(seconds):
+        if len(attempts) == 2:
+            raise Stop
+
+    monkeypatch.setattr("myblog.replica.snapshot", failing)
+    monkeypatch.setattr("time.sleep", sleep)
+
+    with app.app_context(), pytest.raises(Stop):
+        replicate_forever(app.config["DATABASE"], "replica", 5, 1, 0)
+    assert len(attempts) == 2
@@ -0,0 +1,85 @@
+import re
+
+import pytest
+
+from myblog.db import get_db
+from myblog.search import match_query
+
+
+@pytest.fixture
+def blogs(app):
+    with app.app_context():
+        db = get_db()
+        db.executescript(
+            "INSERT INTO blog (title, body, author_id, public) VALUES"
+            " ('Sourdough basics', 'flour water salt', 1, 1),"
+            " ('Weekend trip', 'we baked sourdough in the hut', 2, 1),"
+            " ('Secret sourdough', 'hidden recipe', 2, 0);"
+            "INSERT INTO comment (text, author_id, blog_id) VALUES"
+            " ('try rye sourdough too', 2, 2), ('lovely <b>mountains</b>', 1, 3);"
+        )
+
+
+def titles(response):
+    return re.findall(rb'detail">([^<]+)</a>', response.data)
+
+
+def test_search_ranks_and_filters(client, auth, blogs):
+    response = client.get("/search?search=sourdough")
+    # the title match ranks first; the private blog is not shown
+    assert titles(response) == [b"Sourdough basics", b"Weekend trip"]
+    assert b"<mark>sourdough</mark>" in response.data.lower()
+
+    auth.login("other", "other")
+    assert b"Secret sourdough" in client.get("/search?search=sourdough").data
+
+
+def test_search_comments(client, blogs):
+    response = client.get("/search?search=mountains")
+    assert titles(response) == [b"Weekend trip"]
+    # the snippet is escaped, only the highlight is markup
+    assert b"&lt;b&gt;<mark>mountains</mark>&lt;/b&gt;" in response.data
+
+
+def test_search_pagination(app, client, blogs):
+    app.config["SEARCH_RESULTS_PER_PAGE"] = 1
+    first = client.get("/search?search=sourdough")
+    cursor = re.search(rb'cursor=([^"]+)">More', first.data).group(1).decode()
+
+    second = client.get("/search?search=sourdough&cursor=" + cursor)
+    assert titles(first) + titles(second) == [b"Sourdough basics", b"Weekend trip"]
+    assert b"More matches" not in second.data
+
+
+def test_triggers_follow_changes(app, client, blogs):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE blog SET body = 'now about bread' WHERE title = 'Weekend trip'")
+        db.execute("DELETE FROM comment")
+        db.commit()
+
+    assert titles(client.get("/search?search=sourdough")) == [b"Sourdough basics"]
+    assert titles(client.get("/search?search=bread")) == [b"Weekend trip"]
+
+
+@pytest.mark.parametrize("text", ('"unbalanced', "AND OR NOT", "*", ""))
+def test_search_odd_input(client, text):
+    assert client.get("/search", query_string={"search": text}).status_code == 200
+
+
+def test_match_query():
+    assert match_query('rye "bread') == '"rye" "bread"'
+
+
+def test_reindex_command(app, runner, blogs):
+    with app.app_context():
+        db = get_db()
+        db.executescript("DELETE FROM blog_search; DELETE FROM comment_search;")
+
+    result = runner.invoke(args=["search-reindex", "--chunk-size", "2"])
+    assert "Indexed blog rows up to id 4." in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM blog_search").fetchone()[0] == 4
+        assert db.execute("SELECT COUNT(*) FROM comment_search").fetchone()[0] == 2
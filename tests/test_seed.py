@@ -0,0 +1,39 @@
+from myblog.db import get_db
+
+
+def test_seed_command(app, runner):
+    result = runner.invoke(
+        args=["seed", "--users", "5", "--blogs", "40", "--comments", "200",
+              "--public-ratio", "0.5", "--body-words", "20"]
+    )
+    assert "Added 5 users, 40 blogs and 200 comments." in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM user").fetchone()[0] == 7
+        public = db.execute("SELECT COUNT(*) FROM blog WHERE public").fetchone()[0]
+        assert 10 < public < 35
+
+        # derived data is rebuilt after the load
+        assert db.execute(
+            "SELECT COUNT(*) FROM blog WHERE comment_count !="
+            " (SELECT COUNT(*) FROM comment WHERE blog_id = blog.id)"
+        ).fetchone()[0] == 0
+        assert db.execute("SELECT COUNT(*) FROM blog_search").fetchone()[0] == 41
+        assert db.execute("SELECT COUNT(*) FROM comment_search").fetchone()[0] == 200
+
+        # comments come after their blog
+        assert db.execute(
+            "SELECT COUNT(*) FROM comment c JOIN blog b ON b.id = c.blog_id"
+            " WHERE c.created < b.created"
+        ).fetchone()[0] == 0
+
+
+def test_seeded_users_can_log_in(runner, auth):
+    runner.invoke(args=["seed", "--users", "1", "--blogs", "0", "--comments", "0"])
+    assert auth.login("user3", "password").headers["Location"] == "/"
+
+
+def test_seed_needs_blogs_for_comments(runner):
+    result = runner.invoke(args=["seed", "--blogs", "0"])
+    assert "Comments need blogs." in result.output
@@ -0,0 +1,178 @@
+import os
+import signal
+import threading
+import time
+import traceback
+import urllib.request
+
+import pytest
+
+from myblog.cache import get_response_cache
+from myblog.db import get_pool
+from myblog.serve import Arbiter
+from myblog.serve import close_connections
+from myblog.serve import make_socket
+
+
+@pytest.fixture
+def serve(app):
+    """Start a master process serving the app, returning its pid and
+    port. The app tells which worker answered on ``/pid``.
+    """
+
+    @app.route("/pid")
+    def pid():
+        return str(os.getpid())
+
+    @app.route("/slow")
+    def slow():
+        time.sleep(1)
+        return str(os.getpid())
+
+    masters = []
+
+    def start(**options):
+        sock = make_socket("127.0.0.1", 0)
+        master = os.fork()
+        if master == 0:
+            code = 0
+            try:
+                Arbiter(app, lambda: app, sock, **options).run()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+
+        port = sock.getsockname()[1]
+        sock.close()
+        masters.append(master)
+        return master, port
+
+    yield start
+
+    for master in masters:
+        try:
+            os.kill(master, signal.SIGKILL)
+            os.waitpid(master, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+def get(port, path="/pid"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as r:
+        return r.read()
+
+
+def worker_pid(port):
+    return int(get(port))
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.05)
+
+    raise AssertionError("timed out")
+
+
+def wait_exit(pid, timeout=10):
+    def exited():
+        done, status = os.waitpid(pid, os.WNOHANG)
+        return done and (status,)
+
+    return os.waitstatus_to_exitcode(wait_for(exited, timeout)[0])
+
+
+def test_close_connections(app, tmp_path):
+    app.config.update(RESPONSE_CACHE="sqlite", RESPONSE_CACHE_PATH=str(tmp_path / "c"))
+
+    with app.app_context():
+        pool = get_pool()
+        cache = get_response_cache()
+        close_connections(app)
+        assert pool.closed
+        assert cache._pool.closed
+        assert get_pool() is not pool
+        assert get_response_cache() is not cache
+
+
+def test_workers_serve_and_stop(serve):
+    master, port = serve(workers=2, threads=2, max_requests=0)
+
+    assert b"test title" in get(port, "/")
+    pids = {worker_pid(port) for _ in range(20)}
+    assert master not in pids
+
+    os.kill(master, signal.SIGTERM)
+    assert wait_exit(master) == 0
+
+
+def test_crashed_worker_is_replaced(serve):
+    master, port = serve(workers=1, threads=1, max_requests=0)
+    first = worker_pid(port)
+
+    os.kill(first, signal.SIGKILL)
+    second = wait_for(lambda: worker_pid(port) != first and worker_pid(port))
+    assert second not in (first, master)
+    assert b"test title" in get(port, "/")
+
+
+def test_max_requests_recycles_worker(serve):
+    master, port = serve(workers=1, threads=1, max_requests=3)
+
+    pids = [worker_pid(port) for _ in range(4)]
+    assert pids[:3] == [pids[0]] * 3
+    assert pids[3] != pids[0]
+
+
+def test_reload_replaces_workers(serve):
+    master, port = serve(workers=2, threads=1, max_requests=0)
+    old = {worker_pid(port) for _ in range(10)}
+
+    os.kill(master, signal.SIGHUP)
+    new = wait_for(lambda: worker_pid(port) not in old and worker_pid(port))
+    assert new != master
+    assert b"test title" in get(port, "/")
+
+
+def test_reload_finishes_requests(serve):
+    master, port = serve(workers=1, threads=1, max_requests=0)
+    old = worker_pid(port)
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(get(port, "/slow")))
+    request.start()
+    time.sleep(0.3)
+
+    os.kill(master, signal.SIGHUP)
+    request.join()
+    assert responses == [str(old).encode()]
+    assert wait_for(lambda: worker_pid(port) != old)
+
+
+def test_serve_command_options(app, runner, monkeypatch):
+    started = {}
+
+    def run(self):
+        started.update(workers=self.num_workers, threads=self.threads)
+        started.update(max_requests=self.max_requests)
+
+    monkeypatch.setattr(Arbiter, "run", run)
+    result = runner.invoke(
+        args=["serve", "--port", "0", "--workers", "3", "--threads", "2"]
+    )
+    assert "with 3 workers of 2 threads" in result.output
+    assert started == {"workers": 3, "threads": 2, "max_requests": 10000}
+    assert app.config["SERVE_WORKERS"] == 3
+
+
+def test_serve_command_checks_assets(app, runner, monkeypatch):
+    monkeypatch.setattr(Arbiter, "run", lambda self: None)
+    app.testing = False
+
+    result = runner.invoke(args=["serve", "--port", "0"])
+    assert result.exit_code == 1
+    assert "bundles aren't built. Run 'flask assets-build'" in result.output
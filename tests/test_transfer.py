@@ -0,0 +1,171 @@
+import gzip
+import json
+
+import pytest
+
+from myblog.db import get_db
+
+
+@pytest.fixture
+def content(app):
+    with app.app_context():
+        db = get_db()
+        db.executescript(
+            "INSERT INTO blog (title, body, author_id, public) VALUES"
+            " ('second', 'sourdough', 2, 1);"
+            "INSERT INTO comment (text, author_id, blog_id) VALUES"
+            " ('nice', 2, 1), ('thanks', 1, 1), ('mine', 2, 2);"
+        )
+
+
+def records(path):
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export(runner, content, tmp_path):
+    path = str(tmp_path / "dump.jsonl.gz")
+    result = runner.invoke(args=["export", path])
+    assert "Exported 2 users, 2 blogs and 3 comments." in result.output
+
+    dump = records(path)
+    assert [record["type"] for record in dump] == ["user"] * 2 + ["blog"] * 2 + [
+        "comment"
+    ] * 3
+    assert dump[2] == {
+        "type": "blog",
+        "id": 1,
+        "author_id": 1,
+        "created": "2018-01-01 00:00:00",
+        "updated": dump[2]["updated"],
+        "title": "test title",
+        "body": "test\nbody",
+        "public": 1,
+    }
+
+
+def write_dump(path, lines):
+    with open(path, "w") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+
+
+DUMP = [
+    # "test" exists already, so it is merged
+    {"type": "user", "id": 7, "username": "test", "email": "t@x", "password": "x"},
+    {"type": "user", "id": 8, "username": "new", "email": "n@x", "password": "x"},
+    {"type": "blog", "id": 5, "author_id": 8, "title": "sourdough", "body": "b",
+     "public": 1, "created": "2020-01-01 00:00:00", "updated": "2020-01-01 00:00:00"},
+    {"type": "blog", "id": 6, "author_id": 7, "title": "rye", "body": "b",
+     "public": 0, "created": "2020-01-02 00:00:00", "updated": "2020-01-02 00:00:00"},
+    # refers to a blog missing from the dump
+    {"type": "comment", "id": 1, "author_id": 7, "blog_id": 99, "text": "lost",
+     "created": "2020-01-03 00:00:00", "updated": "2020-01-03 00:00:00"},
+    {"type": "comment", "id": 2, "author_id": 7, "blog_id": 5, "text": "crumb",
+     "created": "2020-01-03 00:00:00", "updated": "2020-01-03 00:00:00"},
+]
+
+
+@pytest.mark.parametrize("defer", ("--defer", "--no-defer"))
+def test_import_remaps_ids(app, client, runner, tmp_path, defer):
+    path = str(tmp_path / "dump.jsonl")
+    write_dump(path, DUMP)
+
+    result = runner.invoke(args=["import", path, "--batch-size", "1", defer])
+    assert "Imported 1 users, 2 blogs and 1 comments, skipped 2 records." in result.output
+
+    with app.app_context():
+        db = get_db()
+        blogs = db.execute(
+            "SELECT b.id, title, username, comment_count"
+            " FROM blog b JOIN user u ON u.id = b.author_id ORDER BY b.id"
+        ).fetchall()
+        assert [tuple(blog) for blog in blogs] == [
+            (1, "test title", "test", 0),
+            (2, "sourdough", "new", 1),
+            (3, "rye", "test", 0),
+        ]
+        comment = db.execute("SELECT author_id, blog_id FROM comment").fetchone()
+        assert tuple(comment) == (1, 2)
+        # the indexes and triggers are back
+        names = {row[0] for row in db.execute("SELECT name FROM sqlite_master")}
+        assert {"blog_public_updated", "comment_blog_created", "blog_search_insert"} <= names
+        assert db.execute("SELECT COUNT(*) FROM import_deferred").fetchone()[0] == 0
+
+    # the imported text is searchable
+    assert b"sourdough" in client.get("/search?search=crumb").data
+
+    result = runner.invoke(args=["import", path])
+    assert "was already imported" in result.output
+
+
+def test_import_resumes(app, runner, tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    write_dump(path, DUMP[:4] + ["garbage"] + DUMP[4:])
+
+    result = runner.invoke(args=["import", path, "--commit-every", "3"])
+    assert "Line 5 is not a user, blog or comment record." in result.output
+
+    with app.app_context():
+        db = get_db()
+        # the first three lines were committed, the fourth rolled back
+        assert db.execute("SELECT COUNT(*) FROM user").fetchone()[0] == 3
+        assert db.execute("SELECT COUNT(*) FROM blog").fetchone()[0] == 2
+        assert db.execute("SELECT COUNT(*) FROM import_deferred").fetchone()[0] == 0
+
+    late = {"type": "user", "id": 9, "username": "late", "email": "l@x", "password": "x"}
+    write_dump(path, DUMP[:4] + [late] + DUMP[4:])
+    result = runner.invoke(args=["import", path, "--commit-every", "3"])
+    assert "Imported 1 users, 1 blogs and 1 comments, skipped 1 records." in result.output
+
+
+def test_export_import_round_trip(app, runner, content, tmp_path):
+    path = str(tmp_path / "dump.jsonl.gz")
+    runner.invoke(args=["export", path])
+
+    with app.app_context():
+        get_db().executescript("DELETE FROM comment; DELETE FROM blog; DELETE FROM user;")
+
+    result = runner.invoke(args=["import", path])
+    assert "Imported 2 users, 2 blogs and 3 comments, skipped 0 records." in result.output
+
+    with app.app_context():
+        counts = get_db().execute("SELECT id, comment_count FROM blog ORDER BY id")
+        assert [tuple(row) for row in counts] == [(3, 2), (4, 1)]
+
+
+def test_import_reports_taken_emails(app, runner, tmp_path):
+    path = str(tmp_path / "dump.jsonl")
+    write_dump(path, [
+        {"type": "user", "id": 1, "username": "copy", "email": "test@example.com",
+         "password": "x"},
+        {"type": "user", "id": 2, "username": "twin", "email": "t@x", "password": "x"},
+        {"type": "user", "id": 3, "username": "twin2", "email": "t@x", "password": "x"},
+        {"type": "blog", "id": 1, "author_id": 1, "title": "orphan", "body": "b",
+         "public": 1, "created": "2020-01-01 00:00:00",
+         "updated": "2020-01-01 00:00:00"},
+    ])
+
+    result = runner.invoke(args=["import", path])
+    assert result.exit_code == 0, result.output
+    assert "User 'copy' was skipped, the email 'test@example.com' is taken." in (
+        result.output
+    )
+    assert "User 'twin2' was skipped, the email 't@x' is taken." in result.output
+    assert "Imported 1 users, 0 blogs and 0 comments, skipped 3 records." in (
+        result.output
+    )
+
+
+def test_failed_import_skips_the_rebuild(app, runner, tmp_path, monkeypatch):
+    rebuilt = []
+    monkeypatch.setattr("myblog.transfer.reindex", lambda **kwargs: rebuilt.append(1))
+    path = str(tmp_path / "dump.jsonl")
+    write_dump(path, ["garbage"] + DUMP)
+
+    result = runner.invoke(args=["import", path])
+    assert "Line 1 is not a user, blog or comment record." in result.output
+    assert rebuilt == []
+
+    with app.app_context():
+        # the indexes and triggers are back all the same
+        assert get_db().execute("SELECT COUNT(*) FROM import_deferred").fetchone()[0] == 0
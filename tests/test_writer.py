@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from myblog.db import get_db
+from myblog.db import get_pool
+from myblog.writer import execute_write
+from myblog.writer import Writer
+from myblog.writer import get_writer
+
+
+def test_execute_write(app):
+    with app.app_context():
+        result = execute_write(
+            "INSERT INTO blog (title, body, public, author_id) VALUES ('w', 'w', 1, 1)"
+        )
+        assert result.rowcount == 1
+
+        row = get_db().execute(
+            "SELECT title FROM blog WHERE id = ?", (result.lastrowid,)
+        ).fetchone()
+        assert row["title"] == "w"
+
+
+def test_group_commit(app):
+    app.config["WRITER_BATCH_WINDOW"] = 0.05
+
+    with app.app_context():
+        writer = get_writer()
+        start = threading.Barrier(20)
+
+        def insert(n):
+            with app.app_context():
+                start.wait()
+                execute_write(
+                    "INSERT INTO comment (text, author_id, blog_id) VALUES (?, 1, 1)",
+                    (f"comment {n}",),
+                )
+
+        threads = [threading.Thread(target=insert, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert get_db().execute("SELECT COUNT(*) FROM comment").fetchone()[0] == 20
+        assert writer.stats["operations"] == 20
+        assert writer.stats["batches"] < 20
+        assert writer.stats["largest_batch"] > 1
+
+
+def test_failed_write_is_isolated(app):
+    app.config["WRITER_BATCH_WINDOW"] = 0.05
+
+    with app.app_context():
+        writer = get_writer()
+        good = writer.submit(
+            lambda db: db.execute(
+                "INSERT INTO user (username, email, password) VALUES ('a', 'a@a.a', 'x')"
+            )
+        )
+        bad = writer.submit(
+            lambda db: db.execute(
+                "INSERT INTO user (username, email, password)"
+                " VALUES ('test', 'b@b.b', 'x')"
+            )
+        )
+
+        with pytest.raises(sqlite3.IntegrityError):
+            bad.result(5)
+        good.result(5)
+
+        names = [r[0] for r in get_db().execute("SELECT username FROM user")]
+        assert "a" in names
+
+
+def test_failed_begin_fails_the_batch(app):
+    # fail at once instead of waiting for the lock
+    app.config["DATABASE_PRAGMAS"] = dict(
+        app.config["DATABASE_PRAGMAS"], busy_timeout=0
+    )
+    app.extensions.pop("myblog.db.pool").close()
+    app.config["WRITER_BATCH_WINDOW"] = 0.05
+
+    # another process holds the write lock
+    lock = sqlite3.connect(app.config["DATABASE"], isolation_level=None)
+    lock.execute("BEGIN IMMEDIATE")
+
+    try:
+        with app.app_context():
+            writer = get_writer()
+            futures = [
+                writer.submit(lambda db: db.execute("DELETE FROM blog"))
+                for _ in range(3)
+            ]
+            for future in futures:
+                with pytest.raises(sqlite3.OperationalError, match="locked"):
+                    future.result(5)
+
+            start = time.monotonic()
+            with pytest.raises(sqlite3.OperationalError):
+                execute_write("DELETE FROM blog")
+            assert time.monotonic() - start < 5
+    finally:
+        lock.rollback()
+        lock.close()
+
+
+def test_writer_survives_other_errors(app):
+    with app.app_context():
+        pool = get_pool()
+    connects = []
+
+    def connect():
+        connects.append(None)
+        if len(connects) == 1:
+            raise RuntimeError("no connection")
+        return pool.connect()
+
+    writer = Writer(connect, 0, 10)
+    with pytest.raises(RuntimeError, match="no connection"):
+        writer.submit(lambda conn: None).result(timeout=5)
+
+    # a failure in the middle of a batch drops its transaction
+    stats, writer.stats = writer.stats, None
+    with pytest.raises(TypeError):
+        writer.submit(lambda conn: None).result(timeout=5)
+    writer.stats = stats
+
+    future = writer.submit(lambda conn: conn.execute("DELETE FROM blog").rowcount)
+    assert future.result(timeout=5) == 1
+    assert len(connects) == 3
+
+
+def test_writer_disabled(app):
+    app.config["WRITER_ENABLED"] = False
+
+    with app.app_context():
+        execute_write("DELETE FROM blog")
+        assert "myblog.writer" not in app.extensions
+        assert get_db().execute("SELECT COUNT(*) FROM blog").fetchone()[0] == 0
+
+
+def test_create_view_writes(client, auth, app):
+    auth.login()
+    response = auth.post(
+        "/create", data={"title": "written", "body": "through the writer"}
+    )
+    assert response.status_code == 302
+
+    with app.app_context():
+        row = get_db().execute(
+            "SELECT body FROM blog WHERE title = 'written'"
+        ).fetchone()
+        assert row["body"] == "through the writer"